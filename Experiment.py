@@ -3,66 +3,46 @@ try:
     import simplejson as json
 except ImportError:
     import json
+import glob
+import hashlib
 import os
+import sys
 import subprocess
-import math
-import random
+import signal
 from distutils import spawn
-import pickle
 import argparse
 import shutil
 import time
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import ipaddress
-
-class TestLinkUtilization():
-    def __init__(self):
-        self.ip4net1 = ipaddress.IPv4Network('10.10.1.0/24')
-        self.ip4net2 = ipaddress.IPv4Network('10.10.2.0/24')
-        self.ip4net3 = ipaddress.IPv4Network('10.10.3.0/24')
-        self.num_addrs = 75
-        self.num_cases = 300
-        self.case_list = [None]*(self.num_cases)
-        self.ip_list = []
-        for i in range(1, self.num_addrs+1):
-            self.ip_list.append(self.ip4net1[i])
-        for i in range(1, self.num_addrs+1):
-            self.ip_list.append(self.ip4net2[i])
-        for i in range(1, self.num_addrs+1):
-            self.ip_list.append(self.ip4net3[i])
-
-    def _gen_node_pairs(self):
-        count = 0
-        total_attempts = 0
-        while count < self.num_cases:
-            total_attempts += 1
-            case = (random.choice(range(self.num_addrs*3)), random.choice(range(self.num_addrs*3)))
-            if case not in self.case_list:
-                self.case_list[count] = case
-                count += 1
-
-    def _stor_host_cases(self):
-        fl1 = open("host1-cases", "w")
-        fl2 = open("host2-cases", "w")
-        fl3 = open("host3-cases", "w")
-        for case in self.case_list:
-            ip_case = (self.ip_list[case[0]], self.ip_list[case[1]])
-            if case[0] < self.num_addrs:
-                inst = (case[0] + 1) % (self.num_addrs+1)
-                fl1.write("{0:0>3d} {1} {2}\n".format(inst, str(ip_case[0]), str(ip_case[1])))
-            elif case[0] < 2*self.num_addrs:
-                inst = (case[0] - self.num_addrs+1) % (self.num_addrs+1)
-                fl2.write("{0:0>3d} {1} {2}\n".format(inst, str(ip_case[0]), str(ip_case[1])))
-            elif case[0] < 3*self.num_addrs:
-                inst = (case[0] - (2*self.num_addrs)+1) % (self.num_addrs+1)
-                fl3.write("{0:0>3d} {1} {2}\n".format(inst, str(ip_case[0]), str(ip_case[1])))
-        fl1.close()
-        fl2.close()
-        fl3.close()
-
-    def run(self):
-        self._gen_node_pairs()
-        self._stor_host_cases()
+from fanout import FanOut, failed, format_report
+from transport import make_transport
+import seqgen
+from configgen import ConfigBuilder
+from orchestrate import Orchestrator, load_inventory, partition
+from sweep import Sweep
+from churn import ChurnScheduler, parse_models
+from convergence import ConvergenceMonitor
+from logindex import LogIndex, format_event, parse_query
+from launchctl import AdaptiveLauncher
+import overlaysim
+import cgsample
+from ctldaemon import SOCKET, ControlServer
+from pingmatrix import MatrixProber, PingMatrix
+from lurunner import LinkUtilizationRunner, read_cases
+from results import ResultStore, format_key
+from trafficgen import TrafficMatrix, case_file, parse_pattern
+import state
+import tracing
+
+def positive_float(value):
+    """ The argparse type of the options that must be greater than 0. """
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("must be greater than 0, not {0}".format(value))
+    return number
 
 class Experiment():
     __metaclass__ = ABCMeta
@@ -71,12 +51,20 @@ class Experiment():
     RANGE_END = 22
     LAUNCH_WAIT = 2
     BATCH_SZ = 10
+    READY_TIMEOUT = 120
+    READY_POLL = 0.25
+    CMD_TIMEOUT = 60
+    NUM_CASES = 300
+    STOP_DEADLINE = 10
+    STALE_AGE = 600
     VIRT = NotImplemented
     APT = spawn.find_executable("apt-get")
+    OVS = spawn.find_executable("ovs-vsctl")
     CONTAINER = NotImplemented
     BF_VIRT_IMG = "kcratie/bounded-flood:0.2"
 
-    def __init__(self, exp_dir=None):
+    @staticmethod
+    def make_parser():
         parser = argparse.ArgumentParser(description="Configures and runs Ken's PhD Experiment")
         parser.add_argument("--clean", action="store_true", default=False, dest="clean",
                             help="Removes all generated files and directories")
@@ -86,10 +74,44 @@ class Experiment():
                             help="Print experiment activity info")
         parser.add_argument("--range", action="store", dest="range",
                             help="Specifies the experiment start and end range in format #,#")
+        parser.add_argument("--seed", action="store", type=int, dest="seed",
+                            help="Seed for the startup sequence and test pairs, for reproducing "
+                            "a run")
         parser.add_argument("--run", action="store_true", default=False, dest="run",
                             help="Runs the currently configured experiment")
+        parser.add_argument("--concurrency", action="store", type=int,
+                            default=Experiment.BATCH_SZ, dest="concurrency",
+                            help="Maximum number of containers launched concurrently")
+        parser.add_argument("--push", action="store", dest="push",
+                            help="Copies the specified controller module files (comma "
+                            "separated) into every running container and restarts ipop in "
+                            "them, checking that the controller and ryu come back up")
+        parser.add_argument("--rollout", action="store", type=int, default=0, dest="rollout",
+                            help="With --push, restarts this many containers at a time and "
+                            "stops at the first batch with an unhealthy node; 0 restarts all "
+                            "at once")
+        parser.add_argument("--adaptive", action="store_true", default=False, dest="adaptive",
+                            help="Adjusts the number of concurrent launches, up to "
+                            "--concurrency, to the host's load and headroom")
+        parser.add_argument("--ready-timeout", action="store", type=float,
+                            default=Experiment.READY_TIMEOUT, dest="ready_timeout",
+                            help="Seconds to wait for a launched node to become ready")
+        parser.add_argument("--fanout", action="store", type=int, default=FanOut.CONCURRENCY,
+                            dest="fanout",
+                            help="Maximum number of containers a command is run on concurrently")
+        parser.add_argument("--timeout", action="store", type=float,
+                            default=Experiment.CMD_TIMEOUT, dest="timeout",
+                            help="Seconds before a command run in a container is abandoned")
         parser.add_argument("--end", action="store_true", default=False, dest="end",
                             help="End the currently running experiment")
+        parser.add_argument("--pool", action="store_true", default=False, dest="pool",
+                            help="Keeps a pool of booted containers with ipop stopped. On its "
+                            "own or with --configure it creates the pool, with --run it only "
+                            "starts ipop and with --end it recycles the containers")
+        parser.add_argument("--stop-deadline", action="store", type=float,
+                            default=Experiment.STOP_DEADLINE, dest="stop_deadline",
+                            help="Seconds --end waits for each graceful stage before killing "
+                            "the stragglers")
         parser.add_argument("--info", action="store_true", default=False, dest="info",
                             help="Displays the current experiment configuration")
         parser.add_argument("--setup", action="store_true", default=False, dest="setup",
@@ -101,27 +123,86 @@ class Experiment():
                             help="Uses LXC containers")
         parser.add_argument("--dkr", action="store_true", default=False, dest="dkr",
                             help="Use docker containers")
+        parser.add_argument("--netns", action="store_true", default=False, dest="netns",
+                            help="Runs each node's processes in network and mount namespaces "
+                            "of its own instead of a container. Requires run as root.")
+        parser.add_argument("--sim", action="store_true", default=False, dest="sim",
+                            help="Simulates the configured overlay instead of running containers")
+        parser.add_argument("--sim-params", action="store", dest="sim_params",
+                            help="Overrides simulation parameters. Ex sim-params=setup_max=5,"
+                            "flows=1000; one of {0}".format(", ".join(
+                                overlaysim.OverlaySimulator.DEFAULTS)))
+        parser.add_argument("--transport", action="store", default="auto", dest="transport",
+                            choices=["auto", "api", "cli"],
+                            help="Talk to the docker engine API socket or fork the docker CLI")
         parser.add_argument("--ping", action="store", dest="ping",
-                            help="Ping the specified address from each container")
+                            help="Ping the specified address from each container. matrix "
+                            "probes every node pair over the overlay addresses into "
+                            "ping-matrix.bin, failed or stale[=SECONDS] re-probe only the "
+                            "failed or failed and stale pairs of the saved matrix")
+        parser.add_argument("--probe-rate", action="store", type=positive_float,
+                            default=MatrixProber.RATE, dest="probe_rate",
+                            help="Maximum node pairs probed per second by --ping matrix")
         parser.add_argument("--arp", action="store", dest="arp",
                             help="arPing the specified address from each container")
         parser.add_argument("--ipop", action="store", dest="ipop",
                             help="Perform the specified service action: stop/start/restart")
         parser.add_argument("--churn", action="store", dest="churn",
-                            help="Restarts the specified amount of nodes in the overlay,"
-                            "one every interval")
+                            help="Churns nodes in the overlay. Ex churn=count,interval or "
+                            "';' separated models fixed:count,interval[,downtime], "
+                            "poisson:duration,mean_session,mean_offline, "
+                            "burst:duration,period,size,downtime")
+        parser.add_argument("--converge", action="store", type=float, dest="converge",
+                            help="After --run or --churn, follows the node logs until the "
+                            "overlay converges or the specified seconds pass and reports the "
+                            "time to converge")
+        parser.add_argument("--sample", action="store", dest="sample",
+                            help="Samples the cpu, memory and network use of every container "
+                            "every specified seconds in the background, across later "
+                            "invocations, until --sample stop or --end, and writes the series "
+                            "aligned with the phases run meanwhile to samples/")
+        parser.add_argument("--trace", action="store", dest="trace",
+                            help="Records phase and command spans and writes them to the "
+                            "specified file as Chrome trace-event json")
+        parser.add_argument("--hosts", action="store", dest="hosts",
+                            help="Shards the range across the hosts of the specified inventory "
+                            "file and runs the other actions on all of them. The --test cases "
+                            "are generated here over the whole range, so that they cross hosts, "
+                            "and each host runs the case file of the nodes it hosts")
+        parser.add_argument("--sweep", action="store", dest="sweep",
+                            help="Runs every point of the parameter grid in the specified json "
+                            "file through configure, run, test and end, skipping the points "
+                            "with a cached result. With --hosts the points are spread across "
+                            "the hosts of the inventory")
         parser.add_argument("--test", action="store", dest="test",
                             help="Performs latency and bandwidth test between random pairs of "
                             "nodes. Ex test=<test_name>")
-
-        self.args = parser.parse_args()
-        self.range_end = Experiment.RANGE_END
-        self.range_start = Experiment.RANGE_START
-        if self.args.range:
-            rng = self.args.range.rsplit(",", 2)
-            self.range_end = int(rng[1])
-            self.range_start = int(rng[0])
-
+        parser.add_argument("--results", action="store", dest="results",
+                            choices=["node", "pair", "run"],
+                            help="Ingests new ping/iperf results and summarizes them per node, "
+                            "host pair or run")
+        parser.add_argument("--logs", action="store", dest="logs",
+                            help="Indexes the node logs and prints the matching events of all "
+                            "nodes in time order. Ex logs=link-down|error[,start[,end]] with "
+                            "epoch or 'YYYY-MM-DD HH:MM:SS' times")
+        parser.add_argument("--daemon", action="store_true", default=False, dest="daemon",
+                            help="Serves later invocations made through expctl.py from this "
+                            "process over {0} in the experiment dir, keeping the experiment "
+                            "state and runtime connections in memory".format(SOCKET))
+        parser.add_argument("--cases", action="store", dest="cases",
+                            help="Runs the test cases listed in the specified host case file "
+                            "instead of generating new ones")
+        parser.add_argument("--traffic", action="store", dest="traffic",
+                            help="Generates the link utilization test cases of the range with "
+                            "the specified pattern into a <host>-cases file per host, split "
+                            "by the --hosts inventory if given; also the pattern --test uses. "
+                            "One of uniform, permutation, hotspot[=HOT[/FRACTION]], ring")
+        parser.add_argument("--num-cases", action="store", type=int,
+                            default=Experiment.NUM_CASES, dest="num_cases",
+                            help="Number of link utilization test cases to generate")
+        return parser
+
+    def __init__(self, exp_dir=None, argv=None, args=None):
         self.exp_dir = exp_dir
         if not self.exp_dir:
             self.exp_dir = os.path.abspath(".")
@@ -134,31 +215,112 @@ class Experiment():
         self.config_file_base = "{0}/config-".format(self.config_dir)
         self.seq_file = "{0}/startup.list".format(self.exp_dir)
         self.range_file = "{0}/range_file".format(self.exp_dir)
-
-        if not self.args.range and os.path.isfile("range_file"):
+        self.results_dir = "{0}/results".format(self.exp_dir)
+        self.matrix_file = "{0}/ping-matrix.bin".format(self.exp_dir)
+        self.state_file = "{0}/experiment.db".format(self.exp_dir)
+        self.sample_dir = "{0}/samples".format(self.exp_dir)
+        self._state = None
+        self._cfg_builder = None
+        self._cfg_key = None
+        self._seq_cache = None
+        self.load_args(args if args is not None else Experiment.make_parser().parse_args(argv))
+
+    def load_args(self, args):
+        """ Takes the arguments of an invocation, so a long-lived experiment can serve many. """
+        self.args = args
+        # failed nodes, cases or hosts of the invocation, which make it exit non-zero
+        self.failures = 0
+        self.range_end = Experiment.RANGE_END
+        self.range_start = Experiment.RANGE_START
+        if self.args.range:
+            rng = self.args.range.rsplit(",", 2)
+            self.range_end = int(rng[1])
+            self.range_start = int(rng[0])
+        elif os.path.isfile(self.range_file):
             with open(self.range_file) as rng_fle:
                 rng = rng_fle.read().strip().rsplit(",", 2)
                 self.range_end = int(rng[1])
                 self.range_start = int(rng[0])
         self.total_inst = self.range_end - self.range_start
         self.seq_list = [None] * self.total_inst
+        self.seed = self.args.seed
 
     @classmethod
-    def runshell(cls, cmd):
+    def runshell(cls, cmd, timeout=None):
         """ Run a shell command. if fails, raise an exception. """
         if cmd[0] is None:
             raise ValueError("No executable specified to run")
-        resp = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with tracing.cmd_span("subprocess", os.path.basename(cmd[0]), cmd) as spn:
+            resp = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  timeout=timeout)
+            spn.set(rc=resp.returncode)
         return resp
 
     @property
-    @abstractmethod
+    def state(self):
+        if self._state is None:
+            self._state = state.StateStore(self.state_file)
+        return self._state
+
+    def fanout(self):
+        return FanOut(self.args.fanout, self.args.timeout)
+
+    @contextmanager
+    def phase(self, name):
+        """ Spans an action, and records it as a phase of the running resource sampler. """
+        start = time.time()
+        with tracing.span(name, "phase"):
+            yield
+        if cgsample.active(self.sample_dir):
+            cgsample.record_phase(self.sample_dir, name, start, time.time())
+
+    def start_sampler(self, interval): # pylint: disable=unused-argument
+        print("Resource sampling is not supported by this experiment")
+
+    def warm_pool(self): # pylint: disable=no-self-use
+        """ Returns the launch results, or None when the backend keeps no pool. """
+        print("--pool is only supported by the docker backend")
+        return None
+
+    def stop_sampler(self):
+        out = cgsample.stop(self.sample_dir)
+        if out is None:
+            return
+        with open(out) as sfl:
+            print(cgsample.summarize(json.load(sfl)))
+        print("Resource samples written to {0}".format(out))
+
+    def report(self, label, results):
+        if self.args.verbose:
+            for res in results:
+                print("node-{0:03} rc={1} {2:.2f}s\n{3}".format(
+                    res.node, res.returncode, res.duration,
+                    (res.stdout if res.returncode == 0 else res.stderr).decode("utf-8")))
+        self.failures += len(failed(results))
+        print(format_report(label, results))
+
+    @property
+    def cfg_builder(self):
+        stat = os.stat(self.template_file)
+        # a long-lived experiment recompiles the template only once it has changed
+        if self._cfg_builder is None or self._cfg_key != (stat.st_mtime_ns, stat.st_size):
+            self._cfg_key = (stat.st_mtime_ns, stat.st_size)
+            self._cfg_builder = ConfigBuilder(self.template_file, self.template_bf_file,
+                                              self.config_dir, self.config_file_base)
+        return self._cfg_builder
+
     def gen_config(self, range_start, range_end):
-        pass
+        summary = self.cfg_builder.build(range_start, range_end)
+        print("{total} config file(s) generated, {written} written, {skipped} unchanged "
+              "in {elapsed:.3f}s (render {render_time:.3f}s, write {write_time:.3f}s)"
+              .format(**summary))
+        return summary
 
     @property
     @abstractmethod
-    def start_instance(self, instance):
+    def start_instance(self, instance, warm=False):
+        """ Launches the instance, or with warm only starts ipop in its already booted pool
+        container. """
         pass
 
     @property
@@ -166,6 +328,23 @@ class Experiment():
     def end(self):
         pass
 
+    def probe_instance(self, instance): # pylint: disable=unused-argument,no-self-use
+        """ Returns True when the instance is up and its ipop service is running. """
+        return True
+
+    def running_instances(self): # pylint: disable=no-self-use
+        """ Returns the set of instances whose container is running, or None if unknown. """
+        return None
+
+    def reconcile(self):
+        """ Folds the runtime's view into the state store with one bulk query. Returns False,
+        leaving the store as is, when the runtime could not be listed. """
+        running = self.running_instances()
+        if running is None:
+            return False
+        self.state.reconcile(running)
+        return True
+
     def clean_config(self):
         if os.path.isdir(self.config_dir):
             shutil.rmtree(self.config_dir)
@@ -178,6 +357,14 @@ class Experiment():
 
     def make_clean(self):
         self.clean_config()
+        if self._state is not None:
+            self._state.close()
+            self._state = None
+        for fle in (self.state_file, self.state_file + "-wal", self.state_file + "-shm"):
+            if os.path.isfile(fle):
+                os.remove(fle)
+                if self.args.verbose:
+                    print("Removed file {}".format(fle))
         if os.path.isdir(self.logs_dir):
             shutil.rmtree(self.logs_dir)
             if self.args.verbose:
@@ -192,47 +379,108 @@ class Experiment():
             rng_fle.write(self.args.range)
         self.gen_config(self.range_start, self.range_end)
         self.gen_rand_seq()
+        self.reconcile()
+        self.state.set_observed(self.state.select(self.seq_list, state.UP, include=False),
+                                state.CONFIGURED)
 
     def gen_rand_seq(self):
-        count = 0
-        total_attempts = 0
-        while count < self.total_inst:
-            total_attempts += 1
-            inst = math.floor(random.uniform(self.range_start, self.range_end))
-            if inst not in self.seq_list:
-                self.seq_list[count] = inst
-                count += 1
-
-        with open(self.seq_file, "wb") as seq_fle:
-            pickle.dump(self.seq_list, seq_fle)
-            seq_fle.flush()
+        if self.seed is None:
+            self.seed = seqgen.new_seed()
+        self.seq_list = list(seqgen.gen_sequence(self.range_start, self.range_end, self.seed))
+        seqgen.write_sequence(self.seq_file, self.seq_list, self.seed)
         if self.args.verbose:
-            print("Startup sequence generated, {0} entries, {1} total attempts\n{2}"
-                  .format(self.total_inst, total_attempts, self.seq_list))
+            print("Startup sequence generated, {0} entries, seed {1}\n{2}"
+                  .format(self.total_inst, self.seed, self.seq_list))
 
     def load_seq_list(self):
         if os.path.isfile(self.seq_file):
-            with open(self.seq_file, "rb") as seq_fle:
-                self.seq_list = pickle.load(seq_fle)
-                if len(self.seq_list) != self.total_inst:
-                    print("Warning: the number of entries in sequence list does not match the "
-                          "configured experiment range. {0}!={1}".
-                          format(len(self.seq_list), self.total_inst))
+            stat = os.stat(self.seq_file)
+            # a long-lived experiment rereads the file only once it has changed
+            if self._seq_cache is None or self._seq_cache[0] != (stat.st_mtime_ns, stat.st_size):
+                try:
+                    self._seq_cache = ((stat.st_mtime_ns, stat.st_size),) + \
+                        tuple(seqgen.read_sequence(self.seq_file))
+                except ValueError as err:
+                    print("Warning: {0}, generating a new one".format(err))
+                    self._seq_cache = None
+                    self.gen_rand_seq()
+                    return
+            seed = self._seq_cache[2]
+            self.seq_list = list(self._seq_cache[1])
+            if self.seed is None:
+                self.seed = seed
+            if len(self.seq_list) != self.total_inst:
+                print("Warning: the number of entries in sequence list does not match the "
+                      "configured experiment range. {0}!={1}".
+                      format(len(self.seq_list), self.total_inst))
             if self.args.verbose:
-                print("Sequence list loaded from existing file -  {0} entries\n{1}".
-                      format(len(self.seq_list), self.seq_list))
+                print("Sequence list loaded from existing file -  {0} entries, seed {1}\n{2}".
+                      format(len(self.seq_list), seed, self.seq_list))
         else:
             self.gen_rand_seq()
 
-    def start_range(self, num, wait):
-        cnt = 0
-        sequence = self.seq_list
-        for inst in sequence:
-            self.start_instance(inst)
-            cnt += 1
-            if cnt % num == 0 and cnt < len(sequence):
-                time.sleep(wait)
-        print("{0} container(s) instantiated".format(cnt))
+    def wait_ready(self, instance, timeout):
+        deadline = time.monotonic() + timeout
+        delay = Experiment.READY_POLL
+        while True:
+            if self.probe_instance(instance):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, Experiment.LAUNCH_WAIT)
+
+    def _launch(self, instance, timeout, warm=False):
+        started = time.monotonic()
+        self.state.set_observed([instance], state.LAUNCHING)
+        with tracing.span("launch", "instance", instance=instance, warm=warm) as spn:
+            resp = self.start_instance(instance, warm)
+            if resp is not None and resp.returncode != 0:
+                spn.set(ready=False)
+                self.state.set_observed([instance], state.STOPPED)
+                return instance, False, time.monotonic() - started
+            with tracing.span("wait_ready", "instance", instance=instance):
+                ready = self.wait_ready(instance, timeout)
+            spn.set(ready=ready)
+        self.state.set_observed([instance], state.IPOP_ACTIVE if ready else state.RUNNING)
+        return instance, ready, time.monotonic() - started
+
+    def start_range(self, num, timeout, sequence=None):
+        """ Launch the startup sequence with at most num launches in flight. A launch slot is
+        released as soon as its node probes ready, or when timeout seconds have elapsed. With
+        --adaptive num is the upper bound of a limit that follows the host's load. """
+        if sequence is None:
+            sequence = self.seq_list
+        started = time.monotonic()
+        # read before the launches mark their instances as launching
+        warm = set(self.state.select(sequence, (state.WARM,))) if self.args.pool else set()
+        launcher = None
+        if self.args.adaptive:
+            running = sum(1 for obs in self.state.observed().values() if obs in state.UP)
+            launcher = AdaptiveLauncher(lambda inst: self._launch(inst, timeout, inst in warm),
+                                        num, running=running)
+            results = launcher.run(sequence)
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, num)) as pool:
+                results = list(pool.map(lambda inst: self._launch(inst, timeout, inst in warm),
+                                        sequence))
+        elapsed = time.monotonic() - started
+        latencies = sorted(lat for _, ready, lat in results if ready)
+        not_ready = ["node-{0:03}".format(inst) for inst, ready, _ in results if not ready]
+        self.failures += len(not_ready)
+        if self.args.verbose:
+            for inst, ready, lat in results:
+                print("node-{0:03} {1} in {2:.2f}s".format(inst, "ready" if ready else "NOT READY",
+                                                          lat))
+        print("{0} container(s) instantiated in {1:.2f}s ({2:.2f}/s), {3} not ready {4}"
+              .format(len(results), elapsed, len(results) / elapsed if elapsed else 0,
+                      len(not_ready), not_ready))
+        if latencies:
+            print("launch latency min {0:.2f}s median {1:.2f}s max {2:.2f}s"
+                  .format(latencies[0], latencies[len(latencies) // 2], latencies[-1]))
+        if launcher:
+            print(launcher.summary())
+        return results
 
     def run(self):
         if not os.path.isdir(self.config_dir):
@@ -246,7 +494,15 @@ class Experiment():
         #if os.path.isdir(self.logs_dir):
         #    shutil.rmtree(self.logs_dir)
 
-        self.start_range(Experiment.BATCH_SZ, Experiment.LAUNCH_WAIT)
+        self.state.set_desired(self.seq_list, state.RUNNING)
+        sequence = self.seq_list
+        if self.reconcile():
+            sequence = self.state.select(self.seq_list, state.UP, include=False)
+            if len(sequence) < len(self.seq_list):
+                print("{0} instance(s) already running, launching the remaining {1}"
+                      .format(len(self.seq_list) - len(sequence), len(sequence)))
+        if sequence:
+            self.start_range(self.args.concurrency, self.args.ready_timeout, sequence)
 
     def display_current_config(self):
         print("----Experiment Configuration----")
@@ -267,91 +523,252 @@ class Experiment():
                   resp.stderr.decode("utf-8"))
 
     @abstractmethod
-    def run_container_cmd(self, cmd_line, instance_num):
+    def run_container_cmd(self, cmd_line, instance_num, timeout=None):
         pass
 
     def churn(self, param):
-        params = self.args.range.rsplit(",", 2)
-        cc = int(params[0])
-        inval = int(params[1])
-        self._churn(cc, inval)
-
-    def _churn(self, churn_count=0, interval=30):
-        if churn_count == 0:
-            churn_count = self.range_end - self.range_start
-        sequence = self.seq_list
-        cnt = 0
-        for inst in sequence:
-            if cnt >= churn_count:
-                return
-            self.run_container_cmd(["systemctl", "stop", "ipop"], inst)
-            time.sleep(interval)
-            self.run_container_cmd(["systemctl", "start", "ipop"], inst)
-            cnt += 1
+        """ Returns 2, the usage error status, when the churn spec does not parse. """
+        self.load_seq_list()
+        try:
+            models = parse_models(param, self.seq_list)
+        except ValueError as err:
+            print(err)
+            return 2
+        sched = ChurnScheduler(self._churn_action, models, self.seed)
+        timeline = sched.run()
+        self.failures += sum(1 for rec in timeline if not rec.suppressed and rec.returncode != 0)
+        timeline_file = "{0}/churn-{1}.csv".format(self.exp_dir, time.strftime("%Y%m%d-%H%M%S"))
+        sched.write_timeline(timeline_file)
+        print(sched.summary())
+        print("Churn timeline written to {0}".format(timeline_file))
+        return 0
+
+    def convergence_monitor(self, seed=False):
+        """ Starts following the node logs from their current end, with seed after reading the
+        links the running nodes already have up. """
+        monitor = ConvergenceMonitor(self.logs_dir, range(self.range_start, self.range_end))
+        monitor.mark(seed)
+        return monitor
+
+    def await_convergence(self, monitor, timeout):
+        monitor.wait(timeout)
+        print(monitor.report())
+
+    def _churn_action(self, instance, action):
+        return self.run_container_cmd(["systemctl", action, "ipop"], instance, self.args.timeout)
 
     def run_test(self, test_name):
-        test = None
-        if test_name == "linkutilization" or test_name == "lu":
-            test = TestLinkUtilization()
-        test.run()
+        """ Returns 2, the usage error status, for an unknown test or traffic pattern. """
+        if test_name not in ("linkutilization", "lu"):
+            print("Invalid test specified, only accepts linkutilization/lu")
+            return 2
+        if self.args.cases:
+            cases = read_cases(self.args.cases)
+        else:
+            try:
+                host_cases = self.gen_traffic()
+            except ValueError as err:
+                print(err)
+                return 2
+            cases = [case for cases in host_cases.values() for case in cases]
+        runner = LinkUtilizationRunner(self.run_container_cmd, self.data_dir, self.args.fanout,
+                                       self.args.timeout, self.args.verbose)
+        self.failures += len(failed(runner.run(cases)))
+        return 0
+
+    def gen_traffic(self, inventory_file=None):
+        """ Generates the test cases of the range over the overlay addresses the node configs
+        are built with, and writes them to a case file per host of the inventory, or to
+        host1-cases without one. Returns {host name: [Case]}. """
+        pattern, params = parse_pattern(self.args.traffic or "uniform")
+        if inventory_file:
+            layout = [(host.name, start, end) for host, start, end in
+                      partition(self.range_start, self.range_end, load_inventory(inventory_file))]
+        else:
+            layout = [("host1", self.range_start, self.range_end)]
+        nodes = range(self.range_start, self.range_end)
+        addresses = [self.cfg_builder.node_values(node)["IP4"].split("/")[0] for node in nodes]
+        seed = self.seed if self.seed is not None else seqgen.new_seed()
+        mtx = TrafficMatrix(nodes, addresses, layout, seed)
+        mtx.generate(pattern, self.args.num_cases, **params)
+        paths = mtx.write(self.exp_dir)
+        print("{0} {1}".format(pattern, mtx.summary()))
+        if self.args.verbose:
+            print("Cases written to {0}".format(", ".join(sorted(paths.values()))))
+        return mtx.host_cases()
+
+    def exec_on_range(self, cmd_line, instances):
+        """ Runs cmd_line in each of the instances' containers concurrently and returns a
+        NodeResult per instance. """
+        return self.fanout().run(
+            lambda inst, timeout: self.run_container_cmd(cmd_line, inst, timeout), instances)
+
+    def run_ping(self, target_address):
+        if target_address in ("matrix", "failed") or target_address.startswith("stale"):
+            return self.ping_matrix(target_address)
+        results = self.exec_on_range(["ping", "-c1", target_address],
+                                     range(self.range_start, self.range_end))
+        self.report("ping {0}".format(target_address), results)
+        return results
+
+    def run_arp(self, target_address):
+        results = self.exec_on_range(["arping", "-C1", target_address],
+                                     range(self.range_start, self.range_end))
+        self.report("arping {0}".format(target_address), results)
+        return results
+
+    def run_svc_ctl(self, svc_ctl):
+        if svc_ctl not in ("stop", "start", "restart"):
+            print("Invalid service control specified, only accepts start/stop/restart")
+            return
+        self.load_seq_list()
+        sequence = self.seq_list
+        if self.reconcile():
+            # only running containers can take the action, and start skips active services
+            sequence = self.state.select(
+                self.seq_list, (state.RUNNING,) if svc_ctl == "start" else state.UP)
+        cmd_line = ["systemctl", svc_ctl, "ipop"]
+        results = self.exec_on_range(cmd_line, sequence)
+        self.report(cmd_line, results)
+        done = [res.node for res in results if res.returncode == 0]
+        self.state.set_observed(done, state.RUNNING if svc_ctl == "stop" else state.IPOP_ACTIVE)
+        return results
+
+    def ping_matrix(self, mode):
+        """ Probes the node pairs selected by mode (matrix, failed or stale[=SECONDS]) over
+        their overlay addresses and updates the saved matrix. """
+        mode, _, max_age = mode.partition("=")
+        mode = "all" if mode == "matrix" else mode
+        count = self.range_end - self.range_start
+        mtx = PingMatrix.load(self.matrix_file, self.range_start, count)
+        cells = mtx.select(mode, float(max_age or Experiment.STALE_AGE))
+        addresses = [self.cfg_builder.node_values(mtx.node(idx))["IP4"].split("/")[0]
+                     for idx in range(count)]
+        prober = MatrixProber(lambda inst, cmd, timeout: self.run_container_cmd(cmd, inst,
+                                                                                timeout),
+                              addresses, self.args.fanout, self.args.probe_rate,
+                              self.args.timeout)
+        started = time.monotonic()
+        try:
+            prober.probe(mtx, cells)
+        finally:
+            mtx.save(self.matrix_file)
+        elapsed = time.monotonic() - started
+        if self.args.verbose:
+            for src, dst, loss in mtx.failures():
+                print("node-{0:03} -> node-{1:03} {2:.0%} loss".format(src, dst, loss))
+        print(mtx.summary())
+        print("{0} pair(s) probed in {1} exec(s), {2} failed, in {3:.2f}s ({4:.1f} pairs/s), "
+              "matrix saved to {5}".format(len(cells), prober.execs, prober.exec_failures,
+                                           elapsed, len(cells) / elapsed if elapsed else 0.0,
+                                           self.matrix_file))
+        return mtx
+
+    def search_logs(self, spec):
+        """ Returns 2, the usage error status, when the query does not parse. """
+        try:
+            types, start, end = parse_query(spec)
+        except ValueError as err:
+            print("Invalid log query {0}: {1}".format(spec, err))
+            return 2
+        index = LogIndex(self.logs_dir)
+        started = time.monotonic()
+        files, added = index.update()
+        indexed = time.monotonic()
+        count = 0
+        for event in index.query(types, start, end):
+            print(format_event(event))
+            count += 1
+        print("{0} event(s) from {1} log file(s), {2} new record(s) indexed in {3:.2f}s, "
+              "queried in {4:.2f}s".format(count, files, added, indexed - started,
+                                          time.monotonic() - indexed))
+        return 0
+
+    def summarize_results(self, group):
+        store = ResultStore(self.results_dir)
+        started = time.monotonic()
+        case_files = set(glob.glob(case_file(self.exp_dir, "*")))
+        if self.args.cases:
+            case_files.add(os.path.abspath(self.args.cases))
+        cases = [(case.src, case.dst) for path in sorted(case_files) for case in read_cases(path)]
+        added = store.ingest([os.path.join(self.data_dir, LinkUtilizationRunner.PING_LOG)],
+                             [os.path.join(self.data_dir, LinkUtilizationRunner.IPERF_LOG)],
+                             cases=cases)
+        ingested = time.monotonic()
+        runs = store.meta["runs"]
+        for metric, unit, scale in (("rtt_avg", "ms", 1), ("loss", "%", 1),
+                                    ("bandwidth", "Mbps", 1e-6)):
+            print("---- {0} ({1}) per {2}: count p50 p90 p99 ----".format(metric, unit, group))
+            for key, count, pcts in store.aggregate(metric, group):
+                print("{0} {1} {2}".format(format_key(key, group, runs), count,
+                                           " ".join("{0:.3f}".format(pct * scale)
+                                                    for pct in pcts)))
+        print("{0} new result(s) ingested in {1:.2f}s, {2} total, summarized in {3:.2f}s"
+              .format(added, ingested - started, store.meta["rows"],
+                      time.monotonic() - ingested))
 
 class DockerExperiment(Experiment):
     VIRT = spawn.find_executable("docker")
     CONTAINER = "ipop-dkr{0}"
-
-    def __init__(self, exp_dir=None):
-        super().__init__(exp_dir=exp_dir)
+    HALT_SIGNAL = "SIGRTMIN+3"
+    MODULES_DIR = "/opt/ipop-vpn/controller/modules/"
+    # $1 is the staged module dir as seen in the container, the steps of bf-update.yml
+    PUSH_SCRIPT = ('set -e; systemctl stop ipop; systemctl restart openvswitch-switch; '
+                   'rm -f /var/log/ipop-vpn/bf.log; cp -f "$1"/* {0}; '
+                   'systemctl start --no-block ipop'.format(MODULES_DIR))
+    # the bracketed patterns keep pgrep from matching this sh -c command line itself
+    HEALTH_CHECK = ["sh", "-c", "pgrep -f '[c]ontroller.Controller' >/dev/null && "
+                    "pgrep -f '[r]yu-manager' >/dev/null"]
+    HEALTH_SETTLE = 2.0
+
+    def __init__(self, exp_dir=None, argv=None, args=None):
+        super().__init__(exp_dir=exp_dir, argv=argv, args=args)
         self.network_name = "dkrnet"
+        self._transport = None
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = make_transport(self.args.transport, DockerExperiment.VIRT)
+        return self._transport
+
+    def running_instances(self):
+        names = self.transport.list_running(DockerExperiment.CONTAINER.format(""))
+        if names is None:
+            return None
+        prefix = DockerExperiment.CONTAINER.format("")
+        return set(int(name[len(prefix):]) for name in names
+                   if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+    def start_sampler(self, interval):
+        self.stop_sampler()
+        prefix = DockerExperiment.CONTAINER.format("")
+
+        def make_sampler():
+            transport = make_transport(self.args.transport, DockerExperiment.VIRT)
+            return cgsample.ResourceSampler(lambda: transport.list_running(prefix),
+                                            transport.pids, interval)
+        pid = cgsample.start(self.sample_dir, make_sampler)
+        print("Sampling container resources every {0}s (pid {1})".format(interval, pid))
 
     #def configure(self):
     #    super().configure()
     #    self.pull_image()
 
     def create_network(self):
-        #netid=docker network ls | grep dkrnet | awk 'BEGIN { FS=" "} {print $2}'
-        #docker network create dkrnet
-        pass
+        resp = self.transport.ensure_network(self.network_name)
+        if resp.returncode != 0:
+            print(resp.stderr.decode("utf-8"))
 
-    def gen_config(self, range_start, range_end):
-        with open(self.template_file) as cfg_tmpl:
-            template = json.load(cfg_tmpl)
-        olid = template["CFx"].get("Overlays", None)
-        olid = olid[0]
-        node_id = template["CFx"].get("NodeId", "a000###feb6040628e5fb7e70b04f###")
-        node_name = template["OverlayVisualizer"].get("NodeName", "dkr###")
-        netwk = template["BridgeController"]["Overlays"][olid].get("IP4", "10.10.1.0/24")
-        netwk = ipaddress.IPv4Network(netwk)
-        for val in range(range_start, range_end):
-            rng_str = "{0:03}".format(val)
-            cfg_file = "{0}{1}.json".format(self.config_file_base, rng_str)
-            node_id = "{0}{1}{2}{1}{3}".format(node_id[:4], rng_str, node_id[7:29], node_id[32:])
-            node_name = "{0}{1}".format(node_name[:3], rng_str)
-            node_ip = str(netwk[val])
-            #node_ip = "{0}{1}".format(node_ip[:10], val) 
-
-            template["CFx"]["NodeId"] = node_id
-            template["OverlayVisualizer"]["NodeName"] = node_name
-            template["BridgeController"]["Overlays"][olid]["IP4"] = node_ip
-            os.makedirs(self.config_dir, exist_ok=True)
-            with open(cfg_file, "w") as cfg_fle:
-                json.dump(template, cfg_fle, indent=2)
-                cfg_fle.flush()
-        if self.args.verbose:
-            print("{0} config file(s) generated".format(range_end-range_start))
-        self.gen_bf_config()
-
-    def gen_bf_config(self):
-        with open(self.template_bf_file) as cfg_tmpl:
-            template = json.load(cfg_tmpl)
-            cfg_file = "{0}{1}.json".format(self.config_file_base, "bf-cfg")
-            with open(cfg_file, "w") as cfg_fle:
-                json.dump(template, cfg_fle, indent=2)
-                cfg_fle.flush()
-
-        if self.args.verbose:
-            print("BoundedFlood config file(s) generated")
-
-    def start_instance(self, instance):
+    def run(self):
+        self.create_network()
+        super().run()
+
+    def start_instance(self, instance, warm=False):
+        if warm:
+            return self.run_container_cmd(["systemctl", "start", "ipop"], instance,
+                                          self.args.timeout)
+        inst_num = instance
         instance = "{0:03}".format(instance)
         container = DockerExperiment.CONTAINER.format(instance)
         log_dir = "{0}/dkr{1}".format(self.logs_dir, instance)
@@ -359,43 +776,33 @@ class DockerExperiment(Experiment):
 
         cfg_file = "{0}{1}.json".format(self.config_file_base, instance)
         if not os.path.isfile(cfg_file):
-            self.gen_config(instance, instance+1)
+            self.gen_config(inst_num, inst_num+1)
 
         mount_cfg = "{0}:/etc/opt/ipop-vpn/config.json".format(cfg_file)
         mount_log = "{0}/:/var/log/ipop-vpn/".format(log_dir)
         mount_data = "{0}/:/var/ipop-vpn/".format(self.data_dir)
-        args = ["--rm", "--privileged"]
-        opts = "-d"
-        img = Experiment.BF_VIRT_IMG
-        cmd = "/sbin/init"
         bf_cfg_file = "{0}{1}.json".format(self.config_file_base, "bf-cfg")
         mount_bf_cfg = "{0}:/etc/opt/ipop-vpn/bf-cfg.json".format(bf_cfg_file)
-        cmd_list = [DockerExperiment.VIRT, "run", opts, "-v", mount_cfg, "-v", mount_log, "-v",
-                    mount_bf_cfg, "-v", mount_data, args[0], args[1], "--name", container,
-                    "--network", self.network_name, img, cmd]
+        resp = self.transport.run(container, Experiment.BF_VIRT_IMG, "/sbin/init",
+                                  binds=[mount_cfg, mount_log, mount_bf_cfg, mount_data],
+                                  network=self.network_name, privileged=True, auto_remove=True)
         if self.args.verbose:
-            print(cmd_list)
-        resp = Experiment.runshell(cmd_list)
+            print(resp.args)
         print(resp.stdout.decode("utf-8") if resp.returncode == 0 else resp.stderr.decode("utf-8"))
+        return resp
 
-    def run_container_cmd(self, cmd_line, instance_num):
-        #report = dict(fail_count=0, fail_node=[])
-        cmd_list = [DockerExperiment.VIRT, "exec", "-it"]
-        inst = "{0:03}".format(instance_num)
-        container = DockerExperiment.CONTAINER.format(inst)
-        cmd_list.append(container)
-        cmd_list += cmd_line
-        resp = Experiment.runshell(cmd_list)
-        #if self.args.verbose:
-        #    print(cmd_list)
-        #    print(resp.stdout.decode("utf-8"))
-        #if resp.returncode != 0:
-        #    report["fail_count"] += 1
-        #    report["fail_node"].append("node-{0}".format(inst))
-        #rpt_msg = "{0}: {1}/{2} failed\n{3}".format(cmd_line, report["fail_count"],
-        #                                            self.range_end - self.range_start,
-        #                                            report["fail_node"])
-        #print(rpt_msg)
+    def probe_instance(self, instance):
+        container = DockerExperiment.CONTAINER.format("{0:03}".format(instance))
+        if not self.transport.running(container):
+            return False
+        # ipop is a oneshot unit whose start script stays in the foreground, so activating
+        # already means the controller processes have been spawned
+        resp = self.run_container_cmd(["systemctl", "is-active", "ipop"], instance)
+        return resp.stdout.strip() in (b"active", b"activating")
+
+    def run_container_cmd(self, cmd_line, instance_num, timeout=None):
+        container = DockerExperiment.CONTAINER.format("{0:03}".format(instance_num))
+        return self.transport.exec(container, cmd_line, timeout)
 
     #def run_cmd_on_range(self, cmd_line):
     #    report = dict(fail_count=0, fail_node=[])
@@ -418,104 +825,589 @@ class DockerExperiment(Experiment):
     #    print(rpt_msg)
 
     def run_cmd_on_range(self, cmd_line):
-        report = dict(fail_count=0, fail_node=[])
         self.load_seq_list()
-        for inst in self.seq_list:
-            cmd_list = [DockerExperiment.VIRT, "exec", "-it"]
-            inst = "{0:03}".format(inst)
-            container = DockerExperiment.CONTAINER.format(inst)
-            cmd_list.append(container)
-            cmd_list += cmd_line
-            resp = Experiment.runshell(cmd_list)
-            if self.args.verbose:
-                print(cmd_list)
-                print(resp.stdout.decode("utf-8"))
-            if resp.returncode != 0:
-                report["fail_count"] += 1
-                report["fail_node"].append("node-{0}".format(inst))
-        rpt_msg = "{0}: {1}/{2} failed\n{3}".format(cmd_line, report["fail_count"],
-                                                    self.range_end - self.range_start,
-                                                    report["fail_node"])
-        print(rpt_msg)
-
+        results = self.exec_on_range(cmd_line, self.seq_list)
+        self.report(cmd_line, results)
+        return results
 
     def pull_image(self):
-        cmd_list = [DockerExperiment.VIRT, "pull", Experiment.BF_VIRT_IMG]
-        resp = Experiment.runshell(cmd_list)
+        resp = self.transport.pull(Experiment.BF_VIRT_IMG)
         if self.args.verbose:
             print(resp)
 
-    def stop_range(self):
+    def stop_range(self, sequence=None, sig=None):
         cnt = 0
-        cmd_list = [DockerExperiment.VIRT, "kill"]
-        sequence = self.seq_list
+        containers = []
+        if sequence is None:
+            sequence = self.seq_list
         for inst in sequence:
             cnt += 1
             inst = "{0:03}".format(inst)
             container = DockerExperiment.CONTAINER.format(inst)
-            cmd_list.append(container)
+            containers.append(container)
+        resp = self.transport.kill(containers, sig)
         if self.args.verbose:
-            print(cmd_list)
-        resp = Experiment.runshell(cmd_list)
+            print(resp.args)
         print(resp.stdout.decode("utf-8") if resp.returncode == 0 else
               resp.stderr.decode("utf-8"))
         print("{0} Docker container(s) terminated".format(cnt))
 
+    def _warm(self, instance, timeout):
+        """ Boots a pool container, waits for the ipop service it starts and stops it again. """
+        resp = self.start_instance(instance)
+        if resp.returncode != 0:
+            return resp
+        if not self.wait_ready(instance, timeout):
+            return subprocess.CompletedProcess(resp.args, 1, b"", b"not ready\n")
+        return self.run_container_cmd(["systemctl", "stop", "ipop"], instance, timeout)
+
+    def warm_pool(self):
+        """ Creates and boots the containers of the range that are not up yet, with their
+        mounts in place and ipop stopped, for --run --pool to start. """
+        self.load_seq_list()
+        self.create_network()
+        sequence = self.seq_list
+        if self.reconcile():
+            sequence = self.state.select(self.seq_list, state.UP + (state.WARM,), include=False)
+        self.state.set_observed(sequence, state.LAUNCHING)
+        started = time.monotonic()
+        results = FanOut(self.args.concurrency, self.args.ready_timeout).run(self._warm, sequence)
+        self.report("warm pool", results)
+        self.state.set_observed([res.node for res in results if res.returncode == 0], state.WARM)
+        self.state.set_observed([res.node for res in results if res.returncode != 0],
+                                state.STOPPED)
+        print("{0} pool container(s) warmed in {1:.2f}s, {2} already up".format(
+            len(results), time.monotonic() - started, len(self.seq_list) - len(sequence)))
+        return results
+
+    def recycle_pool(self, sequence, deadline):
+        """ Resets containers whose ipop has been stopped for the next run: clears the failed
+        state of the unit and deletes the ipop OVS bridges. Returns the instances that could not
+        be reset. """
+        patterns = "|".join("{0}*".format(prefix) for prefix in sorted(self.bridge_prefixes()))
+        script = ("systemctl reset-failed ipop; for br in $(ovs-vsctl list-br); do case $br in "
+                  "{0}) ovs-vsctl --if-exists del-br $br;; esac; done".format(patterns))
+        results = self.fanout().run(
+            lambda inst, _: self.run_container_cmd(
+                ["sh", "-c", script], inst, max(deadline - time.monotonic(), 0.1)), sequence)
+        if self.args.verbose:
+            self.report("recycle", results)
+        self.state.set_observed([res.node for res in results if res.returncode == 0], state.WARM)
+        return [res.node for res in results if res.returncode != 0]
+
+    def stage_push(self, files):
+        """ Copies the files to a dir of the data dir named after their digest, which every
+        container already has bind mounted under /var/ipop-vpn/. Returns that dir's path in the
+        containers. """
+        digest = hashlib.sha1()
+        for path in files:
+            digest.update(os.path.basename(path).encode("utf-8"))
+            with open(path, "rb") as src:
+                digest.update(src.read())
+        name = digest.hexdigest()[:12]
+        stage = os.path.join(self.data_dir, ".push", name)
+        os.makedirs(stage, exist_ok=True)
+        for path in files:
+            shutil.copy2(path, stage)
+        return "/var/ipop-vpn/.push/{0}".format(name)
+
+    def healthy(self, instance, timeout):
+        """ Waits for the controller and ryu processes to be up in the container, and checks
+        they are still up HEALTH_SETTLE seconds later, as a module that fails to load takes
+        ryu down shortly after it starts. """
+        deadline = time.monotonic() + timeout
+        delay = Experiment.READY_POLL
+        while self.run_container_cmd(DockerExperiment.HEALTH_CHECK, instance).returncode != 0:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, Experiment.LAUNCH_WAIT)
+        time.sleep(DockerExperiment.HEALTH_SETTLE)
+        return self.run_container_cmd(DockerExperiment.HEALTH_CHECK, instance).returncode == 0
+
+    def _push_one(self, instance, src, timeout):
+        resp = self.run_container_cmd(["sh", "-c", DockerExperiment.PUSH_SCRIPT, "push", src],
+                                      instance, timeout)
+        if resp.returncode == 0 and not self.healthy(instance, self.args.ready_timeout):
+            return subprocess.CompletedProcess(resp.args, 1, resp.stdout,
+                                               b"unhealthy after restart\n")
+        return resp
+
+    def push_code(self, paths):
+        """ Copies updated controller modules into every running container and restarts ipop
+        in them, all at once or --rollout containers at a time, health checking each. """
+        files = [path for path in paths.split(",") if path]
+        missing = [path for path in files if not os.path.isfile(path)]
+        if not files or missing:
+            print("No such module file(s) {0}".format(missing))
+            return None
+        self.load_seq_list()
+        sequence = self.seq_list
+        if self.reconcile():
+            sequence = self.state.select(self.seq_list, state.UP)
+        if not sequence:
+            print("No running instances to push to")
+            return None
+        started = time.monotonic()
+        src = self.stage_push(files)
+        batch = self.args.rollout if self.args.rollout > 0 else len(sequence)
+        results = []
+        for pos in range(0, len(sequence), batch):
+            with tracing.span("push_batch", "push", first=pos):
+                group = self.fanout().run(lambda inst, timeout: self._push_one(inst, src, timeout),
+                                          sequence[pos:pos + batch])
+            results += group
+            if failed(group) and pos + batch < len(sequence):
+                print("Rollout stopped, {0} node(s) unhealthy in the last batch, {1} not "
+                      "updated".format(len(failed(group)), len(sequence) - pos - batch))
+                break
+        self.report("push {0}".format(", ".join(os.path.basename(path) for path in files)),
+                    results)
+        self.state.set_observed([res.node for res in results if res.returncode == 0],
+                                state.IPOP_ACTIVE)
+        self.state.set_observed([res.node for res in results if res.returncode != 0],
+                                state.RUNNING)
+        print("{0} module(s) pushed to {1}/{2} node(s) in {3:.2f}s".format(
+            len(files), len(results) - len(failed(results)), len(sequence),
+            time.monotonic() - started))
+        return results
+
+    def bridge_prefixes(self):
+        """ Names of the OVS bridges the ipop controllers create, from the config templates. """
+        prefixes = set()
+        with open(self.template_file) as cfg_fle:
+            cfg = json.load(cfg_fle)
+        for overlay in cfg.get("BridgeController", {}).get("Overlays", {}).values():
+            if overlay.get("Type") == "OVS" and overlay.get("BridgeName"):
+                prefixes.add(overlay["BridgeName"])
+        if os.path.isfile(self.template_bf_file):
+            with open(self.template_bf_file) as cfg_fle:
+                name = json.load(cfg_fle).get("BridgeName")
+            if name:
+                prefixes.add(name)
+        return prefixes
+
+    def remove_bridges(self):
+        """ Deletes the leftover ipop OVS bridges on the host with a single ovs-vsctl call.
+        Returns the number removed. """
+        if Experiment.OVS is None:
+            return 0
+        resp = Experiment.runshell([Experiment.OVS, "list-br"])
+        if resp.returncode != 0:
+            return 0
+        prefixes = tuple(self.bridge_prefixes())
+        bridges = [br for br in resp.stdout.decode("utf-8").split() if br.startswith(prefixes)]
+        if not bridges:
+            return 0
+        cmd = [Experiment.OVS]
+        for bridge in bridges:
+            cmd += ["--", "--if-exists", "del-br", bridge]
+        resp = Experiment.runshell(cmd)
+        if resp.returncode != 0:
+            print(resp.stderr.decode("utf-8"))
+        return len(bridges)
+
+    def wait_stopped(self, sequence, deadline):
+        """ Polls the runtime until none of sequence is running or the deadline passes. Returns
+        the instances still running. """
+        delay = Experiment.READY_POLL
+        while True:
+            running = self.running_instances()
+            if running is None:
+                return list(sequence)
+            sequence = [inst for inst in sequence if inst in running]
+            if not sequence or time.monotonic() >= deadline:
+                return sequence
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, Experiment.LAUNCH_WAIT)
+
     def end(self):
+        """ Tears the overlay down in stages: stop ipop in every container concurrently, halt
+        the containers whose service stopped cleanly, kill those that did not or that outlive
+        the deadline, then remove the leftover OVS bridges and the container network. With
+        --pool the containers whose service stopped are recycled instead of halted and only the
+        stragglers are killed. """
         self.load_seq_list()
-        self.run_cmd_on_range(["systemctl", "stop", "ipop"])
-        self.stop_range()
+        self.state.set_desired(self.seq_list, state.STOPPED)
+        sequence = self.seq_list
+        if self.reconcile():
+            sequence = self.state.select(
+                self.seq_list, state.UP if self.args.pool else state.UP + (state.WARM,))
+        started = time.monotonic()
+        stages = []
+        if sequence:
+            cmd_line = ["systemctl", "stop", "ipop"]
+            deadline = time.monotonic() + self.args.stop_deadline
+            with tracing.span("stop_ipop", "teardown"):
+                results = self.fanout().run(
+                    lambda inst, _: self.run_container_cmd(
+                        cmd_line, inst, max(deadline - time.monotonic(), 0.1)), sequence)
+            stages.append(("stop ipop", time.monotonic() - started))
+            self.report(cmd_line, results)
+
+            mark = time.monotonic()
+            stragglers = [res.node for res in results if res.returncode != 0]
+            stopped = [res.node for res in results if res.returncode == 0]
+            if stopped and self.args.pool:
+                with tracing.span("recycle", "teardown"):
+                    stragglers += self.recycle_pool(stopped, time.monotonic() +
+                                                    self.args.stop_deadline)
+            elif stopped:
+                # systemd's halt request, the container exits once its units have stopped
+                with tracing.span("halt", "teardown"):
+                    self.transport.kill([DockerExperiment.CONTAINER.format("{0:03}".format(inst))
+                                         for inst in stopped], DockerExperiment.HALT_SIGNAL)
+                    stragglers += self.wait_stopped(stopped, time.monotonic() +
+                                                    self.args.stop_deadline)
+            stages.append(("recycle" if self.args.pool else "halt", time.monotonic() - mark))
+
+            mark = time.monotonic()
+            if stragglers:
+                with tracing.span("kill", "teardown"):
+                    self.stop_range(stragglers)
+            stages.append(("kill {0}".format(len(stragglers)), time.monotonic() - mark))
+            self.state.set_observed(stragglers if self.args.pool else sequence, state.STOPPED)
+        else:
+            print("No running instances to end")
+
+        if self.args.pool:
+            print("{0} instance(s) returned to the pool in {1:.2f}s: {2}".format(
+                len(sequence), time.monotonic() - started,
+                ", ".join("{0} {1:.2f}s".format(name, secs) for name, secs in stages)))
+            return
+        mark = time.monotonic()
+        with tracing.span("cleanup", "teardown"):
+            bridges = self.remove_bridges()
+            resp = self.transport.remove_network(self.network_name)
+        if self.args.verbose and resp.returncode != 0:
+            print(resp.stderr.decode("utf-8"))
+        stages.append(("cleanup ({0} bridges)".format(bridges), time.monotonic() - mark))
+        print("{0} instance(s) torn down in {1:.2f}s: {2}".format(
+            len(sequence), time.monotonic() - started,
+            ", ".join("{0} {1:.2f}s".format(name, secs) for name, secs in stages)))
+
+class NetnsExperiment(Experiment):
+    """ Runs each node as plain processes, tincan, the controller, ryu and an OVS of its own,
+    in a network and mount namespace instead of a container. The namespaces are attached by
+    veth pairs to a host bridge that is NATed for signalling and STUN, and the node's generated
+    config, log and data dirs are bind mounted where the ipop-vpn package expects them, so the
+    configs and log tree are the same as with docker. Requires root and ipop-vpn installed on
+    the host. systemctl commands for the ipop service are mapped onto the node's processes. """
+    IP = spawn.find_executable("ip")
+    IPTABLES = spawn.find_executable("iptables")
+    SYSCTL = spawn.find_executable("sysctl")
+    UNSHARE = spawn.find_executable("unshare")
+    OVS_CTL = "/usr/share/openvswitch/scripts/ovs-ctl"
+    NETNS = "ipop-ns{0}"
+    VETH = "vns{0}"
+    BRIDGE = "ipopnsbr"
+    SUBNET = "172.31.0.0/16"
+    NETNS_DIR = "/var/run/netns"
+    # $1 config, $2 bf config, $3 log dir, $4 data dir, $5 ovs-ctl; runs in the node's namespaces
+    NODE_SCRIPT = (
+        'set -e; mkdir -p /var/ipop-vpn /var/log/ipop-vpn /var/run/openvswitch /etc/openvswitch '
+        '/var/log/openvswitch; '
+        'for f in config.json bf-cfg.json; do [ -e "/etc/opt/ipop-vpn/$f" ] || '
+        'touch "/etc/opt/ipop-vpn/$f"; done; '
+        'mount --bind "$1" /etc/opt/ipop-vpn/config.json; '
+        'mount --bind "$2" /etc/opt/ipop-vpn/bf-cfg.json; '
+        'mount --bind "$3" /var/log/ipop-vpn; mount --bind "$4" /var/ipop-vpn; '
+        'for d in /var/run/openvswitch /etc/openvswitch /var/log/openvswitch; do '
+        'mount -t tmpfs ipop "$d"; done; '
+        '"$5" start --system-id=random; exec /opt/ipop-vpn/ipop-start')
+    CONTROLLER = b"controller.Controller"
+
+    def __init__(self, exp_dir=None, argv=None, args=None):
+        super().__init__(exp_dir=exp_dir, argv=argv, args=args)
+        self.subnet = ipaddress.IPv4Network(NetnsExperiment.SUBNET)
+        self.pid_dir = "{0}/netns".format(self.exp_dir)
+        self._procs = {}
+
+    def _netns(self, instance):
+        return NetnsExperiment.NETNS.format("{0:03}".format(instance))
+
+    def _pid_file(self, instance):
+        return "{0}/node{1:03}.pid".format(self.pid_dir, instance)
+
+    @staticmethod
+    def ip_batch(lines, netns=None, force=False):
+        """ Runs the ip commands in one ip process, in netns when given. """
+        cmd = [NetnsExperiment.IP] + (["-n", netns] if netns else []) + \
+            (["-force"] if force else []) + ["-batch", "-"]
+        with tracing.cmd_span("subprocess", "ip", cmd) as spn:
+            resp = subprocess.run(cmd, input="\n".join(lines).encode("utf-8"),
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            spn.set(rc=resp.returncode)
+        return resp
 
-    def run_ping(self, target_address):
-        report = dict(fail_count=0, fail_node=[])
-        for inst in range(self.range_start, self.range_end):
-            cmd_list = [DockerExperiment.VIRT, "exec", "-it"]
-            inst = "{0:03}".format(inst)
-            container = DockerExperiment.CONTAINER.format(inst)
-            cmd_list.append(container)
-            cmd_list += ["ping", "-c1"]
-            cmd_list.append(target_address)
-            resp = Experiment.runshell(cmd_list)
-            if self.args.verbose:
-                print(cmd_list)
-                print("ping ", target_address, "\n", resp.stdout.decode("utf-8"))
+    def running_instances(self):
+        prefix = NetnsExperiment.NETNS.format("")
+        try:
+            names = os.listdir(NetnsExperiment.NETNS_DIR)
+        except FileNotFoundError:
+            return set()
+        except OSError:
+            return None
+        return set(int(name[len(prefix):]) for name in names
+                   if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+    def create_network(self):
+        """ The host bridge the namespaces hang off, with forwarding and NAT to the outside. """
+        gateway = "{0}/{1}".format(self.subnet[1], self.subnet.prefixlen)
+        if not os.path.isdir("/sys/class/net/{0}".format(NetnsExperiment.BRIDGE)):
+            resp = self.ip_batch(["link add {0} type bridge".format(NetnsExperiment.BRIDGE),
+                                  "addr add {0} dev {1}".format(gateway, NetnsExperiment.BRIDGE),
+                                  "link set {0} up".format(NetnsExperiment.BRIDGE)])
             if resp.returncode != 0:
-                report["fail_count"] += 1
-                report["fail_node"].append("node-{0}".format(inst))
-        rpt_msg = "ping {0}: {1}/{2} failed\n{3}".format(target_address, report["fail_count"],
-                                                         self.range_end - self.range_start,
-                                                         report["fail_node"])
-        print(rpt_msg)
+                print(resp.stderr.decode("utf-8"))
+        Experiment.runshell([NetnsExperiment.SYSCTL, "-qw", "net.ipv4.ip_forward=1"])
+        if NetnsExperiment.IPTABLES is None:
+            print("iptables not found, the nodes cannot reach beyond the host")
+            return
+        rule = ["POSTROUTING", "-s", str(self.subnet), "!", "-o", NetnsExperiment.BRIDGE, "-j",
+                "MASQUERADE"]
+        if Experiment.runshell([NetnsExperiment.IPTABLES, "-t", "nat", "-C"] + rule).returncode:
+            Experiment.runshell([NetnsExperiment.IPTABLES, "-t", "nat", "-A"] + rule)
+
+    def remove_network(self):
+        self.ip_batch(["link del {0}".format(NetnsExperiment.BRIDGE)])
+        if NetnsExperiment.IPTABLES is None:
+            return
+        Experiment.runshell([NetnsExperiment.IPTABLES, "-t", "nat", "-D", "POSTROUTING", "-s",
+                             str(self.subnet), "!", "-o", NetnsExperiment.BRIDGE, "-j",
+                             "MASQUERADE"])
 
-    def run_arp(self, target_address):
-        for inst in range(self.range_start, self.range_end):
-            cmd_list = [DockerExperiment.VIRT, "exec", "-it"]
-            inst = "{0:03}".format(inst)
-            container = DockerExperiment.CONTAINER.format(inst)
-            cmd_list.append(container)
-            cmd_list += ["arping", "-C1"]
-            cmd_list.append(target_address)
-            if self.args.verbose:
-                print(cmd_list)
-            resp = Experiment.runshell(cmd_list)
+    def run(self):
+        if os.geteuid() != 0:
+            print("Network namespace nodes require running as root")
+            return
+        self.create_network()
+        super().run()
+
+    def _net_up(self, instance):
+        """ Creates the node's namespace with its end of a veth pair to the host bridge. """
+        netns = self._netns(instance)
+        veth = NetnsExperiment.VETH.format("{0:03}".format(instance))
+        resp = self.ip_batch(["netns add {0}".format(netns),
+                              "link add {0} type veth peer name eth0 netns {1}".format(veth,
+                                                                                     netns),
+                              "link set {0} master {1} up".format(veth,
+                                                                  NetnsExperiment.BRIDGE)])
+        if resp.returncode != 0:
+            return resp
+        return self.ip_batch(["link set lo up",
+                              "addr add {0}/{1} dev eth0".format(self.subnet[instance + 1],
+                                                                 self.subnet.prefixlen),
+                              "link set eth0 up",
+                              "route add default via {0}".format(self.subnet[1])], netns)
+
+    def _spawn(self, instance):
+        """ Starts the node's processes in its namespaces, in a session of their own. """
+        inst = "{0:03}".format(instance)
+        log_dir = "{0}/dkr{1}".format(self.logs_dir, inst)
+        cmd = [NetnsExperiment.IP, "netns", "exec", self._netns(instance),
+               NetnsExperiment.UNSHARE, "--mount", "--propagation", "private",
+               "sh", "-c", NetnsExperiment.NODE_SCRIPT, "ipop-node",
+               "{0}{1}.json".format(self.config_file_base, inst),
+               "{0}bf-cfg.json".format(self.config_file_base), log_dir, self.data_dir,
+               NetnsExperiment.OVS_CTL]
+        os.makedirs(self.pid_dir, exist_ok=True)
+        try:
+            with open("{0}/node.log".format(log_dir), "ab") as log:
+                proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                        start_new_session=True)
+        except OSError as err:
+            return subprocess.CompletedProcess(cmd, 1, b"", str(err).encode("utf-8"))
+        self._procs[instance] = proc
+        with open(self._pid_file(instance), "w") as pid_fle:
+            pid_fle.write(str(proc.pid))
+        return subprocess.CompletedProcess(cmd, 0, "node-{0} pid {1}\n".format(
+            inst, proc.pid).encode("utf-8"), b"")
+
+    def start_instance(self, instance, warm=False):
+        inst = "{0:03}".format(instance)
+        os.makedirs("{0}/dkr{1}".format(self.logs_dir, inst), exist_ok=True)
+        cfg_file = "{0}{1}.json".format(self.config_file_base, inst)
+        if not os.path.isfile(cfg_file):
+            self.gen_config(instance, instance + 1)
+        if not os.path.exists(os.path.join(NetnsExperiment.NETNS_DIR, self._netns(instance))):
+            resp = self._net_up(instance)
+            if resp.returncode != 0:
+                print(resp.stderr.decode("utf-8"))
+                return resp
+        resp = self._spawn(instance)
+        if self.args.verbose or resp.returncode != 0:
             print(resp.stdout.decode("utf-8") if resp.returncode == 0 else
                   resp.stderr.decode("utf-8"))
+        return resp
 
-    def run_svc_ctl(self, svc_ctl):
-        if svc_ctl == "stop":
-            self.run_cmd_on_range(["systemctl", "stop", "ipop"])
-        elif svc_ctl == "start":
-            self.run_cmd_on_range(["systemctl", "start", "ipop"])
-        elif svc_ctl == "restart":
-            self.run_cmd_on_range(["systemctl", "restart", "ipop"])
+    def _ns_pids(self, instance):
+        resp = Experiment.runshell([NetnsExperiment.IP, "netns", "pids", self._netns(instance)])
+        if resp.returncode != 0:
+            return []
+        return [int(pid) for pid in resp.stdout.split()]
+
+    @staticmethod
+    def _cmdline(pid):
+        try:
+            with open("/proc/{0}/cmdline".format(pid), "rb") as cmd_fle:
+                return cmd_fle.read()
+        except OSError:
+            return b""
+
+    def _reap(self):
+        for instance, proc in list(self._procs.items()):
+            if proc.poll() is not None:
+                del self._procs[instance]
+
+    def probe_instance(self, instance):
+        """ Up once the node's controller process is running in its namespace. """
+        return any(NetnsExperiment.CONTROLLER in self._cmdline(pid)
+                   for pid in self._ns_pids(instance))
+
+    def _stop_node(self, instance, deadline):
+        """ Terminates every process in the node's namespace, killing those still there at the
+        deadline. Returns a CompletedProcess with returncode 1 if any had to be killed. """
+        args = ["stop", self._netns(instance)]
+        pids = self._ns_pids(instance)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        delay = Experiment.READY_POLL / 5
+        while pids and time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, Experiment.READY_POLL)
+            self._reap()
+            pids = self._ns_pids(instance)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self._reap()
+        if os.path.isfile(self._pid_file(instance)):
+            os.remove(self._pid_file(instance))
+        return subprocess.CompletedProcess(args, 1 if pids else 0, b"", "{0} process(es) killed"
+                                           "\n".format(len(pids)).encode("utf-8") if pids else b"")
+
+    def _svc(self, action, instance, timeout):
+        """ systemctl is-active/start/stop/restart ipop for a namespace node. """
+        args = ["systemctl", action, "ipop"]
+        if action == "is-active":
+            active = self.probe_instance(instance)
+            return subprocess.CompletedProcess(args, 0 if active else 3,
+                                               b"active\n" if active else b"inactive\n", b"")
+        if action in ("stop", "restart"):
+            resp = self._stop_node(instance, time.monotonic() +
+                                   (timeout or self.args.stop_deadline))
+            if action == "stop":
+                return resp
+        elif self._ns_pids(instance):
+            return subprocess.CompletedProcess(args, 0, b"", b"")
+        return self._spawn(instance)
+
+    def run_container_cmd(self, cmd_line, instance_num, timeout=None):
+        if len(cmd_line) == 3 and cmd_line[0] == "systemctl" and cmd_line[2] == "ipop":
+            return self._svc(cmd_line[1], instance_num, timeout)
+        return Experiment.runshell([NetnsExperiment.IP, "netns", "exec",
+                                    self._netns(instance_num)] + list(cmd_line), timeout)
+
+    def end(self):
+        """ Stops the processes of every node concurrently, killing those that outlive the
+        deadline, then deletes the namespaces with one ip call and removes the host bridge. """
+        self.load_seq_list()
+        self.state.set_desired(self.seq_list, state.STOPPED)
+        sequence = self.seq_list
+        if self.reconcile():
+            sequence = self.state.select(self.seq_list, state.UP)
+        started = time.monotonic()
+        stages = []
+        if sequence:
+            deadline = time.monotonic() + self.args.stop_deadline
+            with tracing.span("stop_nodes", "teardown"):
+                results = self.fanout().run(lambda inst, _: self._stop_node(inst, deadline),
+                                            sequence)
+            stages.append(("stop nodes", time.monotonic() - started))
+            self.report("stop nodes", results)
+            mark = time.monotonic()
+            with tracing.span("delete_netns", "teardown"):
+                resp = self.ip_batch(["netns del {0}".format(self._netns(inst))
+                                      for inst in sequence], force=True)
+            if resp.returncode != 0:
+                print(resp.stderr.decode("utf-8"))
+            stages.append(("delete namespaces", time.monotonic() - mark))
+            self.state.set_observed(sequence, state.STOPPED)
         else:
-            print("Invalid service control specified, only accepts start/stop/restart")
+            print("No running instances to end")
+        mark = time.monotonic()
+        if not self.running_instances():
+            with tracing.span("cleanup", "teardown"):
+                self.remove_network()
+            stages.append(("cleanup", time.monotonic() - mark))
+        print("{0} node(s) torn down in {1:.2f}s: {2}".format(
+            len(sequence), time.monotonic() - started,
+            ", ".join("{0} {1:.2f}s".format(name, secs) for name, secs in stages)))
+
+class SimExperiment(Experiment):
+    """ Runs the configured overlay through the discrete-event simulator instead of containers,
+    joining the nodes in startup sequence order at the configured launch concurrency. """
+
+    def start_instance(self, instance, warm=False):
+        pass
 
-def main(): # pylint: disable=too-many-return-statements
-    exp = DockerExperiment()
-    if exp.args.lxd:
-        exp = LxdExperiment()
+    def run_container_cmd(self, cmd_line, instance_num, timeout=None):
+        return subprocess.CompletedProcess(cmd_line, 1, b"",
+                                           b"Not supported by the simulated experiment\n")
 
+    def end(self):
+        print("Nothing to end for a simulated experiment")
+
+    def load_overlay(self):
+        """ Returns the NodeIds of the startup sequence and the topology parameters, read from
+        the generated configs. """
+        if not os.path.isfile("{0}bf-cfg.json".format(self.config_file_base)):
+            self.gen_config(self.range_start, self.range_end)
+        self.load_seq_list()
+        node_ids = []
+        cfg = None
+        for inst in self.seq_list:
+            with open("{0}{1:03}.json".format(self.config_file_base, inst)) as cfg_fle:
+                cfg = json.load(cfg_fle)
+            node_ids.append(cfg["CFx"]["NodeId"])
+        with open("{0}bf-cfg.json".format(self.config_file_base)) as cfg_fle:
+            bf_cfg = json.load(cfg_fle)
+        return node_ids, overlaysim.topology_params(cfg, bf_cfg)
+
+    def run(self):
+        """ Returns the report, or 2, the usage error status, for bad --sim-params or flows
+        without a pair of nodes to run between. """
+        try:
+            params = overlaysim.parse_params(self.args.sim_params)
+        except ValueError as err:
+            print("Error! {0}".format(err))
+            return 2
+        node_ids, topo = self.load_overlay()
+        # launches go --concurrency at a time and a node is online boot seconds after its launch
+        joins = [(idx // max(1, self.args.concurrency) + 1) * params["boot"]
+                 for idx in range(len(node_ids))]
+        try:
+            sim = overlaysim.OverlaySimulator(node_ids, joins, topo, params, self.seed)
+        except ValueError as err:
+            print("Error! {0}".format(err))
+            return 2
+        print("Simulating {0} nodes, {1}".format(len(node_ids), topo))
+        report = sim.run()
+        report.update(topology=topo._asdict(), params=params, seed=self.seed)
+        print(overlaysim.format_report(report))
+        report_file = "{0}/sim-{1}.json".format(self.exp_dir, time.strftime("%Y%m%d-%H%M%S"))
+        with open(report_file, "w") as rpt:
+            json.dump(report, rpt, indent=2)
+        print("Simulation report written to {0}".format(report_file))
+        return report
+
+def run_actions(exp): # pylint: disable=too-many-return-statements,too-many-branches
     if exp.args.run and exp.args.end:
         print("Error! Both run and end were specified.")
         return
@@ -524,14 +1416,62 @@ def main(): # pylint: disable=too-many-return-statements
         exp.display_current_config()
         return
 
+    if exp.args.sweep:
+        swp = Sweep(exp.args.sweep, exp.exp_dir, exp.args.hosts, exp.args.verbose)
+        with exp.phase("sweep"):
+            swp.run((exp.range_start, exp.range_end))
+        return
+
+    if exp.args.traffic and not exp.args.test:
+        try:
+            with exp.phase("traffic"):
+                exp.gen_traffic(exp.args.hosts)
+        except ValueError as err:
+            print(err)
+            return 2
+        return
+
+    if exp.args.hosts:
+        if exp.range_end - exp.range_start <= 0:
+            print("Invalid range, please fix RANGE_START={0} RANGE_END={1}".
+                  format(exp.range_start, exp.range_end))
+            return
+        try:
+            orch = Orchestrator(exp.args.hosts, exp.exp_dir, exp.args.verbose)
+            cases = None
+            if exp.args.test and not exp.args.cases:
+                with exp.phase("traffic"):
+                    cases = {host: case_file(exp.exp_dir, host)
+                             for host in exp.gen_traffic(exp.args.hosts)}
+            with exp.phase("hosts"):
+                results = orch.run(sys.argv[1:], exp.range_start, exp.range_end, cases=cases)
+        except ValueError as err:
+            print("Error! {0}".format(err))
+            return 2
+        exp.failures += len(failed(results))
+        return
+
     if exp.args.setup:
-        exp.setup_system()
+        with exp.phase("setup"):
+            exp.setup_system()
 
     if exp.args.pull:
-        exp.pull_image()
+        with exp.phase("pull"):
+            exp.pull_image()
 
     if exp.args.clean:
-        exp.make_clean()
+        with exp.phase("clean"):
+            exp.make_clean()
+
+    if exp.args.sample == "stop":
+        exp.stop_sampler()
+        return
+    if exp.args.sample:
+        try:
+            exp.start_sampler(float(exp.args.sample))
+        except ValueError:
+            print("Invalid sample interval {0}".format(exp.args.sample))
+            return
 
     if exp.range_end - exp.range_start <= 0:
         print("Invalid range, please fix RANGE_START={0} RANGE_END={1}".
@@ -539,35 +1479,138 @@ def main(): # pylint: disable=too-many-return-statements
         return
 
     if exp.args.configure:
-        exp.configure()
+        try:
+            with exp.phase("configure"):
+                exp.configure()
+        except ValueError as err:
+            print("Error! {0}".format(err))
+            return 2
+
+    if exp.args.pool and not (exp.args.run or exp.args.end):
+        with exp.phase("pool"):
+            results = exp.warm_pool()
+        return 2 if results is None else None
 
     if exp.args.run:
-        exp.run()
+        monitor = exp.convergence_monitor() if exp.args.converge else None
+        with exp.phase("run"):
+            if exp.run() == 2:
+                return 2
+        if monitor:
+            with exp.phase("converge"):
+                exp.await_convergence(monitor, exp.args.converge)
         return
 
     if exp.args.end:
-        exp.end()
+        with exp.phase("end"):
+            exp.end()
+        exp.stop_sampler()
         return
 
     if exp.args.ping:
-        exp.run_ping(exp.args.ping)
+        with exp.phase("ping"):
+            exp.run_ping(exp.args.ping)
         return
 
     if exp.args.arp:
-        exp.run_arp(exp.args.arp)
+        with exp.phase("arp"):
+            exp.run_arp(exp.args.arp)
         return
 
     if exp.args.ipop:
-        exp.run_svc_ctl(exp.args.ipop)
+        with exp.phase("ipop"):
+            exp.run_svc_ctl(exp.args.ipop)
+        return
+
+    if exp.args.push:
+        with exp.phase("push"):
+            exp.push_code(exp.args.push)
         return
 
     if exp.args.churn:
-        exp.churn(exp.args.churn)
+        # the nodes churn leaves alone log nothing new, so their links come from the logs
+        monitor = exp.convergence_monitor(seed=True) if exp.args.converge else None
+        with exp.phase("churn"):
+            code = exp.churn(exp.args.churn)
+        if code:
+            return code
+        if monitor:
+            # time to converge counts from the last churn event
+            monitor.reference = time.time()
+            with exp.phase("converge"):
+                exp.await_convergence(monitor, exp.args.converge)
         return
 
     if exp.args.test:
-        exp.run_test(exp.args.test)
+        with exp.phase("test"):
+            return exp.run_test(exp.args.test)
+
+    if exp.args.results:
+        exp.summarize_results(exp.args.results)
         return
 
+    if exp.args.logs:
+        with exp.phase("logs"):
+            return exp.search_logs(exp.args.logs)
+
+def backend(args):
+    if args.lxd:
+        return LxdExperiment
+    if args.netns:
+        return NetnsExperiment
+    if args.sim:
+        return SimExperiment
+    return DockerExperiment
+
+def execute(exp):
+    """ Runs the actions of the invocation and returns its exit status: 2 on a usage error, 1
+    when nodes, cases or hosts failed and 0 otherwise. """
+    if exp.args.trace:
+        tracing.TRACER.enable()
+    try:
+        code = run_actions(exp)
+    finally:
+        if exp.args.trace:
+            tracing.TRACER.disable()
+            tracing.TRACER.export_chrome(exp.args.trace)
+            print(tracing.TRACER.summary())
+            print("Trace written to {0}".format(exp.args.trace))
+    return code or (1 if exp.failures else 0)
+
+def serve():
+    """ Runs the invocations sent by expctl.py on experiments kept for the life of the
+    process, one per backend. """
+    parser = Experiment.make_parser()
+    experiments = {}
+
+    def handle(argv):
+        args = parser.parse_args(argv)
+        if args.daemon:
+            print("A daemon is already serving this experiment dir")
+            return 1
+        exp = experiments.get(backend(args))
+        if exp is None:
+            exp = experiments[backend(args)] = backend(args)(args=args)
+        else:
+            exp.load_args(args)
+        saved, sys.argv = sys.argv, [sys.argv[0]] + argv
+        try:
+            return execute(exp)
+        finally:
+            sys.argv = saved
+
+    server = ControlServer(os.path.join(os.path.abspath("."), SOCKET), handle)
+    print("Serving experiment commands on {0}".format(server.path))
+    sys.stdout.flush()
+    server.serve()
+    print("Daemon stopped after {0} request(s)".format(server.served))
+
+def main():
+    args = Experiment.make_parser().parse_args()
+    if args.daemon:
+        serve()
+        return 0
+    return execute(backend(args)(args=args))
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
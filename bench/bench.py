@@ -0,0 +1,150 @@
+# pylint: disable=missing-docstring
+""" Benchmarks the orchestration paths of Experiment.py against the fake-docker executable.
+
+python bench/bench.py --sizes 10,100,1000 --latency 0.01 --out bench.json
+python bench/bench.py --baseline bench-baseline.json  # exits 1 on regressions
+
+Without --baseline the results are compared against bench/baseline.json, made with the
+defaults; --baseline "" skips the comparison.
+"""
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import argparse
+import contextlib
+import io
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from Experiment import DockerExperiment # pylint: disable=wrong-import-position
+
+FAKE_DOCKER = os.path.join(BENCH_DIR, "fake-docker")
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+SETTINGS = ("latency", "concurrency", "fanout")
+
+
+def make_exp_dir(root, num):
+    exp_dir = os.path.join(root, "exp{0}".format(num))
+    os.makedirs(os.path.join(exp_dir, "test-link-utilization"), exist_ok=True)
+    src_dir = os.path.dirname(BENCH_DIR)
+    with open(os.path.join(src_dir, "template-config.json")) as tmpl:
+        template = json.load(tmpl)
+    olid = template["CFx"]["Overlays"][0]
+    # a network large enough to address every instance of the largest size
+    template["BridgeController"]["Overlays"][olid]["IP4"] = "10.0.0.0/8"
+    with open(os.path.join(exp_dir, "template-config.json"), "w") as tmpl:
+        json.dump(template, tmpl, indent=2)
+    shutil.copy(os.path.join(src_dir, "template-bf-config.json"), exp_dir)
+    return exp_dir
+
+
+def timed(func):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    return time.perf_counter() - started
+
+
+def run_size(root, num, opts):
+    exp_dir = make_exp_dir(root, num)
+    argv = ["--range", "1,{0}".format(num + 1), "--transport", "cli", "--seed", "1",
+            "--concurrency", str(opts.concurrency), "--fanout", str(opts.fanout)]
+    exp = DockerExperiment(exp_dir=exp_dir, argv=argv)
+    results = {}
+    results["gen_config"] = timed(lambda: exp.gen_config(exp.range_start, exp.range_end))
+    results["gen_config_noop"] = timed(lambda: exp.gen_config(exp.range_start, exp.range_end))
+    results["gen_rand_seq"] = timed(exp.gen_rand_seq)
+    if num <= opts.max_docker:
+        results["start_range"] = timed(lambda: exp.start_range(opts.concurrency, 10))
+        results["run_cmd_on_range"] = timed(
+            lambda: exp.run_cmd_on_range(["systemctl", "restart", "ipop"]))
+        results["end"] = timed(exp.end)
+    return [{"bench": name, "n": num, "seconds": secs, "rate": num / secs if secs else 0.0}
+            for name, secs in results.items()]
+
+
+def compare(results, baseline, tolerance, min_delta):
+    base = {(rec["bench"], rec["n"]): rec["seconds"] for rec in baseline["results"]}
+    regressions = []
+    for rec in results:
+        ref = base.get((rec["bench"], rec["n"]))
+        if ref is None:
+            continue
+        ratio = rec["seconds"] / ref if ref else float("inf")
+        rec["baseline"] = ref
+        rec["ratio"] = ratio
+        if ratio > 1 + tolerance and rec["seconds"] - ref > min_delta:
+            regressions.append(rec)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the experiment control plane")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="Comma separated instance counts, up to 10000")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Seconds each fake docker call takes")
+    parser.add_argument("--concurrency", type=int, default=DockerExperiment.BATCH_SZ)
+    parser.add_argument("--fanout", type=int, default=64)
+    parser.add_argument("--max-docker", type=int, default=1000, dest="max_docker",
+                        help="Largest size the container paths are benchmarked at")
+    parser.add_argument("--out", help="Writes the results to this json file")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="Compares against this results file, by default the committed "
+                        "bench/baseline.json; empty to skip")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown relative to the baseline")
+    parser.add_argument("--min-delta", type=float, default=0.05, dest="min_delta",
+                        help="Slowdowns smaller than this many seconds are treated as noise")
+    opts = parser.parse_args()
+
+    os.environ["FAKE_DOCKER_LATENCY"] = str(opts.latency)
+    DockerExperiment.VIRT = FAKE_DOCKER
+    root = tempfile.mkdtemp(prefix="bfexp-bench-")
+    os.environ["FAKE_DOCKER_STATE"] = os.path.join(root, "containers")
+    os.makedirs(os.environ["FAKE_DOCKER_STATE"])
+    results = []
+    try:
+        for num in (int(val) for val in opts.sizes.split(",")):
+            results += run_size(root, num, opts)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    regressions = []
+    if opts.baseline:
+        with open(opts.baseline) as bfl:
+            baseline = json.load(bfl)
+        regressions = compare(results, baseline, opts.tolerance, opts.min_delta)
+        differ = [name for name in SETTINGS
+                  if baseline.get("meta", {}).get(name) != getattr(opts, name)]
+        if differ:
+            print("Warning: the baseline {0} was made with other {1}".format(
+                opts.baseline, ", ".join("{0} {1}".format(name, baseline["meta"].get(name))
+                                         for name in differ)))
+    for rec in results:
+        print("{bench:<18} n={n:<6} {seconds:9.3f}s {rate:12.1f}/s".format(**rec) +
+              (" x{0:.2f} of baseline".format(rec["ratio"]) if "ratio" in rec else ""))
+    if opts.out:
+        with open(opts.out, "w") as ofl:
+            json.dump({"meta": {"python": platform.python_version(), "latency": opts.latency,
+                                "concurrency": opts.concurrency, "fanout": opts.fanout,
+                                "time": time.time()},
+                       "results": results}, ofl, indent=2)
+    if regressions:
+        print("{0} regression(s) beyond {1:.0%}: {2}".format(
+            len(regressions), opts.tolerance,
+            ["{0}@{1}".format(rec["bench"], rec["n"]) for rec in regressions]))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import array
+import os
+import signal
+import threading
+import time
+
+FIELDS = ("cpu", "mem", "rx_bytes", "tx_bytes", "rx_packets", "tx_packets")
+CONTROL = "sampler.json"
+PHASES = "phases.jsonl"
+
+
+class Ring():
+    """ Fixed size ring of samples over arrays preallocated for its capacity, a timestamp
+    column and an int64 column per field. Once full a new sample overwrites the oldest. """
+
+    def __init__(self, capacity, fields=FIELDS):
+        self.capacity = capacity
+        self.ts = array.array("d", bytes(8 * capacity))
+        self.columns = [array.array("q", bytes(8 * capacity)) for _ in fields]
+        self.head = 0
+        self.count = 0
+
+    def append(self, stamp, values):
+        pos = self.head
+        self.ts[pos] = stamp
+        for column, value in zip(self.columns, values):
+            column[pos] = value
+        self.head = (pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _ordered(self, column):
+        start = self.head - self.count
+        if start >= 0:
+            return column[start:self.head]
+        return column[start:] + column[:self.head]
+
+    def series(self):
+        """ Returns (timestamps, columns) oldest first. """
+        return self._ordered(self.ts), [self._ordered(column) for column in self.columns]
+
+
+def _pread_int(fdesc, key=None):
+    data = os.pread(fdesc, 4096, 0)
+    if key is None:
+        return int(data)
+    for line in data.splitlines():
+        if line.startswith(key):
+            return int(line.split()[1])
+    return 0
+
+
+class NodeReader():
+    """ Reads a container's cumulative cpu time (usec) and memory use from its cgroup and the
+    byte and packet counters of the interfaces in its network namespace (loopback excluded)
+    from /proc/<pid>/net/dev. Handles cgroup v1 (cpuacct and memory hierarchies) and v2
+    (unified). The files are opened once and re-read with pread. """
+
+    def __init__(self, pid, sys_root="/sys/fs/cgroup", proc_root="/proc"):
+        with open(os.path.join(proc_root, str(pid), "cgroup")) as cfl:
+            lines = cfl.read().splitlines()
+        unified, hierarchies = None, {}
+        for line in lines:
+            hier_id, ctrls, path = line.split(":", 2)
+            if hier_id == "0" and not ctrls:
+                unified = path
+            for ctrl in ctrls.split(","):
+                hierarchies[ctrl] = (ctrls, path.lstrip("/"))
+        self.fds = []
+        try:
+            if "cpuacct" in hierarchies and "memory" in hierarchies:
+                mount, path = hierarchies["cpuacct"]
+                self.cpu = self._open(sys_root, mount, path, "cpuacct.usage")
+                self.cpu_key, self.cpu_div = None, 1000
+                self.mem = self._open(sys_root, "memory", hierarchies["memory"][1],
+                                      "memory.usage_in_bytes")
+            elif unified is not None:
+                path = unified.lstrip("/")
+                self.cpu = self._open(sys_root, path, "cpu.stat")
+                self.cpu_key, self.cpu_div = b"usage_usec", 1
+                self.mem = self._open(sys_root, path, "memory.current")
+            else:
+                raise OSError("No cpu and memory accounting for pid {0}".format(pid))
+            self.net = self._open(proc_root, str(pid), "net", "dev")
+        except OSError:
+            self.close()
+            raise
+
+    def _open(self, *parts):
+        fdesc = os.open(os.path.join(*parts), os.O_RDONLY)
+        self.fds.append(fdesc)
+        return fdesc
+
+    def read(self):
+        cpu = _pread_int(self.cpu, self.cpu_key) // self.cpu_div
+        mem = _pread_int(self.mem)
+        rx_bytes = tx_bytes = rx_packets = tx_packets = 0
+        for line in os.pread(self.net, 65536, 0).splitlines()[2:]:
+            name, _, counters = line.partition(b":")
+            if name.strip() == b"lo":
+                continue
+            fields = counters.split()
+            rx_bytes += int(fields[0])
+            rx_packets += int(fields[1])
+            tx_bytes += int(fields[8])
+            tx_packets += int(fields[9])
+        return cpu, mem, rx_bytes, tx_bytes, rx_packets, tx_packets
+
+    def close(self):
+        for fdesc in self.fds:
+            os.close(fdesc)
+        self.fds = []
+
+
+class ResourceSampler():
+    """ Samples every running container at a fixed interval into a Ring per container.
+    running() returns the names of the running containers (or None when unknown) and is polled
+    every rescan seconds; resolve(names) maps newly seen names to their pids. A container whose
+    files stop reading is dropped until it shows up again, its samples are kept. """
+    INTERVAL = 0.1
+    CAPACITY = 4096
+    RESCAN = 1.0
+
+    def __init__(self, running, resolve, interval=INTERVAL, capacity=CAPACITY,
+                 sys_root="/sys/fs/cgroup", proc_root="/proc", rescan=RESCAN):
+        self.running = running
+        self.resolve = resolve
+        self.interval = interval
+        self.capacity = capacity
+        self.sys_root = sys_root
+        self.proc_root = proc_root
+        self.rescan = rescan
+        self.readers = {}
+        self.rings = {}
+        self.start = time.time()
+        self.ticks = 0
+        self.overruns = 0
+
+    def discover(self):
+        names = self.running()
+        if names is None:
+            return
+        for name in set(self.readers) - set(names):
+            self.readers.pop(name).close()
+        new = set(names) - set(self.readers)
+        if not new:
+            return
+        for name, pid in self.resolve(new).items():
+            try:
+                self.readers[name] = NodeReader(pid, self.sys_root, self.proc_root)
+            except (OSError, ValueError):
+                continue
+            if name not in self.rings:
+                self.rings[name] = Ring(self.capacity)
+
+    def sample(self, now=None):
+        now = time.time() if now is None else now
+        for name, reader in list(self.readers.items()):
+            try:
+                values = reader.read()
+            except (OSError, ValueError, IndexError):
+                self.readers.pop(name).close()
+                continue
+            self.rings[name].append(now, values)
+        self.ticks += 1
+
+    def run(self, stop):
+        """ Samples until the stop event is set, on a fixed schedule that skips the ticks a
+        slow round overran rather than bunching them up. """
+        self.start = time.time()
+        next_scan = next_tick = time.monotonic()
+        while not stop.is_set():
+            if time.monotonic() >= next_scan:
+                self.discover()
+                next_scan = time.monotonic() + self.rescan
+            self.sample()
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                skipped = int(-delay / self.interval) + 1
+                self.overruns += skipped
+                next_tick += skipped * self.interval
+                delay = next_tick - time.monotonic()
+            stop.wait(delay)
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+
+    def series(self, phases=()):
+        """ A compact time series: per container, columns of sample times in ms since the start,
+        cpu in millicores and memory in bytes, and the network counters as per second rates,
+        each over the interval since the previous sample. Phases are (name, start, end) epoch
+        times and are given in ms since the start too. """
+        nodes = {}
+        for name, ring in sorted(self.rings.items()):
+            stamps, columns = ring.series()
+            cols = [[] for _ in range(len(FIELDS) + 1)]
+            for idx in range(1, len(stamps)):
+                span = stamps[idx] - stamps[idx - 1]
+                if span <= 0:
+                    continue
+                cols[0].append(int((stamps[idx] - self.start) * 1000))
+                cols[1].append(int((columns[0][idx] - columns[0][idx - 1]) / span / 1000))
+                cols[2].append(columns[1][idx])
+                for fld in range(2, len(FIELDS)):
+                    cols[fld + 1].append(int((columns[fld][idx] - columns[fld][idx - 1]) / span))
+            nodes[name] = cols
+        return {"start": self.start, "interval": self.interval,
+                "columns": ["t_ms", "cpu_millicores", "mem_bytes", "rx_bytes_s", "tx_bytes_s",
+                            "rx_packets_s", "tx_packets_s"],
+                "phases": [[name, int((start - self.start) * 1000),
+                            int((end - self.start) * 1000)] for name, start, end in phases],
+                "ticks": self.ticks, "overruns": self.overruns, "nodes": nodes}
+
+
+def summarize(series):
+    """ Per phase, the mean and peak per container cpu, the peak per container memory and the
+    total network traffic of the sampled containers. """
+    lines = ["{0} container(s) sampled every {1}s, {2} tick(s), {3} overrun(s)".format(
+        len(series["nodes"]), series["interval"], series["ticks"], series["overruns"])]
+    windows = series["phases"] + [["all", float("-inf"), float("inf")]]
+    for name, start, end in windows:
+        cpu, mem, rx_bytes, tx_bytes = [], 0, 0.0, 0.0
+        for cols in series["nodes"].values():
+            last = None
+            for idx, stamp in enumerate(cols[0]):
+                if start <= stamp <= end:
+                    span = (stamp - last) / 1000 if last is not None else series["interval"]
+                    cpu.append(cols[1][idx])
+                    mem = max(mem, cols[2][idx])
+                    rx_bytes += cols[3][idx] * span
+                    tx_bytes += cols[4][idx] * span
+                last = stamp
+        if not cpu:
+            continue
+        lines.append("{0:<10} cpu mean {1:.0f}m peak {2}m, mem peak {3:.1f}MiB, "
+                     "rx {4:.1f}MiB tx {5:.1f}MiB".format(
+                         name, sum(cpu) / len(cpu), max(cpu), mem / (1 << 20),
+                         rx_bytes / (1 << 20), tx_bytes / (1 << 20)))
+    return "\n".join(lines)
+
+
+def _control(sample_dir):
+    try:
+        with open(os.path.join(sample_dir, CONTROL)) as cfl:
+            return json.load(cfl)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def active(sample_dir):
+    ctl = _control(sample_dir)
+    return ctl is not None and _alive(ctl["pid"])
+
+
+def record_phase(sample_dir, name, start, end):
+    """ Appends a phase to the running sampler's phase log. """
+    with open(os.path.join(sample_dir, PHASES), "a") as pfl:
+        pfl.write(json.dumps([name, start, end]) + "\n")
+
+
+def _read_phases(sample_dir):
+    phases = []
+    try:
+        with open(os.path.join(sample_dir, PHASES)) as pfl:
+            for line in pfl:
+                try:
+                    phases.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return phases
+
+
+def start(sample_dir, make_sampler):
+    """ Forks a detached sampler process that samples until it is sent SIGTERM and then writes
+    its series to samples-<start time>.json in sample_dir, together with the phases recorded
+    meanwhile. make_sampler() builds the ResourceSampler in the child. Returns the pid. """
+    os.makedirs(sample_dir, exist_ok=True)
+    out = os.path.join(sample_dir, "samples-{0}.json".format(time.strftime("%Y%m%d-%H%M%S")))
+    with open(os.path.join(sample_dir, PHASES), "w"):
+        pass
+    pid = os.fork()
+    if pid:
+        tmp = os.path.join(sample_dir, CONTROL + ".tmp")
+        with open(tmp, "w") as cfl:
+            json.dump({"pid": pid, "out": out}, cfl)
+        os.replace(tmp, os.path.join(sample_dir, CONTROL))
+        return pid
+    code = 1
+    try:
+        os.setsid()
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        with open(os.devnull, "rb") as null_in, \
+                open(os.path.join(sample_dir, "sampler.log"), "ab") as log:
+            os.dup2(null_in.fileno(), 0)
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+        # a forking daemon's listening socket and client connections must not outlive it here
+        os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+        sampler = make_sampler()
+        sampler.run(stop)
+        tmp = out + ".tmp"
+        with open(tmp, "w") as ofl:
+            json.dump(sampler.series(_read_phases(sample_dir)), ofl, separators=(",", ":"))
+        os.replace(tmp, out)
+        code = 0
+    finally:
+        os._exit(code) # pylint: disable=protected-access
+
+
+def stop(sample_dir, timeout=30.0):
+    """ Stops the running sampler and returns the file its series was written to, or None if
+    no sampler was running or it did not finish in time. """
+    ctl = _control(sample_dir)
+    if ctl is None:
+        return None
+    os.remove(os.path.join(sample_dir, CONTROL))
+    try:
+        os.kill(ctl["pid"], signal.SIGTERM)
+    except ProcessLookupError:
+        return ctl["out"] if os.path.isfile(ctl["out"]) else None
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # reaps it when the sampler was forked by this process
+            if os.waitpid(ctl["pid"], os.WNOHANG)[0]:
+                break
+        except ChildProcessError:
+            if not _alive(ctl["pid"]):
+                break
+        time.sleep(0.05)
+    return ctl["out"] if os.path.isfile(ctl["out"]) else None
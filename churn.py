@@ -0,0 +1,237 @@
+# pylint: disable=missing-docstring
+import csv
+import heapq
+import random
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+STOP = "stop"
+START = "start"
+
+ChurnRecord = namedtuple("ChurnRecord", ["model", "node", "action", "scheduled", "issued",
+                                         "completed", "returncode", "suppressed"])
+
+
+class FixedIntervalChurn():
+    """ Takes down count nodes of the sequence one every interval seconds, each for downtime
+    seconds (defaults to interval, which reproduces the original serial churn timing). """
+    name = "fixed"
+
+    def __init__(self, nodes, count=0, interval=30, downtime=None):
+        self.nodes = nodes[:count] if count else list(nodes)
+        self.interval = interval
+        self.downtime = interval if downtime is None else downtime
+
+    def events(self, rng): # pylint: disable=unused-argument
+        # with downtime over interval the starts fall between later stops
+        starts = []
+        for i, node in enumerate(self.nodes):
+            while starts and starts[0][0] <= i * self.interval:
+                yield heapq.heappop(starts)
+            yield i * self.interval, node, STOP
+            heapq.heappush(starts, (i * self.interval + self.downtime, node, START))
+        while starts:
+            yield heapq.heappop(starts)
+
+
+class PoissonChurn():
+    """ Every node alternates exponentially distributed online sessions and offline periods,
+    so departures and rejoins across the overlay arrive as Poisson processes. """
+    name = "poisson"
+
+    def __init__(self, nodes, duration, mean_session, mean_offline):
+        self.nodes = list(nodes)
+        self.duration = duration
+        self.mean_session = mean_session
+        self.mean_offline = mean_offline
+
+    def events(self, rng):
+        pending = [(rng.expovariate(1.0 / self.mean_session), node, STOP) for node in self.nodes]
+        heapq.heapify(pending)
+        while pending:
+            when, node, action = heapq.heappop(pending)
+            if action == STOP and when >= self.duration:
+                continue
+            yield when, node, action
+            if action == STOP:
+                heapq.heappush(pending, (when + rng.expovariate(1.0 / self.mean_offline), node,
+                                         START))
+            else:
+                heapq.heappush(pending, (when + rng.expovariate(1.0 / self.mean_session), node,
+                                         STOP))
+
+
+class BurstChurn():
+    """ Every period seconds a burst of size nodes that are adjacent on the ring (consecutive
+    instance numbers, hence consecutive node ids) fail together for downtime seconds. """
+    name = "burst"
+
+    def __init__(self, nodes, duration, period, size, downtime):
+        self.nodes = sorted(nodes)
+        self.duration = duration
+        self.period = period
+        self.size = min(size, len(self.nodes))
+        self.downtime = downtime
+
+    def events(self, rng):
+        # with downtime over period the starts fall after later bursts
+        starts = []
+        when = self.period
+        while when < self.duration:
+            while starts and starts[0][0] <= when:
+                yield heapq.heappop(starts)
+            first = rng.randrange(len(self.nodes))
+            burst = [self.nodes[(first + i) % len(self.nodes)] for i in range(self.size)]
+            for node in burst:
+                yield when, node, STOP
+                heapq.heappush(starts, (when + self.downtime, node, START))
+            when += self.period
+        while starts:
+            yield heapq.heappop(starts)
+
+
+MODELS = {"fixed": FixedIntervalChurn, "poisson": PoissonChurn, "burst": BurstChurn}
+USAGE = {"fixed": "count,interval[,downtime]", "poisson": "duration,mean_session,mean_offline",
+         "burst": "duration,period,size,downtime"}
+# the least and most parameters each model takes
+ARITY = {"fixed": (2, 3), "poisson": (3, 3), "burst": (4, 4)}
+# the parameters that must be positive, by position
+POSITIVE = {"poisson": (1, 2), "burst": (1,)}
+
+
+def parse_models(spec, nodes):
+    """ spec is a ';' separated list of model:p1,p2,... e.g.
+    fixed:count,interval[,downtime]; poisson:duration,mean_session,mean_offline;
+    burst:duration,period,size,downtime. A bare count,interval is a fixed model. Raises
+    ValueError for a spec that does not parse. """
+    models = []
+    for item in spec.split(";"):
+        name, _, params = item.strip().rpartition(":")
+        name = name or "fixed"
+        if name not in MODELS:
+            raise ValueError("Unknown churn model {0}, one of {1}".format(name,
+                                                                       ", ".join(MODELS)))
+        usage = "expected {0}:{1}".format(name, USAGE[name])
+        try:
+            params = [float(val) for val in params.split(",") if val]
+        except ValueError:
+            raise ValueError("Invalid churn parameters {0}, {1}".format(item.strip(), usage))
+        if not ARITY[name][0] <= len(params) <= ARITY[name][1]:
+            raise ValueError("Wrong number of churn parameters in {0}, {1}".format(
+                item.strip(), usage))
+        if any(params[pos] <= 0 for pos in POSITIVE.get(name, ())):
+            raise ValueError("The periods and means of {0} must be positive, {1}".format(
+                item.strip(), usage))
+        if name == "fixed":
+            params[0] = int(params[0])
+        elif name == "burst":
+            params[2] = int(params[2])
+        models.append(MODELS[name](nodes, *params))
+    return models
+
+
+class ChurnScheduler():
+    """ Merges the event streams of several churn models into one timed event queue and issues
+    each stop/start on a thread pool at its scheduled offset, without waiting for earlier
+    actions of other nodes to complete. An action due while an earlier one of the same node is
+    still running is issued after it, on the same worker. A node taken down by several models
+    overlapping is only stopped by the first and started by the last; the other actions are
+    recorded as suppressed. """
+    WORKERS = 64
+
+    def __init__(self, action, models, seed=None, workers=WORKERS):
+        """ action(node, action) performs the stop or start and returns a CompletedProcess. """
+        self.action = action
+        self.models = models
+        self.rng = random.Random(seed)
+        self.workers = workers
+        self.timeline = []
+        self._lock = threading.Lock()
+        self._down = {}
+        self._queued = {}
+        self._epoch = None
+
+    def _dispatch(self, pool, model, node, act, scheduled):
+        with self._lock:
+            if node in self._queued:
+                self._queued[node].append((model, act, scheduled))
+                return
+            self._queued[node] = []
+        pool.submit(self._perform, model, node, act, scheduled, time.time())
+
+    def _perform(self, model, node, act, scheduled, issued):
+        while True:
+            try:
+                returncode = self.action(node, act).returncode
+            except subprocess.TimeoutExpired:
+                returncode = -1
+            self._record(ChurnRecord(model, node, act, scheduled, issued, time.time(),
+                                     returncode, False))
+            with self._lock:
+                if not self._queued[node]:
+                    del self._queued[node]
+                    return
+                model, act, scheduled = self._queued[node].pop(0)
+            issued = time.time()
+
+    def _record(self, rec):
+        with self._lock:
+            self.timeline.append(rec)
+
+    def _suppress(self, node, act):
+        """ Returns True if the action is redundant given the other models' outstanding stops. """
+        count = self._down.get(node, 0)
+        if act == STOP:
+            self._down[node] = count + 1
+            return count > 0
+        self._down[node] = max(count - 1, 0)
+        return count > 1
+
+    def run(self):
+        queue = []
+        order = 0
+        for idx, model in enumerate(self.models):
+            stream = model.events(self.rng)
+            for when, node, act in stream:
+                heapq.heappush(queue, (when, order, idx, node, act, stream))
+                order += 1
+                break
+        self._epoch = time.time()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while queue:
+                when, _, idx, node, act, stream = heapq.heappop(queue)
+                delay = when - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                model = self.models[idx].name
+                scheduled = self._epoch + when
+                if self._suppress(node, act):
+                    self._record(ChurnRecord(model, node, act, scheduled, time.time(), None,
+                                             None, True))
+                else:
+                    self._dispatch(pool, model, node, act, scheduled)
+                for nxt_when, nxt_node, nxt_act in stream:
+                    heapq.heappush(queue, (nxt_when, order, idx, nxt_node, nxt_act, stream))
+                    order += 1
+                    break
+        self.timeline.sort(key=lambda rec: (rec.scheduled, rec.issued))
+        return self.timeline
+
+    def write_timeline(self, path):
+        with open(path, "w", newline="") as fle:
+            writer = csv.writer(fle)
+            writer.writerow(ChurnRecord._fields)
+            for rec in self.timeline:
+                writer.writerow(rec)
+
+    def summary(self):
+        issued = [rec for rec in self.timeline if not rec.suppressed]
+        fails = [rec for rec in issued if rec.returncode != 0]
+        lateness = [rec.issued - rec.scheduled for rec in issued]
+        return "churn: {0} action(s) issued, {1} suppressed, {2} failed, max issue lag {3:.3f}s" \
+            .format(len(issued), len(self.timeline) - len(issued), len(fails),
+                    max(lateness, default=0))
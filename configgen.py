@@ -0,0 +1,154 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import hashlib
+import ipaddress
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_SLOT = re.compile(r'"@@(\w+)@@"')
+
+
+class CompiledTemplate():
+    """ A template serialized once with named slots; rendering only splices the json encoded
+    slot values between the fixed text fragments. """
+
+    def __init__(self, template, slots):
+        """ slots maps a slot name to the path of keys of the value it replaces. """
+        for name, path in slots.items():
+            node = template
+            for key in path[:-1]:
+                node = node[key]
+            node[path[-1]] = "@@{0}@@".format(name)
+        self.parts = _SLOT.split(json.dumps(template, indent=2))
+
+    def render(self, values):
+        parts = self.parts
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            out.append(json.dumps(values[parts[i]]))
+            out.append(parts[i + 1])
+        return "".join(out)
+
+
+class ConfigBuilder():
+    """ Renders the per node ipop config files from template-config.json and writes only the
+    files whose content hash differs from the one recorded in the config dir manifest. """
+    MANIFEST = ".manifest.json"
+    WRITERS = 8
+
+    def __init__(self, template_file, bf_template_file, config_dir, config_file_base):
+        self.template_file = template_file
+        self.bf_template_file = bf_template_file
+        self.config_dir = config_dir
+        self.config_file_base = config_file_base
+        self.manifest_file = os.path.join(config_dir, ConfigBuilder.MANIFEST)
+        self._lock = threading.Lock()
+        self._compile()
+
+    def _compile(self):
+        with open(self.template_file) as cfg_tmpl:
+            template = json.load(cfg_tmpl)
+        olid = template["CFx"].get("Overlays", None)[0]
+        self.node_id = template["CFx"].get("NodeId", "a000###feb6040628e5fb7e70b04f###")
+        self.node_name = template["OverlayVisualizer"].get("NodeName", "dkr###")
+        ip4 = template["BridgeController"]["Overlays"][olid].get("IP4", "10.10.1.0/24")
+        # either a network whose host N is assigned to node N, or an address with a ### slot
+        self.ip4_pattern = ip4 if "###" in ip4 else None
+        self.netwk = None if self.ip4_pattern else ipaddress.IPv4Network(ip4)
+        self.template = CompiledTemplate(template, {
+            "NodeId": ("CFx", "NodeId"),
+            "NodeName": ("OverlayVisualizer", "NodeName"),
+            "IP4": ("BridgeController", "Overlays", olid, "IP4")})
+
+    def node_ip4(self, val):
+        """ Raises ValueError when node val has no valid address, e.g. past 255 in a ###
+        octet or past the end of the network. """
+        if self.ip4_pattern:
+            ip4 = self.ip4_pattern.replace("###", str(val))
+            try:
+                ipaddress.IPv4Interface(ip4)
+            except ValueError:
+                raise ValueError("Node {0} has no valid IPv4 address, {1} from {2}; use a "
+                                 "network such as 10.10.0.0/16 for larger ranges"
+                                 .format(val, ip4, self.ip4_pattern))
+            return ip4
+        try:
+            return str(self.netwk[val])
+        except IndexError:
+            raise ValueError("Node {0} is past the end of the IPv4 network {1}"
+                             .format(val, self.netwk))
+
+    def node_values(self, val):
+        rng_str = "{0:03}".format(val)
+        node_id = self.node_id
+        node_name = self.node_name
+        return {
+            "NodeId": "{0}{1}{2}{1}{3}".format(node_id[:4], rng_str, node_id[7:29], node_id[32:]),
+            "NodeName": "{0}{1}".format(node_name[:3], rng_str),
+            "IP4": self.node_ip4(val)}
+
+    def node_file(self, val):
+        return "{0}{1:03}.json".format(self.config_file_base, val)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file) as mfst:
+                return json.load(mfst)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, "w") as mfst:
+            json.dump(manifest, mfst, sort_keys=True)
+        os.replace(tmp, self.manifest_file)
+
+    @staticmethod
+    def _write(item):
+        path, content = item
+        tmp = path + ".tmp"
+        with open(tmp, "w") as cfg_fle:
+            cfg_fle.write(content)
+        os.replace(tmp, path)
+
+    def _bf_content(self):
+        with open(self.bf_template_file) as cfg_tmpl:
+            return json.dumps(json.load(cfg_tmpl), indent=2)
+
+    def build(self, range_start, range_end, with_bf=True):
+        """ Returns a summary dict of the files rendered, written and skipped with timings. """
+        with self._lock:
+            started = time.monotonic()
+            os.makedirs(self.config_dir, exist_ok=True)
+            manifest = self._load_manifest()
+            pending = []
+            renders = [(self.node_file(val), self.template.render(self.node_values(val)))
+                       for val in range(range_start, range_end)]
+            if with_bf:
+                renders.append(("{0}bf-cfg.json".format(self.config_file_base),
+                                self._bf_content()))
+            for path, content in renders:
+                name = os.path.basename(path)
+                digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+                if manifest.get(name) != digest or not os.path.isfile(path):
+                    manifest[name] = digest
+                    pending.append((path, content))
+            rendered = time.monotonic()
+            if len(pending) > ConfigBuilder.WRITERS:
+                with ThreadPoolExecutor(max_workers=ConfigBuilder.WRITERS) as pool:
+                    list(pool.map(ConfigBuilder._write, pending))
+            else:
+                for item in pending:
+                    ConfigBuilder._write(item)
+            if pending:
+                self._save_manifest(manifest)
+            done = time.monotonic()
+        return dict(total=len(renders), written=len(pending),
+                    skipped=len(renders) - len(pending), render_time=rendered - started,
+                    write_time=done - rendered, elapsed=done - started)
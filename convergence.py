@@ -0,0 +1,272 @@
+# pylint: disable=missing-docstring
+import datetime
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+
+LinkEvent = namedtuple("LinkEvent", ["node", "ts", "link", "up"])
+
+_TIMESTAMP = re.compile(r"^\[?(?:(\d{4})-?(\d{2})-?(\d{2})[ T])?(\d{2}):(\d{2}):(\d{2})"
+                        r"(?:[.,](\d{1,6}))?")
+# the link event patterns, also matched on raw bytes by logindex through as_bytes
+LINK_SUBJECT = re.compile(r"\b(?:tunnel|link|edge)s?\b", re.I)
+LINK_ID = re.compile(r"\b[0-9a-f]{8,32}\b")
+LINK_DOWN = re.compile(r"\b(?:disconnected|offline|removed|deleted|down|terminated|failed|"
+                       r"expired)\b", re.I)
+LINK_UP = re.compile(r"\b(?:connected|online|established|up)\b", re.I)
+NODE_DIR = re.compile(r"^dkr(\d+)$")
+
+
+def as_bytes(regex):
+    """ The same ascii pattern compiled to match bytes. """
+    return re.compile(regex.pattern.encode("ascii"), regex.flags & ~re.UNICODE)
+
+
+def parse_time(line, default):
+    """ The timestamp the ipop logger prefixes a record with, or default for continuation lines
+    and lines without one. A time of day without a date is taken to be today. """
+    match = _TIMESTAMP.match(line)
+    if not match:
+        return default
+    year, month, day, hour, minute, sec, frac = match.groups()
+    if year:
+        date = datetime.date(int(year), int(month), int(day))
+    else:
+        date = datetime.date.today()
+    stamp = datetime.datetime(date.year, date.month, date.day, int(hour), int(minute), int(sec))
+    return time.mktime(stamp.timetuple()) + (float("0." + frac) if frac else 0.0)
+
+
+def parse_link_event(node, line, ts):
+    """ Returns a LinkEvent for a log line reporting a tunnel, link or edge coming up or going
+    down, identified by the first hex id on the line, or None. """
+    if not LINK_SUBJECT.search(line):
+        return None
+    link = LINK_ID.search(line)
+    if not link:
+        return None
+    if LINK_DOWN.search(line):
+        return LinkEvent(node, ts, link.group(0), False)
+    if LINK_UP.search(line):
+        return LinkEvent(node, ts, link.group(0), True)
+    return None
+
+
+class LogTailer():
+    """ Follows a set of log files by polling, reading only the bytes appended since the last
+    poll and handing complete lines to a callback. A file is tracked by inode and offset, so when
+    the logger rotates it (renaming ctrl.log to ctrl.log.1 and starting a new ctrl.log) the rest
+    of the renamed file is read from its archive before the new file is read from the start. """
+    CHUNK = 1 << 20
+
+    def __init__(self, on_line):
+        """ on_line(path, line, observed_time) is called for every new complete line. """
+        self.on_line = on_line
+        self.files = {}
+        self.lost_rotations = 0
+
+    def follow(self, path, from_end=False):
+        if path in self.files:
+            return
+        inode, offset = None, 0
+        if from_end:
+            try:
+                stat = os.stat(path)
+                inode, offset = stat.st_ino, stat.st_size
+            except OSError:
+                pass
+        self.files[path] = {"inode": inode, "offset": offset, "pending": b""}
+
+    def _find_archive(self, path, inode):
+        folder, name = os.path.split(path)
+        try:
+            entries = os.listdir(folder)
+        except OSError:
+            return None
+        for entry in entries:
+            if entry != name and entry.startswith(name):
+                archive = os.path.join(folder, entry)
+                try:
+                    if os.stat(archive).st_ino == inode:
+                        return archive
+                except OSError:
+                    continue
+        return None
+
+    def _read(self, path, actual, track, now):
+        with open(actual, "rb") as fle:
+            fle.seek(track["offset"])
+            while True:
+                chunk = fle.read(LogTailer.CHUNK)
+                if not chunk:
+                    break
+                track["offset"] += len(chunk)
+                data = track["pending"] + chunk
+                end = data.rfind(b"\n") + 1
+                track["pending"] = data[end:]
+                for line in data[:end].splitlines():
+                    self.on_line(path, line.decode("utf-8", "replace"), now)
+
+    def poll(self):
+        """ Reads what was appended to every followed file. Returns the number of bytes read. """
+        total = 0
+        now = time.time()
+        for path, track in self.files.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            before = track["offset"]
+            if track["inode"] is not None and (stat.st_ino != track["inode"] or
+                                               stat.st_size < track["offset"]):
+                archive = None
+                if stat.st_ino != track["inode"]:
+                    archive = self._find_archive(path, track["inode"])
+                if archive:
+                    self._read(path, archive, track, now)
+                    total += track["offset"] - before
+                elif stat.st_ino != track["inode"]:
+                    self.lost_rotations += 1
+                track.update(offset=0, pending=b"")
+                before = 0
+            track["inode"] = stat.st_ino
+            if stat.st_size > track["offset"]:
+                self._read(path, path, track, now)
+                total += track["offset"] - before
+        return total
+
+
+class ConvergenceMonitor():
+    """ Tracks the links each node's controller reports up from its log/dkrNNN logs. A node has
+    converged once it has at least min_links links up and no link change has been read from its
+    logs for settle seconds; its time to converge is the logged time of its last change relative
+    to the reference time. The overlay has converged when every expected node has. """
+    LOG_FILES = ("ctrl.log", "tincan_log")
+    SETTLE = 10.0
+    POLL = 0.5
+
+    def __init__(self, logs_dir, nodes, settle=SETTLE, min_links=1):
+        self.logs_dir = logs_dir
+        self.nodes = set(nodes)
+        self.settle = settle
+        self.min_links = min_links
+        self.tailer = LogTailer(self._on_line)
+        self.reference = time.time()
+        self.links = {node: set() for node in self.nodes}
+        self.last_change = {}
+        self.last_seen = {}
+        self.events = 0
+        self.last_ts = {}
+
+    def _node_of(self, path):
+        match = NODE_DIR.match(os.path.basename(os.path.dirname(path)))
+        return int(match.group(1)) if match else None
+
+    def _discover(self, from_end):
+        try:
+            entries = os.listdir(self.logs_dir)
+        except OSError:
+            return
+        for entry in entries:
+            match = NODE_DIR.match(entry)
+            if not match or int(match.group(1)) not in self.nodes:
+                continue
+            for name in ConvergenceMonitor.LOG_FILES:
+                self.tailer.follow(os.path.join(self.logs_dir, entry, name), from_end)
+
+    def mark(self, seed=False):
+        """ Sets the reference time to now and skips everything already logged. With seed the
+        logs are first read for the links each node already has up, and a node that reports no
+        change from then on counts as converged at the reference time, as after churn that
+        left it alone. """
+        self.reference = time.time()
+        self._discover(from_end=not seed)
+        self.tailer.poll()
+        self.events = 0
+        if seed:
+            self.last_change = {node: self.reference for node in self.nodes}
+            self.last_seen = dict(self.last_change)
+        else:
+            self.last_change = {}
+            self.last_seen = {}
+
+    def _on_line(self, path, line, now):
+        node = self._node_of(path)
+        stamp = parse_time(line, self.last_ts.get(path, now))
+        self.last_ts[path] = stamp
+        event = parse_link_event(node, line, stamp)
+        if event is None:
+            return
+        self.events += 1
+        links = self.links.setdefault(node, set())
+        if event.up:
+            links.add(event.link)
+        else:
+            links.discard(event.link)
+        self.last_change[node] = max(self.last_change.get(node, 0.0), event.ts)
+        self.last_seen[node] = now
+
+    def poll(self):
+        self._discover(from_end=False)
+        return self.tailer.poll()
+
+    def converged(self, now=None):
+        """ Maps each converged node to its time to converge in seconds. """
+        now = time.time() if now is None else now
+        done = {}
+        for node in self.nodes:
+            seen = self.last_seen.get(node)
+            if seen is None or len(self.links.get(node, ())) < self.min_links:
+                continue
+            if now - seen >= self.settle:
+                done[node] = max(self.last_change[node] - self.reference, 0.0)
+        return done
+
+    def progress(self, now=None):
+        done = self.converged(now)
+        return "converged {0}/{1} node(s), {2} link(s) up, {3} event(s), t+{4:.1f}s".format(
+            len(done), len(self.nodes), sum(len(links) for links in self.links.values()),
+            self.events, (time.time() if now is None else now) - self.reference)
+
+    def wait(self, timeout, out=None, interval=POLL):
+        """ Polls until the overlay converges or timeout seconds pass, writing a progress line
+        to out, the current sys.stdout by default, whenever it changes. Returns the converged
+        map. """
+        # looked up per call so that a redirected stdout, as the daemon's, gets the lines
+        out = sys.stdout if out is None else out
+        deadline = time.monotonic() + timeout
+        shown = None
+        while True:
+            self.poll()
+            done = self.converged()
+            line = self.progress()
+            if line.rsplit(",", 1)[0] != shown:
+                shown = line.rsplit(",", 1)[0]
+                out.write(line + "\n")
+                out.flush()
+            if len(done) == len(self.nodes) or time.monotonic() >= deadline:
+                return done
+            time.sleep(interval)
+
+    def report(self):
+        done = self.converged()
+        times = sorted(done.values())
+        lines = []
+        if times:
+            lines.append("time to converge per node: min {0:.2f}s median {1:.2f}s p90 {2:.2f}s "
+                         "max {3:.2f}s".format(times[0], times[len(times) // 2],
+                                               times[min(len(times) - 1, len(times) * 9 // 10)],
+                                               times[-1]))
+        if len(done) == len(self.nodes) and times:
+            lines.append("overlay of {0} node(s) converged in {1:.2f}s".format(len(self.nodes),
+                                                                              times[-1]))
+        else:
+            lines.append("overlay not converged, {0}/{1} node(s) pending {2}".format(
+                len(self.nodes) - len(done), len(self.nodes),
+                ["node-{0:03}".format(node) for node in sorted(self.nodes - set(done))]))
+        if self.tailer.lost_rotations:
+            lines.append("{0} log rotation(s) outran the archives, events may be missing"
+                         .format(self.tailer.lost_rotations))
+        return "\n".join(lines)
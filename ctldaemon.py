@@ -0,0 +1,119 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import os
+import signal
+import socket
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+# also in expctl.py, which avoids importing this module
+SOCKET = "experiment.sock"
+
+
+class _Stream():
+    """ Stands in for stdout and stderr while a request runs, forwarding whole lines to the
+    client as they are written. A client that goes away does not stop the command. """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pending = []
+        self.broken = False
+
+    def write(self, text):
+        self.pending.append(text)
+        if "\n" in text:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            data = "".join(self.pending)
+            self.pending = []
+            self.send({"out": data})
+
+    def send(self, msg):
+        if self.broken:
+            return
+        try:
+            self.conn.sendall((json.dumps(msg) + "\n").encode("utf-8"))
+        except OSError:
+            self.broken = True
+
+
+class ControlServer():
+    """ Serves experiment invocations over a unix socket. A request is a json line holding the
+    argv of an invocation, which handler(argv) runs with its output streamed back as json lines
+    and closed by one with the return code. Requests run one at a time in arrival order since
+    they share the experiment. {"op": "shutdown"} stops the server. """
+    BACKLOG = 16
+
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self.running = False
+        self.served = 0
+
+    def _bind(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise OSError("A daemon is already serving {0}".format(self.path))
+            except ConnectionRefusedError:
+                # left behind by a daemon that did not shut down cleanly
+                os.remove(self.path)
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        sock.listen(ControlServer.BACKLOG)
+        return sock
+
+    def _handle(self, conn):
+        line = conn.makefile("rb").readline()
+        try:
+            req = json.loads(line.decode("utf-8"))
+        except ValueError:
+            return
+        out = _Stream(conn)
+        if req.get("op") == "shutdown":
+            self.running = False
+            out.send({"out": "Daemon stopped after {0} request(s)\n".format(self.served),
+                      "rc": 0})
+            return
+        started = time.monotonic()
+        code = 0
+        with redirect_stdout(out), redirect_stderr(out):
+            try:
+                code = self.handler(list(req.get("argv", []))) or 0
+            except SystemExit as err:
+                code = err.code if isinstance(err.code, int) else int(err.code is not None)
+            except Exception: # pylint: disable=broad-except
+                traceback.print_exc()
+                code = 1
+            out.flush()
+        self.served += 1
+        out.send({"rc": code, "elapsed": time.monotonic() - started})
+
+    def serve(self):
+        sock = self._bind()
+        self.running = True
+        previous = signal.signal(signal.SIGTERM, lambda *_: sock.close())
+        try:
+            while self.running:
+                try:
+                    conn, _ = sock.accept()
+                except OSError:
+                    break
+                with conn:
+                    self._handle(conn)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
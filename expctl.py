@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring
+""" Thin client of Experiment.py --daemon. Sends its arguments to the daemon serving the
+current experiment dir and streams back the output, or runs Experiment.py itself when no
+daemon is listening. --shutdown stops the daemon. Imports only what it needs to talk to the
+socket so that a command answers in the time the daemon takes to run it. """
+import json
+import os
+import socket
+import sys
+
+SOCKET = "experiment.sock"
+
+
+def main(argv):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(os.path.join(os.getcwd(), SOCKET))
+    except OSError:
+        sock.close()
+        if argv == ["--shutdown"]:
+            print("No daemon is serving this experiment dir")
+            return 1
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Experiment.py")
+        os.execv(sys.executable, [sys.executable, script] + argv)
+    req = {"op": "shutdown"} if argv == ["--shutdown"] else {"argv": argv}
+    sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+    code = 1
+    for line in sock.makefile("rb"):
+        msg = json.loads(line.decode("utf-8"))
+        if "out" in msg:
+            sys.stdout.write(msg["out"])
+            sys.stdout.flush()
+        if "rc" in msg:
+            code = msg["rc"]
+    sock.close()
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
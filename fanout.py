@@ -0,0 +1,55 @@
+# pylint: disable=missing-docstring
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+NodeResult = namedtuple("NodeResult", ["node", "returncode", "duration", "stdout", "stderr",
+                                       "timed_out"])
+
+
+class FanOut():
+    """ Runs one operation per node on a bounded thread pool and collects a NodeResult for each.
+    The operation is called as op(node, timeout) and must return a CompletedProcess-like object;
+    subprocess.TimeoutExpired raised by it is recorded as a timed out result. """
+    CONCURRENCY = 64
+
+    def __init__(self, concurrency=CONCURRENCY, timeout=None):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+
+    def _call(self, operation, node):
+        started = time.monotonic()
+        try:
+            resp = operation(node, self.timeout)
+        except subprocess.TimeoutExpired as err:
+            return NodeResult(node, -1, time.monotonic() - started, err.stdout or b"",
+                              err.stderr or b"", True)
+        except OSError as err:
+            return NodeResult(node, -1, time.monotonic() - started, b"",
+                              str(err).encode("utf-8"), False)
+        return NodeResult(node, resp.returncode, time.monotonic() - started, resp.stdout or b"",
+                          resp.stderr or b"", False)
+
+    def run(self, operation, nodes):
+        """ Returns the results in the order of nodes. """
+        nodes = list(nodes)
+        if not nodes:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(nodes))) as pool:
+            return list(pool.map(lambda node: self._call(operation, node), nodes))
+
+
+def failed(results):
+    return [res for res in results if res.returncode != 0]
+
+
+def format_report(label, results, node_fmt="node-{0:03}"):
+    """ Builds the "<label>: N/M failed" summary used by the experiment entry points. """
+    fails = failed(results)
+    slowest = max((res.duration for res in results), default=0)
+    timeouts = sum(1 for res in fails if res.timed_out)
+    return "{0}: {1}/{2} failed{3}, slowest {4:.2f}s\n{5}".format(
+        label, len(fails), len(results),
+        " ({0} timed out)".format(timeouts) if timeouts else "", slowest,
+        [node_fmt.format(res.node) for res in fails])
@@ -0,0 +1,162 @@
+# pylint: disable=missing-docstring
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+HostSample = namedtuple("HostSample", ["load", "mem_free", "pid_used", "fd_used", "keys_used"])
+
+
+def _read(path):
+    try:
+        with open(path) as fle:
+            return fle.read()
+    except OSError:
+        return ""
+
+
+def _ratio(used, limit):
+    return used / limit if limit > 0 else 0.0
+
+
+class HostSampler():
+    """ Reads the host's load and resource headroom from /proc. load is the one minute load
+    average per CPU, mem_free the fraction of memory available, and pid_used, fd_used and
+    keys_used the fractions of the task, open file and root key limits (the ones
+    update-limits.sh raises) in use. Missing sources read as fully free. """
+
+    def __init__(self, proc="/proc"):
+        self.proc = proc
+        self.cpus = os.cpu_count() or 1
+
+    def sample(self):
+        loadavg = _read(os.path.join(self.proc, "loadavg")).split()
+        load = float(loadavg[0]) / self.cpus if loadavg else 0.0
+        tasks = int(loadavg[3].split("/")[1]) if len(loadavg) > 3 else 0
+        task_max = min(int(_read(os.path.join(self.proc, "sys/kernel/" + name)) or 1 << 22)
+                       for name in ("pid_max", "threads-max"))
+        meminfo = {}
+        for line in _read(os.path.join(self.proc, "meminfo")).splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                meminfo[fields[0].rstrip(":")] = int(fields[1])
+        mem_free = _ratio(meminfo.get("MemAvailable", 1), meminfo.get("MemTotal", 1))
+        file_nr = _read(os.path.join(self.proc, "sys/fs/file-nr")).split()
+        fd_used = _ratio(int(file_nr[0]), int(file_nr[2])) if len(file_nr) == 3 else 0.0
+        keys_used = 0.0
+        for line in _read(os.path.join(self.proc, "key-users")).splitlines():
+            fields = line.split()
+            if len(fields) >= 4 and fields[0] == "0:":
+                used, limit = fields[3].split("/")
+                keys_used = _ratio(int(used), int(limit))
+        return HostSample(load, mem_free, _ratio(tasks, task_max), fd_used, keys_used)
+
+
+class AdaptiveLauncher():
+    """ Launches instances with a concurrency limit steered by additive increase and
+    multiplicative decrease. After every completed launch the host is sampled; while all of the
+    signals are within bounds the limit grows by one per window of launches, and when any is
+    exceeded it is halved and the number of instances up at that point is recorded as the
+    density the host reached before degrading. Start latency counts as degraded when its moving
+    average exceeds LATENCY_FACTOR times the average of the first launches. """
+    MAX_LOAD = 2.0
+    MIN_MEM_FREE = 0.10
+    MAX_USED = 0.90
+    LATENCY_FACTOR = 3.0
+    BASELINE_LAUNCHES = 5
+    EWMA = 0.3
+
+    def __init__(self, launch, max_concurrency, sampler=None, initial=1, running=0):
+        """ launch(instance) returns (instance, ready, latency); running is the number of
+        instances already up on the host. """
+        self.launch = launch
+        self.max_concurrency = max(1, max_concurrency)
+        self.sampler = sampler or HostSampler()
+        self.limit = float(min(initial, self.max_concurrency))
+        self.in_flight = 0
+        self.next_start = 0
+        self.up = running
+        self.baseline = None
+        self.latency = None
+        self.first_latencies = []
+        self.density = None
+        self.peak_limit = self.limit
+        self.decreases = 0
+        self.history = []
+        self._cond = threading.Condition()
+
+    def degraded(self, sample):
+        """ Returns the reason the host counts as degraded, or None. """
+        if sample.load > AdaptiveLauncher.MAX_LOAD:
+            return "load {0:.2f}/cpu".format(sample.load)
+        if sample.mem_free < AdaptiveLauncher.MIN_MEM_FREE:
+            return "{0:.0%} memory free".format(sample.mem_free)
+        for name in ("pid_used", "fd_used", "keys_used"):
+            if getattr(sample, name) > AdaptiveLauncher.MAX_USED:
+                return "{0} {1:.0%}".format(name, getattr(sample, name))
+        if self.baseline and self.latency > self.baseline * AdaptiveLauncher.LATENCY_FACTOR:
+            return "start latency {0:.2f}s".format(self.latency)
+        return None
+
+    def _completed(self, ready, latency):
+        with self._cond:
+            self.in_flight -= 1
+            if ready:
+                self.up += 1
+                self.latency = latency if self.latency is None else \
+                    AdaptiveLauncher.EWMA * latency + (1 - AdaptiveLauncher.EWMA) * self.latency
+                if self.baseline is None:
+                    self.first_latencies.append(latency)
+                    if len(self.first_latencies) >= AdaptiveLauncher.BASELINE_LAUNCHES:
+                        self.baseline = sum(self.first_latencies) / len(self.first_latencies)
+            sample = self.sampler.sample()
+            reason = self.degraded(sample) if ready else "launch failed"
+            if reason:
+                if self.density is None and ready:
+                    self.density = (self.up, reason, sample)
+                self.limit = max(1.0, self.limit / 2)
+                self.decreases += 1
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.peak_limit = max(self.peak_limit, self.limit)
+            self.history.append((time.monotonic(), self.limit, latency, sample))
+            self._cond.notify_all()
+
+    def _run_one(self, ticket, instance):
+        with self._cond:
+            # launches start in sequence order, whichever worker thread holds them
+            while ticket != self.next_start or self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            self.next_start += 1
+            self._cond.notify_all()
+        try:
+            result = self.launch(instance)
+        except Exception:
+            self._completed(False, 0.0)
+            raise
+        self._completed(result[1], result[2])
+        return result
+
+    def run(self, sequence):
+        """ Launches the sequence in order and returns the launch results in the same order. """
+        sequence = list(sequence)
+        if not sequence:
+            return []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            return list(pool.map(self._run_one, range(len(sequence)), sequence))
+
+    def summary(self):
+        lines = ["adaptive launch: limit peaked at {0:.1f}, ended at {1:.1f}, {2} decrease(s)"
+                 .format(self.peak_limit, self.limit, self.decreases)]
+        if self.baseline:
+            lines.append("start latency baseline {0:.2f}s, last average {1:.2f}s"
+                         .format(self.baseline, self.latency))
+        if self.density:
+            up, reason, sample = self.density
+            lines.append("host degraded at {0} running instance(s) ({1}; load {2:.2f}/cpu, "
+                         "{3:.0%} memory free)".format(up, reason, sample.load, sample.mem_free))
+        else:
+            lines.append("no degradation observed up to {0} running instance(s)".format(self.up))
+        return "\n".join(lines)
@@ -0,0 +1,239 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import bisect
+import heapq
+import mmap
+import os
+import re
+import struct
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+from convergence import LINK_DOWN, LINK_ID, LINK_SUBJECT, LINK_UP, NODE_DIR, as_bytes, parse_time
+
+TYPES = ("other", "debug", "info", "warning", "error", "link-up", "link-down")
+
+LogEvent = namedtuple("LogEvent", ["ts", "node", "type", "path", "text"])
+
+# ts, offset << 8 | type
+RECORD = struct.Struct("<dQ")
+
+_RECORD_START = re.compile(rb"^\[?((?:\d{4}-?\d{2}-?\d{2}[ T])?\d{2}:\d{2}:\d{2})(?:[.,](\d{1,6}))?"
+                           rb"([^\n]*)", re.M)
+_LEVEL = re.compile(rb"\b(DEBUG|INFO|WARNING|WARN|ERROR|CRITICAL)\b")
+_SUBJECT, _LINK_ID, _DOWN, _UP = (as_bytes(rgx) for rgx in (LINK_SUBJECT, LINK_ID, LINK_DOWN,
+                                                               LINK_UP))
+_LEVEL_TYPE = {b"DEBUG": 1, b"INFO": 2, b"WARNING": 3, b"WARN": 3, b"ERROR": 4, b"CRITICAL": 4}
+
+
+@lru_cache(maxsize=1 << 12)
+def _stamp(text):
+    """ Cached on the whole seconds, the fraction is added by the caller. """
+    return parse_time(text.decode("ascii"), None)
+
+
+def classify(line):
+    """ The TYPES index of a log record from its first line, link events before levels. """
+    # substring checks first, they rule out most lines far quicker than the regexes
+    if (b"unnel" in line or b"ink" in line or b"dge" in line) and _SUBJECT.search(line) and \
+            _LINK_ID.search(line):
+        if _DOWN.search(line):
+            return 6
+        if _UP.search(line):
+            return 5
+    level = _LEVEL.search(line)
+    return _LEVEL_TYPE[level.group(1)] if level else 0
+
+
+def _mapped(path):
+    """ A read only mmap of the file, or None when it is empty. """
+    with open(path, "rb") as fle:
+        if os.fstat(fle.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(fle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class LogIndex():
+    """ An on-disk index of the records in every ctrl.log and tincan_log (and their rotated
+    archives) under a logs dir. Each log file gets a .idx file of fixed size records holding a
+    record's timestamp, byte offset and event type, named after the file's inode so a rotated
+    file keeps its index under its new name. Indexing resumes from the last offset reached, and
+    queries binary search the memory-mapped index files and read the matching records straight
+    out of the memory-mapped logs. Records are assumed to be in time order within a file. """
+    LOG_FILES = ("ctrl.log", "tincan_log")
+    META = "meta.json"
+
+    def __init__(self, logs_dir, index_dir=None):
+        self.logs_dir = logs_dir
+        self.index_dir = index_dir or os.path.join(logs_dir, ".index")
+        self.meta = {}
+        meta_file = os.path.join(self.index_dir, LogIndex.META)
+        if os.path.isfile(meta_file):
+            with open(meta_file) as mfl:
+                self.meta = json.load(mfl)
+
+    def _idx_file(self, key):
+        return os.path.join(self.index_dir, key + ".idx")
+
+    def sources(self):
+        """ Yields (path, node) for every log file in the tree. """
+        try:
+            entries = sorted(os.listdir(self.logs_dir))
+        except OSError:
+            return
+        for entry in entries:
+            match = NODE_DIR.match(entry)
+            node_dir = os.path.join(self.logs_dir, entry)
+            if not match or not os.path.isdir(node_dir):
+                continue
+            for name in sorted(os.listdir(node_dir)):
+                if name.startswith(LogIndex.LOG_FILES):
+                    yield os.path.join(node_dir, name), int(match.group(1))
+
+    def update(self):
+        """ Indexes the bytes appended since the last update. Returns (files, records added). """
+        os.makedirs(self.index_dir, exist_ok=True)
+        seen = {}
+        added = 0
+        for path, node in self.sources():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = "{0}-{1}".format(stat.st_dev, stat.st_ino)
+            entry = self.meta.get(key, {"offset": 0, "records": 0})
+            if stat.st_size < entry["offset"]:
+                entry = {"offset": 0, "records": 0}
+                if os.path.isfile(self._idx_file(key)):
+                    os.remove(self._idx_file(key))
+            entry.update(path=path, node=node)
+            if stat.st_size > entry["offset"]:
+                added += self._index_file(key, entry)
+            seen[key] = entry
+        for key in set(self.meta) - set(seen):
+            if os.path.isfile(self._idx_file(key)):
+                os.remove(self._idx_file(key))
+        self.meta = seen
+        tmp = os.path.join(self.index_dir, LogIndex.META + ".tmp")
+        with open(tmp, "w") as mfl:
+            json.dump(self.meta, mfl)
+        os.replace(tmp, os.path.join(self.index_dir, LogIndex.META))
+        return len(seen), added
+
+    def _index_file(self, key, entry):
+        data = _mapped(entry["path"])
+        if data is None:
+            return 0
+        try:
+            # only complete lines are indexed, a partly written one is picked up next time
+            end = data.rfind(b"\n", entry["offset"]) + 1
+            if end <= entry["offset"]:
+                return 0
+            out = bytearray()
+            count = 0
+            for match in _RECORD_START.finditer(data, entry["offset"], end):
+                seconds, frac, line = match.groups()
+                stamp = _stamp(seconds)
+                if stamp is None:
+                    continue
+                if frac:
+                    stamp += int(frac) / 10 ** len(frac)
+                out += RECORD.pack(stamp, (match.start() << 8) | classify(line))
+                count += 1
+        finally:
+            data.close()
+        with open(self._idx_file(key), "ab") as ifl:
+            # drop records of an update that did not commit its meta
+            ifl.truncate(entry["records"] * RECORD.size)
+            ifl.write(out)
+        entry["offset"] = end
+        entry["records"] += count
+        return count
+
+    def _scan(self, key, entry, kinds, start, end):
+        """ Yields the LogEvents of one file with a type in kinds and start <= ts <= end. """
+        if not entry["records"] or not os.path.isfile(self._idx_file(key)):
+            return
+        index = _mapped(self._idx_file(key))
+        data = _mapped(entry["path"])
+        if index is None or data is None:
+            return
+        try:
+            count = min(entry["records"], len(index) // RECORD.size)
+            stamps = _Stamps(index, count)
+            pos = bisect.bisect_left(stamps, start)
+            while pos < count:
+                stamp, word = RECORD.unpack_from(index, pos * RECORD.size)
+                if stamp > end:
+                    break
+                if word & 0xff in kinds:
+                    offset = word >> 8
+                    if pos + 1 < count:
+                        nxt = RECORD.unpack_from(index, (pos + 1) * RECORD.size)[1] >> 8
+                    else:
+                        nxt = entry["offset"]
+                    text = data[offset:nxt].decode("utf-8", "replace").rstrip("\n")
+                    yield LogEvent(stamp, entry["node"], TYPES[word & 0xff], entry["path"], text)
+                pos += 1
+        finally:
+            index.close()
+            data.close()
+
+    def query(self, types=None, start=None, end=None, nodes=None):
+        """ All records of the given types (names from TYPES, None for all) with a timestamp in
+        [start, end] across the selected nodes, merged in time order. """
+        kinds = set(range(len(TYPES))) if not types else set(TYPES.index(kind) for kind in types)
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        streams = [self._scan(key, entry, kinds, start, end) for key, entry in self.meta.items()
+                   if nodes is None or entry["node"] in nodes]
+        return heapq.merge(*streams)
+
+
+class _Stamps():
+    """ Sequence view of the timestamps in a mapped index, for bisect. """
+    __slots__ = ("index", "count")
+
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, pos):
+        return RECORD.unpack_from(self.index, pos * RECORD.size)[0]
+
+
+def parse_query(spec):
+    """ Parses "type[|type...][,start[,end]]" where the times are epoch seconds or
+    "YYYY-MM-DD HH:MM:SS" local times. Returns (types, start, end). """
+    fields = [field.strip() for field in spec.split(",")]
+    types = [kind for kind in fields[0].split("|") if kind and kind != "all"]
+    for kind in types:
+        if kind not in TYPES:
+            raise ValueError("Unknown event type {0}, expected one of {1}".format(kind, TYPES))
+    bounds = []
+    for field in fields[1:3]:
+        if not field:
+            bounds.append(None)
+            continue
+        try:
+            bounds.append(float(field))
+        except ValueError:
+            stamp = parse_time(field, None)
+            if stamp is None:
+                raise ValueError("Invalid time {0}".format(field))
+            bounds.append(stamp)
+    bounds += [None] * (2 - len(bounds))
+    return types, bounds[0], bounds[1]
+
+
+def format_event(event):
+    return "{0}.{1:03d} node-{2:03} {3:<9} {4}".format(
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.ts)),
+        int(event.ts * 1000) % 1000, event.node, event.type, event.text)
@@ -0,0 +1,94 @@
+# pylint: disable=missing-docstring
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+from fanout import FanOut, format_report
+
+Case = namedtuple("Case", ["inst", "src", "dst"])
+
+
+def read_cases(path):
+    """ Reads a host case file, one "<instance> <src ip> <dst ip>" line per case. """
+    cases = []
+    with open(path) as fle:
+        for line in fle:
+            fields = line.split()
+            if len(fields) == 3:
+                cases.append(Case(int(fields[0]), fields[1], fields[2]))
+    return cases
+
+
+def schedule_rounds(cases):
+    """ Groups the cases into rounds in which no node is the source or destination of more than
+    one case. Each case goes to the earliest round in which both of its nodes are free, tracked
+    as a bitmask of occupied rounds per node. """
+    busy = {}
+    rounds = []
+    for case in cases:
+        occupied = busy.get(case.src, 0) | busy.get(case.dst, 0)
+        free = ~occupied
+        rnd = (free & -free).bit_length() - 1
+        busy[case.src] = busy.get(case.src, 0) | (1 << rnd)
+        busy[case.dst] = busy.get(case.dst, 0) | (1 << rnd)
+        if rnd == len(rounds):
+            rounds.append([])
+        rounds[rnd].append(case)
+    return rounds
+
+
+class LinkUtilizationRunner():
+    """ Runs the lu.sh iping probe (ping then iperf from the source container) for every case,
+    concurrently within each round, and appends each probe's output to the ping and iperf result
+    logs in the data dir as soon as that case finishes. """
+    PING_LOG = "ping-results.log"
+    IPERF_LOG = "iperf-resulst.log"
+
+    def __init__(self, exec_cmd, data_dir, concurrency=FanOut.CONCURRENCY, timeout=None,
+                 verbose=False):
+        """ exec_cmd(cmd_line, instance, timeout) runs a command in the instance's container. """
+        self.exec_cmd = exec_cmd
+        self.data_dir = data_dir
+        self.fanout = FanOut(concurrency, timeout)
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._ping_log = None
+        self._iperf_log = None
+
+    def _probe(self, case, timeout):
+        started = time.time()
+        self.exec_cmd(["ping", "-c1", case.dst], case.inst, timeout)
+        ping = self.exec_cmd(["ping", "-c5", "-nq", case.dst], case.inst, timeout)
+        iperf = self.exec_cmd(["iperf", "-c", case.dst, "-e", "-yC"], case.inst, timeout)
+        with self._lock:
+            self._ping_log.write("### {0:.3f} {1:03} {2} {3}\n".format(started, case.inst,
+                                                                      case.src, case.dst))
+            self._ping_log.write(ping.stdout.decode("utf-8", "replace"))
+            self._ping_log.flush()
+            self._iperf_log.write(iperf.stdout.decode("utf-8", "replace"))
+            self._iperf_log.flush()
+        returncode = ping.returncode or iperf.returncode
+        return subprocess.CompletedProcess(case, returncode, ping.stdout + iperf.stdout,
+                                           ping.stderr + iperf.stderr)
+
+    def run(self, cases):
+        rounds = schedule_rounds(cases)
+        results = []
+        started = time.monotonic()
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open(os.path.join(self.data_dir, LinkUtilizationRunner.PING_LOG), "a") as ping_log, \
+             open(os.path.join(self.data_dir, LinkUtilizationRunner.IPERF_LOG), "a") as iperf_log:
+            self._ping_log, self._iperf_log = ping_log, iperf_log
+            for num, rnd in enumerate(rounds):
+                rnd_results = self.fanout.run(self._probe, rnd)
+                results += rnd_results
+                if self.verbose:
+                    print("round {0}/{1}: {2} case(s) in {3:.2f}s".format(
+                        num + 1, len(rounds), len(rnd),
+                        max(res.duration for res in rnd_results)))
+        print(format_report("link utilization", results, node_fmt="{0.inst:03} {0.src}->{0.dst}"))
+        print("{0} case(s) in {1} round(s), {2:.2f}s".format(len(results), len(rounds),
+                                                            time.monotonic() - started))
+        return results
@@ -0,0 +1,218 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+Host = namedtuple("Host", ["name", "address", "capacity", "exp_dir", "executor"])
+HostResult = namedtuple("HostResult", ["host", "range_start", "range_end", "returncode",
+                                       "duration", "output"])
+
+_FAIL_LINE = re.compile(r"^(.*): (\d+)/(\d+) failed")
+_COUNT_LINE = re.compile(r"^(\d+) (container\(s\) instantiated|Docker container\(s\) terminated)")
+
+
+def load_inventory(inventory_file):
+    """ The inventory is a json file of the form
+    {"hosts": [{"name": "node1", "address": "192.168.1.1", "capacity": 25,
+                "exp_dir": "~/workspace/experiment", "executor": "ssh"}, ...]}
+    address, exp_dir and executor are optional; executor defaults to local. """
+    with open(inventory_file) as inv:
+        hosts = json.load(inv)["hosts"]
+    return [Host(hst["name"], hst.get("address", hst["name"]), int(hst["capacity"]),
+                 hst.get("exp_dir"), hst.get("executor", "local")) for hst in hosts]
+
+
+def partition(range_start, range_end, hosts):
+    """ Splits [range_start, range_end) into contiguous shards sized in proportion to each host's
+    capacity. Returns a list of (host, shard_start, shard_end), omitting hosts given no nodes. """
+    total = range_end - range_start
+    capacity = sum(hst.capacity for hst in hosts)
+    if total > capacity:
+        raise ValueError("Range of {0} instances exceeds the inventory capacity of {1}"
+                         .format(total, capacity))
+    quotas = [total * hst.capacity / capacity for hst in hosts]
+    sizes = [int(quota) for quota in quotas]
+    by_remainder = sorted(range(len(hosts)), key=lambda i: quotas[i] - sizes[i], reverse=True)
+    for i in by_remainder[:total - sum(sizes)]:
+        sizes[i] += 1
+    shards = []
+    start = range_start
+    for hst, size in zip(hosts, sizes):
+        if size:
+            shards.append((hst, start, start + size))
+        start += size
+    return shards
+
+
+class LocalExecutor():
+    """ Simulates a host by running Experiment.py in a per host directory on this machine. The
+    templates and the test data dir are linked from the orchestrating experiment dir. """
+    SHARED = ["template-config.json", "template-bf-config.json", "test-link-utilization"]
+
+    def __init__(self, exp_dir):
+        self.exp_dir = exp_dir
+        self.script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Experiment.py")
+
+    def host_dir(self, host):
+        return host.exp_dir or os.path.join(self.exp_dir, "hosts", host.name)
+
+    def _prepare(self, host_dir):
+        os.makedirs(host_dir, exist_ok=True)
+        for name in LocalExecutor.SHARED:
+            src = os.path.join(self.exp_dir, name)
+            dst = os.path.join(host_dir, name)
+            if os.path.exists(src) and not os.path.lexists(dst):
+                os.symlink(src, dst)
+
+    def run(self, host, args, timeout=None, work_dir=None):
+        """ Runs in work_dir, when given, instead of the host's dir, which is set up first. """
+        if work_dir is None:
+            work_dir = self.host_dir(host)
+            self._prepare(work_dir)
+        return subprocess.run([sys.executable, self.script] + args, cwd=work_dir,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+
+    def put(self, host, name, data):
+        """ Writes data to the named file in the host's dir. """
+        host_dir = self.host_dir(host)
+        self._prepare(host_dir)
+        with open(os.path.join(host_dir, name), "wb") as fle:
+            fle.write(data)
+
+
+class SshExecutor():
+    """ Runs Experiment.py in the host's experiment dir over ssh. """
+    EXP_DIR = "~/workspace/experiment"
+
+    def __init__(self, exp_dir):
+        self.exp_dir = exp_dir
+
+    @staticmethod
+    def host_dir(host):
+        return host.exp_dir or SshExecutor.EXP_DIR
+
+    def run(self, host, args, timeout=None, work_dir=None):
+        """ work_dir is a dir on the host to run in instead of its experiment dir. Neither is
+        quoted, so that ~ expands. """
+        remote = "cd {0} && python3 {1}/Experiment.py {2}".format(
+            work_dir or self.host_dir(host), self.host_dir(host),
+            " ".join(shlex.quote(arg) for arg in args))
+        return subprocess.run(["ssh", "-o", "BatchMode=yes", host.address, remote],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+
+    def put(self, host, name, data):
+        """ Writes data to the named file in the host's experiment dir. """
+        subprocess.run(["ssh", "-o", "BatchMode=yes", host.address, "cat > {0}/{1}".format(
+            self.host_dir(host), shlex.quote(name))], input=data, stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT, check=True)
+
+
+EXECUTORS = {"local": LocalExecutor, "ssh": SshExecutor}
+
+
+def invoke(executor, host, args, timeout=None, work_dir=None):
+    """ Runs Experiment.py with args through the executor and returns (returncode, output),
+    with a returncode of -1 when it timed out or could not be started. """
+    try:
+        resp = executor.run(host, args, timeout, work_dir)
+        return resp.returncode, resp.stdout.decode("utf-8", "replace")
+    except subprocess.TimeoutExpired as err:
+        return -1, (err.output or b"").decode("utf-8", "replace") + "\nTimed out\n"
+    except OSError as err:
+        return -1, str(err)
+
+
+def strip_args(argv, options):
+    """ Removes the given options and their values from an argument list. """
+    out = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in options:
+            skip = True
+        elif not any(arg.startswith(opt + "=") for opt in options):
+            out.append(arg)
+    return out
+
+
+class Orchestrator():
+    """ Drives one experiment range sharded across the hosts of an inventory. Every host runs
+    the same Experiment.py command on its own shard, concurrently, and the per host reports are
+    merged into one. """
+
+    def __init__(self, inventory_file, exp_dir, verbose=False):
+        self.hosts = load_inventory(inventory_file)
+        self.exp_dir = exp_dir
+        self.verbose = verbose
+        self._executors = {}
+
+    def executor(self, kind):
+        if kind not in self._executors:
+            self._executors[kind] = EXECUTORS[kind](self.exp_dir)
+        return self._executors[kind]
+
+    def _run_shard(self, shard, args, timeout, cases):
+        host, start, end = shard
+        shard_args = args + ["--range", "{0},{1}".format(start, end)]
+        started = time.monotonic()
+        executor = self.executor(host.executor)
+        if cases:
+            name = os.path.basename(cases[host.name])
+            try:
+                with open(cases[host.name], "rb") as fle:
+                    executor.put(host, name, fle.read())
+            except (OSError, subprocess.CalledProcessError) as err:
+                return HostResult(host, start, end, -1, time.monotonic() - started,
+                                  "Copying {0} failed: {1}".format(name, err))
+            shard_args += ["--cases", name]
+        returncode, output = invoke(executor, host, shard_args, timeout)
+        return HostResult(host, start, end, returncode, time.monotonic() - started, output)
+
+    def run(self, argv, range_start, range_end, timeout=None, cases=None):
+        """ cases maps every host name to a case file made for it here, which is copied to the
+        host and run there with --cases. """
+        args = strip_args(argv, ("--hosts", "--range"))
+        shards = partition(range_start, range_end, self.hosts)
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(pool.map(lambda shard: self._run_shard(shard, args, timeout, cases),
+                                    shards))
+        print(self.merge_reports(results))
+        return results
+
+    def merge_reports(self, results):
+        fails = OrderedDict()
+        counts = OrderedDict()
+        lines = []
+        for res in results:
+            if self.verbose or res.returncode != 0:
+                lines.append("==== {0} [{1},{2}) rc={3} {4:.2f}s ====\n{5}".format(
+                    res.host.name, res.range_start, res.range_end, res.returncode,
+                    res.duration, res.output.rstrip()))
+            for line in res.output.splitlines():
+                match = _FAIL_LINE.match(line)
+                if match:
+                    failed, total = fails.get(match.group(1), (0, 0))
+                    fails[match.group(1)] = (failed + int(match.group(2)),
+                                             total + int(match.group(3)))
+                match = _COUNT_LINE.match(line)
+                if match:
+                    counts[match.group(2)] = counts.get(match.group(2), 0) + int(match.group(1))
+        for label, (failed, total) in fails.items():
+            lines.append("{0}: {1}/{2} failed".format(label, failed, total))
+        for label, count in counts.items():
+            lines.append("{0} {1}".format(count, label))
+        host_fails = [res.host.name for res in results if res.returncode != 0]
+        lines.append("{0}/{1} host(s) failed {2}, slowest {3:.2f}s".format(
+            len(host_fails), len(results), host_fails,
+            max((res.duration for res in results), default=0)))
+        return "\n".join(lines)
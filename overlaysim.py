@@ -0,0 +1,428 @@
+# pylint: disable=missing-docstring
+import bisect
+import heapq
+import math
+import random
+import time
+from array import array
+from collections import OrderedDict, deque, namedtuple
+
+TopologyParams = namedtuple("TopologyParams", ["max_successors", "max_long_edges",
+                                               "max_ondemand", "max_concurrent_setup",
+                                               "demand_threshold"])
+
+JOIN = 0
+SETUP_DONE = 1
+REFRESH = 2
+FLOW = 3
+
+_UNITS = {"": 1, "K": 1e3, "M": 1e6, "G": 1e9}
+
+
+def parse_rate(text):
+    """ Bits per second from a DemandThreshold style value such as "100M". """
+    text = str(text).strip().upper().rstrip("BPS")
+    if text and text[-1] in _UNITS:
+        return float(text[:-1]) * _UNITS[text[-1]]
+    return float(text)
+
+
+def topology_params(node_cfg, bf_cfg):
+    """ Reads the parameters the simulator models from a node config and the bf config. """
+    olid = node_cfg["CFx"]["Overlays"][0]
+    topo = node_cfg.get("Topology", {}).get("Overlays", {}).get(olid, {})
+    return TopologyParams(int(topo.get("MaxSuccessors", 2)),
+                          int(topo.get("MaxLongDistEdges", 4)),
+                          int(topo.get("MaxOnDemandEdges", 1)),
+                          int(topo.get("MaxConcurrentEdgeSetup", 2)),
+                          parse_rate(bf_cfg.get("DemandThreshold", "100M")))
+
+
+def parse_params(spec):
+    """ Parses "key=value,..." overrides of OverlaySimulator.DEFAULTS. """
+    params = dict(OverlaySimulator.DEFAULTS)
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        key, _, val = item.partition("=")
+        key = key.strip()
+        if key not in params:
+            raise ValueError("Unknown simulation parameter {0}, expected one of {1}"
+                             .format(key, sorted(params)))
+        params[key] = type(params[key])(val)
+    return params
+
+
+def _percentiles(values, pcts=(50, 90, 99)):
+    ordered = sorted(values)
+    if not ordered:
+        return [0.0] * len(pcts)
+    return [ordered[min(len(ordered) - 1, len(ordered) * pct // 100)] for pct in pcts]
+
+
+class _Online():
+    """ The set of online ring positions as a Fenwick tree, answering "the k-th online node
+    clockwise from p" in O(log n). """
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = array("i", [0]) * (size + 1)
+        self.count = 0
+        self.top = 1 << size.bit_length()
+
+    def add(self, pos):
+        self.count += 1
+        pos += 1
+        while pos <= self.size:
+            self.tree[pos] += 1
+            pos += pos & -pos
+
+    def _prefix(self, pos):
+        """ Number of online positions < pos. """
+        total = 0
+        while pos > 0:
+            total += self.tree[pos]
+            pos -= pos & -pos
+        return total
+
+    def _kth(self, rank):
+        """ Position of the rank-th (0 based) online node in ring order. """
+        pos = 0
+        step = self.top
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= rank:
+                pos = nxt
+                rank -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+    def after(self, pos, count, inclusive=False):
+        """ Up to count online positions clockwise from pos, pos itself excluded unless
+        inclusive. """
+        if self.count == 0:
+            return []
+        start = self._prefix(pos if inclusive else pos + 1)
+        out = []
+        for step in range(min(count, self.count)):
+            found = self._kth((start + step) % self.count)
+            if found == pos and not inclusive:
+                break
+            out.append(found)
+        return out
+
+    def __contains__(self, pos):
+        return self._prefix(pos + 1) - self._prefix(pos) == 1
+
+    def before(self, pos, count):
+        if self.count == 0:
+            return []
+        start = self._prefix(pos)
+        out = []
+        for step in range(1, min(count, self.count) + 1):
+            found = self._kth((start - step) % self.count)
+            if found == pos:
+                break
+            out.append(found)
+        return out
+
+
+class OverlaySimulator():
+    """ Discrete-event model of a SymphonyRing overlay forming as its nodes come online, and of
+    BoundedFlood broadcast over the result. Nodes are identified by their ring position (rank
+    of NodeId). Each node wants edges to its MaxSuccessors online successors, MaxLongDistEdges
+    Symphony long distance peers drawn from the harmonic distribution when it joins, and up to
+    MaxOnDemandEdges peers it sends more than DemandThreshold to. An edge takes a random setup
+    time and a node negotiates at most MaxConcurrentEdgeSetup edges at a time. A node whose
+    successors change on a join picks that up at its next topology refresh and drops edges
+    that neither endpoint wants any more. The final overlay is kept as CSR arrays. """
+    DEFAULTS = OrderedDict([
+        ("boot", 10.0),         # seconds from a node's launch until its controller is online
+        ("setup_min", 1.0),     # seconds an edge takes to set up, uniform in [min, max]
+        ("setup_max", 3.0),
+        ("refresh", 30.0),      # topology refresh interval
+        ("signal_msgs", 4),     # signalling messages per edge setup
+        ("sources", 8),         # broadcast sources sampled for message counts and stretch
+        ("flows", 0),           # unicast flows drawn to exercise on-demand edges
+        ("flow_rate", 50e6),    # median flow rate, log-normal with sigma 1
+    ])
+
+    def __init__(self, node_ids, join_times, topo, params=None, seed=None):
+        """ node_ids are the hex NodeIds and join_times the time each comes online. """
+        self.topo = topo
+        self.params = dict(OverlaySimulator.DEFAULTS, **(params or {}))
+        self.rand = random.Random(seed)
+        order = sorted(range(len(node_ids)), key=lambda idx: int(node_ids[idx], 16))
+        self.size = len(node_ids)
+        if self.params["flows"] > 0 and self.size < 2:
+            raise ValueError("Simulating {0} flow(s) needs at least 2 nodes, not {1}"
+                             .format(int(self.params["flows"]), self.size))
+        self.pos_of = array("i", [0]) * self.size
+        for rank, idx in enumerate(order):
+            self.pos_of[idx] = rank
+        self.join_time = array("d", [0.0]) * self.size
+        for idx, stamp in enumerate(join_times):
+            self.join_time[self.pos_of[idx]] = stamp
+        self.online = _Online(self.size)
+        self.adj = [set() for _ in range(self.size)]
+        self.want = [set() for _ in range(self.size)]
+        self.long = [()] * self.size
+        self.ondemand = [set() for _ in range(self.size)]
+        self.pending = {}
+        self.inflight = array("i", [0]) * self.size
+        self.backlog = [None] * self.size
+        self.refreshing = set()
+        self.last_change = array("d", [-1.0]) * self.size
+        self.counts = dict(events=0, setups=0, teardowns=0, ondemand=0, flows_over=0)
+        self.events = []
+        self.seq = 0
+        self.now = 0.0
+        self.offsets = None
+        self.neighbors = None
+
+    def _push(self, when, kind, node, peer=-1):
+        self.seq += 1
+        heapq.heappush(self.events, (when, self.seq, kind, node, peer))
+
+    def _successors(self, pos):
+        return self.online.after(pos, self.topo.max_successors)
+
+    def _long_edges(self, pos):
+        """ Symphony: peers at a harmonic distributed fraction of the ring, estimated from the
+        number of nodes online. """
+        peers = set()
+        estimate = max(self.online.count, 2)
+        for _ in range(self.topo.max_long_edges):
+            frac = math.exp(math.log(estimate) * (self.rand.random() - 1.0))
+            target = (pos + max(1, int(frac * self.size))) % self.size
+            found = self.online.after(target, 1, inclusive=True)
+            if found and found[0] != pos:
+                peers.add(found[0])
+        return tuple(peers)
+
+    def _changed(self, node):
+        self.last_change[node] = self.now
+
+    def _request(self, node):
+        """ Starts setting up wanted edges of node up to its concurrency limit. """
+        backlog = self.backlog[node]
+        if backlog is None:
+            return
+        while backlog and self.inflight[node] < self.topo.max_concurrent_setup:
+            peer = backlog.popleft()
+            key = (node, peer) if node < peer else (peer, node)
+            if peer in self.adj[node] or key in self.pending or peer not in self.want[node]:
+                continue
+            self.pending[key] = node
+            self.inflight[node] += 1
+            self.counts["setups"] += 1
+            self._push(self.now + self.rand.uniform(self.params["setup_min"],
+                                                    self.params["setup_max"]),
+                       SETUP_DONE, node, peer)
+
+    def _set_want(self, node, want):
+        dropped = self.want[node] - want
+        added = want - self.want[node]
+        self.want[node] = want
+        for peer in dropped:
+            if peer in self.adj[node] and node not in self.want[peer]:
+                self.adj[node].discard(peer)
+                self.adj[peer].discard(node)
+                self.counts["teardowns"] += 1
+                self._changed(node)
+                self._changed(peer)
+        if added:
+            if self.backlog[node] is None:
+                self.backlog[node] = deque()
+            self.backlog[node].extend(sorted(added))
+            self._request(node)
+
+    def _join(self, node):
+        self.online.add(node)
+        self.long[node] = self._long_edges(node)
+        self._changed(node)
+        self._set_want(node, set(self._successors(node)) | set(self.long[node]) |
+                       self.ondemand[node])
+        # the nodes that now have this one among their successors
+        for pred in self.online.before(node, self.topo.max_successors):
+            if pred not in self.refreshing:
+                self.refreshing.add(pred)
+                self._push(self.now + self.rand.uniform(0, self.params["refresh"]), REFRESH,
+                           pred)
+
+    def _setup_done(self, node, peer):
+        key = (node, peer) if node < peer else (peer, node)
+        self.pending.pop(key, None)
+        self.inflight[node] -= 1
+        if peer in self.want[node] or node in self.want[peer]:
+            if peer not in self.adj[node]:
+                self.adj[node].add(peer)
+                self.adj[peer].add(node)
+                self._changed(node)
+                self._changed(peer)
+        self._request(node)
+
+    def _refresh(self, node):
+        self.refreshing.discard(node)
+        self._set_want(node, set(self._successors(node)) | set(self.long[node]) |
+                       self.ondemand[node])
+
+    def _flow(self, node, peer, rate):
+        if rate <= self.topo.demand_threshold:
+            return
+        self.counts["flows_over"] += 1
+        if len(self.ondemand[node]) >= self.topo.max_ondemand or \
+                len(self.ondemand[peer]) >= self.topo.max_ondemand or peer in self.want[node]:
+            return
+        self.ondemand[node].add(peer)
+        self.ondemand[peer].add(node)
+        self.counts["ondemand"] += 1
+        self._set_want(node, self.want[node] | {peer})
+
+    def run(self):
+        """ Forms the overlay and returns the report dict. """
+        started = time.monotonic()
+        for node in range(self.size):
+            self._push(self.join_time[node], JOIN, node)
+        last_join = max(self.join_time) if self.size else 0.0
+        for _ in range(int(self.params["flows"])):
+            src, dst = self.rand.sample(range(self.size), 2)
+            rate = self.params["flow_rate"] * math.exp(self.rand.gauss(0, 1))
+            self._push(self.rand.uniform(0, last_join), FLOW, src, (dst, rate))
+        while self.events:
+            when, _, kind, node, peer = heapq.heappop(self.events)
+            self.now = when
+            self.counts["events"] += 1
+            if kind == JOIN:
+                self._join(node)
+            elif kind == SETUP_DONE:
+                self._setup_done(node, peer)
+            elif kind == REFRESH:
+                self._refresh(node)
+            elif node in self.online and peer[0] in self.online:
+                self._flow(node, peer[0], peer[1])
+        formed = time.monotonic()
+        self._build_csr()
+        report = self._formation_report(last_join)
+        report.update(self._broadcast_report())
+        report["sim_seconds"] = {"formation": formed - started,
+                                 "broadcast": time.monotonic() - formed}
+        return report
+
+    def _build_csr(self):
+        self.offsets = array("l", [0]) * (self.size + 1)
+        self.neighbors = array("i")
+        for node in range(self.size):
+            self.neighbors.extend(sorted(self.adj[node]))
+            self.offsets[node + 1] = len(self.neighbors)
+        self.adj = None
+
+    def _formation_report(self, last_join):
+        degrees = [self.offsets[node + 1] - self.offsets[node] for node in range(self.size)]
+        ttc = [self.last_change[node] - self.join_time[node] for node in range(self.size)]
+        converged = max(self.last_change) if self.size else 0.0
+        p50, p90, p99 = _percentiles(ttc)
+        return {
+            "nodes": self.size,
+            "edges": len(self.neighbors) // 2,
+            "degree": {"mean": sum(degrees) / max(self.size, 1), "max": max(degrees, default=0)},
+            "edge_setups": self.counts["setups"],
+            "edge_teardowns": self.counts["teardowns"],
+            "control_messages": self.counts["setups"] * int(self.params["signal_msgs"]) +
+                                self.counts["teardowns"],
+            "ondemand_edges": self.counts["ondemand"],
+            "flows_over_threshold": self.counts["flows_over"],
+            "events": self.counts["events"],
+            "last_join": last_join,
+            "converged_at": converged,
+            "converged_after_last_join": converged - last_join,
+            "node_ttc": {"p50": p50, "p90": p90, "p99": p99, "max": max(ttc, default=0.0)},
+        }
+
+    def flood(self, source):
+        """ BoundedFlood from source: a node forwards to its neighbors that lie clockwise
+        before its bound, handing each the next such neighbor as its bound, so each node is
+        reached once over a ring connected overlay. Returns (hops array, messages,
+        duplicates). """
+        size = self.size
+        offsets, neighbors = self.offsets, self.neighbors
+        hops = array("i", [-1]) * size
+        hops[source] = 0
+        messages = duplicates = 0
+        stack = [(source, source)]
+        while stack:
+            node, bound = stack.pop()
+            limit = (bound - node) % size or size
+            nbrs = neighbors[offsets[node]:offsets[node + 1]]
+            split = bisect.bisect_right(nbrs, node)
+            ordered = [peer for peer in nbrs[split:].tolist() + nbrs[:split].tolist()
+                       if (peer - node) % size < limit]
+            for idx, peer in enumerate(ordered):
+                messages += 1
+                if hops[peer] >= 0:
+                    duplicates += 1
+                    continue
+                hops[peer] = hops[node] + 1
+                stack.append((peer, ordered[idx + 1] if idx + 1 < len(ordered) else bound))
+        return hops, messages, duplicates
+
+    def shortest(self, source):
+        offsets, neighbors = self.offsets, self.neighbors
+        dist = array("i", [-1]) * self.size
+        dist[source] = 0
+        frontier = [source]
+        while frontier:
+            nxt = []
+            for node in frontier:
+                step = dist[node] + 1
+                for peer in neighbors[offsets[node]:offsets[node + 1]]:
+                    if dist[peer] < 0:
+                        dist[peer] = step
+                        nxt.append(peer)
+            frontier = nxt
+        return dist
+
+    def _broadcast_report(self):
+        sources = self.rand.sample(range(self.size), min(int(self.params["sources"]), self.size))
+        messages, duplicates, coverage, max_hops, stretches = [], [], [], [], []
+        for source in sources:
+            hops, msgs, dups = self.flood(source)
+            dist = self.shortest(source)
+            messages.append(msgs)
+            duplicates.append(dups)
+            reached = [node for node in range(self.size) if hops[node] > 0]
+            coverage.append((len(reached) + 1) / self.size)
+            max_hops.append(max((hops[node] for node in reached), default=0))
+            stretches.extend(hops[node] / dist[node] for node in reached if dist[node] > 0)
+        s50, s90, s99 = _percentiles(stretches)
+        count = max(len(sources), 1)
+        return {"broadcast": {
+            "sources": len(sources),
+            "messages": sum(messages) / count,
+            "naive_flood_messages": len(self.neighbors) - self.size + 1,
+            "duplicates": sum(duplicates) / count,
+            "coverage": min(coverage, default=0.0),
+            "max_hops": max(max_hops, default=0),
+            "stretch": {"mean": sum(stretches) / max(len(stretches), 1), "p50": s50, "p90": s90,
+                        "p99": s99}}}
+
+
+def format_report(report):
+    bcast = report["broadcast"]
+    return "\n".join([
+        "{nodes} nodes, {edges} edges, degree mean {0:.2f} max {1}".format(
+            report["degree"]["mean"], report["degree"]["max"], **report),
+        "{edge_setups} edge setups, {edge_teardowns} teardowns, {control_messages} control "
+        "messages, {ondemand_edges} on-demand edges ({flows_over_threshold} flows over "
+        "threshold)".format(**report),
+        "last join at {last_join:.1f}s, converged at {converged_at:.1f}s "
+        "({converged_after_last_join:.1f}s after the last join)".format(**report),
+        "per node time to converge p50 {p50:.1f}s p90 {p90:.1f}s p99 {p99:.1f}s max {max:.1f}s"
+        .format(**report["node_ttc"]),
+        "broadcast from {sources} sources: {messages:.0f} messages (naive flood "
+        "{naive_flood_messages}), {duplicates:.1f} duplicates, coverage {coverage:.2%}, "
+        "max hops {max_hops}".format(**bcast),
+        "path stretch mean {mean:.3f} p50 {p50:.3f} p90 {p90:.3f} p99 {p99:.3f}"
+        .format(**bcast["stretch"]),
+        "simulated in {formation:.1f}s + {broadcast:.1f}s, {0} events".format(
+            report["events"], **report["sim_seconds"])])
@@ -0,0 +1,235 @@
+# pylint: disable=missing-docstring
+import math
+import os
+import re
+import struct
+import subprocess
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+NAN = float("nan")
+MAGIC = b"PMX1"
+# magic, range start, node count, last update
+HEADER = struct.Struct("=4sIId")
+
+_LOSS = re.compile(r"(\d+) packets transmitted, (\d+) (?:packets )?received")
+_RTT = re.compile(r"= [\d.]+/([\d.]+)/")
+# pings every target concurrently, one atomic line per target
+_SCRIPT = ('n=$1; w=$2; shift 2; for t in "$@"; do '
+           'echo "$t $(ping -nq -c "$n" -i 0.2 -W "$w" "$t" 2>&1 | tail -2 | tr "\\n" " ")" & '
+           'done; wait')
+
+
+def _rank(ordered, pct):
+    if not ordered:
+        return NAN
+    return ordered[min(len(ordered) - 1, int(math.ceil(len(ordered) * pct / 100.0)) - 1)]
+
+
+class TokenBucket():
+    """ Limits takers to rate tokens per second with bursts of up to burst tokens. A take larger
+    than what is available runs the bucket into debt, which later takes wait out in turn. """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("The probe rate must be greater than 0, not {0}".format(rate))
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, count=1):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class PingMatrix():
+    """ Dense N x N reachability matrix over a range of nodes, with the source as the row and
+    the destination as the column. Each cell holds the average rtt in ms (NaN when nothing came
+    back), the loss fraction (NaN while unprobed) and the epoch time it was last probed, in
+    three flat arrays saved back to back after a fixed header. """
+
+    def __init__(self, range_start, count):
+        self.range_start = range_start
+        self.count = count
+        cells = count * count
+        self.rtt = array("f", [NAN]) * cells
+        self.loss = array("f", [NAN]) * cells
+        self.probed = array("d", [0.0]) * cells
+        self.updated = 0.0
+
+    @classmethod
+    def load(cls, path, range_start, count):
+        """ The matrix saved in path, or an empty one when there is none for this range. """
+        mtx = cls(range_start, count)
+        try:
+            with open(path, "rb") as mfl:
+                magic, start, nodes, updated = HEADER.unpack(mfl.read(HEADER.size))
+                if magic != MAGIC or start != range_start or nodes != count:
+                    return mtx
+                for column in (mtx.rtt, mtx.loss, mtx.probed):
+                    column.fromfile(mfl, count * count)
+                    del column[:count * count]
+        except (OSError, EOFError, struct.error):
+            return cls(range_start, count)
+        mtx.updated = updated
+        return mtx
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as mfl:
+            mfl.write(HEADER.pack(MAGIC, self.range_start, self.count, self.updated))
+            for column in (self.rtt, self.loss, self.probed):
+                column.tofile(mfl)
+        os.replace(tmp, path)
+
+    def node(self, idx):
+        return self.range_start + idx
+
+    def select(self, mode="all", max_age=None, now=None):
+        """ The (src, dst) index pairs to probe: all of them, the failed ones (any loss or never
+        probed), or the stale ones (probed over max_age seconds ago) as well as the failed. """
+        now = time.time() if now is None else now
+        count = self.count
+        cells = []
+        for src in range(count):
+            base = src * count
+            for dst in range(count):
+                if src == dst:
+                    continue
+                loss = self.loss[base + dst]
+                if mode == "all" or not loss == 0.0 or \
+                        (mode == "stale" and self.probed[base + dst] < now - max_age):
+                    cells.append((src, dst))
+        return cells
+
+    def set(self, src, dst, rtt, loss, now):
+        cell = src * self.count + dst
+        self.rtt[cell] = rtt
+        self.loss[cell] = loss
+        self.probed[cell] = now
+        self.updated = max(self.updated, now)
+
+    def summary(self, worst=5):
+        count = self.count
+        rtts, reachable, partial, unreachable, unprobed, asymmetric = [], 0, 0, 0, 0, 0
+        fail_out, fail_in = [0] * count, [0] * count
+        for src in range(count):
+            base = src * count
+            for dst in range(count):
+                if src == dst:
+                    continue
+                loss = self.loss[base + dst]
+                if loss != loss:
+                    unprobed += 1
+                    continue
+                if loss >= 1.0:
+                    unreachable += 1
+                    fail_out[src] += 1
+                    fail_in[dst] += 1
+                    if self.loss[dst * count + src] < 1.0:
+                        asymmetric += 1
+                    continue
+                reachable += 1
+                if loss > 0:
+                    partial += 1
+                rtts.append(self.rtt[base + dst])
+        rtts.sort()
+        lines = ["ping matrix {0}x{0}: {1} pair(s), {2} reachable ({3} with loss), "
+                 "{4} unreachable, {5} unprobed".format(count, count * (count - 1), reachable,
+                                                       partial, unreachable, unprobed)]
+        if rtts:
+            lines.append("rtt ms p50 {0:.3f} p90 {1:.3f} p99 {2:.3f} max {3:.3f}".format(
+                _rank(rtts, 50), _rank(rtts, 90), _rank(rtts, 99), rtts[-1]))
+        if unreachable:
+            lines.append("{0} pair(s) reachable one way only".format(asymmetric))
+            nodes = sorted((idx for idx in range(count) if fail_out[idx] or fail_in[idx]),
+                           key=lambda idx: fail_out[idx] + fail_in[idx], reverse=True)
+            lines.append("least reachable: " + ", ".join(
+                "node-{0:03} ({1} out, {2} in)".format(self.node(idx), fail_out[idx],
+                                                       fail_in[idx]) for idx in nodes[:worst]))
+        return "\n".join(lines)
+
+    def failures(self):
+        """ The (src node, dst node, loss) of every probed cell with loss. """
+        count = self.count
+        return [(self.node(cell // count), self.node(cell % count), loss)
+                for cell, loss in enumerate(self.loss)
+                if cell // count != cell % count and loss > 0]
+
+
+class MatrixProber():
+    """ Probes matrix cells with pings sent from inside the source containers. The cells of a
+    source are batched CHUNK destinations per exec, which pings them all concurrently, and
+    the batches of all sources run on a bounded pool under a global limit of rate cells per
+    second. A batch whose exec fails counts as total loss for its cells. """
+    CHUNK = 32
+    PINGS = 3
+    RATE = 200.0
+
+    def __init__(self, run_cmd, addresses, concurrency, rate=RATE, timeout=None,
+                 chunk=CHUNK, pings=PINGS):
+        """ run_cmd(instance, cmd_line, timeout) runs a command in a node; addresses lists the
+        overlay address of each matrix index. """
+        self.run_cmd = run_cmd
+        self.addresses = addresses
+        self.concurrency = max(1, concurrency)
+        self.bucket = TokenBucket(rate)
+        self.timeout = timeout
+        self.chunk = max(1, chunk)
+        self.pings = pings
+        self.execs = 0
+        self.exec_failures = 0
+
+    def _probe(self, mtx, src, dsts):
+        self.bucket.take(len(dsts))
+        targets = [self.addresses[dst] for dst in dsts]
+        cmd_line = ["sh", "-c", _SCRIPT, "sh", str(self.pings), "1"] + targets
+        try:
+            resp = self.run_cmd(mtx.node(src), cmd_line, self.timeout)
+            output = resp.stdout.decode("utf-8", "replace") if resp.returncode == 0 else ""
+        except (subprocess.TimeoutExpired, OSError):
+            output = ""
+        now = time.time()
+        results = {}
+        for line in output.splitlines():
+            target, _, stats = line.partition(" ")
+            loss = _LOSS.search(stats)
+            rtt = _RTT.search(stats)
+            if loss:
+                sent, received = int(loss.group(1)), int(loss.group(2))
+                results[target] = (float(rtt.group(1)) if rtt and received else NAN,
+                                   1.0 - received / sent if sent else 1.0)
+        for dst, target in zip(dsts, targets):
+            rtt, loss = results.get(target, (NAN, 1.0))
+            mtx.set(src, dst, rtt, loss, now)
+        return bool(output)
+
+    def probe(self, mtx, cells):
+        """ Probes the (src, dst) cells into mtx. Returns the number of batches run. """
+        rows = {}
+        for src, dst in cells:
+            rows.setdefault(src, []).append(dst)
+        # the first batch of every source, then the second, so a slow or dead node does not
+        # hold up a stretch of the run
+        batches = sorted(((pos, src, dsts[pos:pos + self.chunk])
+                          for src, dsts in rows.items()
+                          for pos in range(0, len(dsts), self.chunk)),
+                         key=lambda batch: batch[:2])
+        batches = [(src, dsts) for _, src, dsts in batches]
+        if not batches:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+            done = list(pool.map(lambda batch: self._probe(mtx, *batch), batches))
+        self.execs += len(done)
+        self.exec_failures += done.count(False)
+        return len(done)
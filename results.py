@@ -0,0 +1,298 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import ipaddress
+import math
+import os
+import re
+import socket
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PING = 0
+IPERF = 1
+NAN = float("nan")
+
+# column name -> array typecode
+COLUMNS = OrderedDict([("kind", "B"), ("run", "H"), ("ts", "d"), ("src", "I"), ("dst", "I"),
+                       ("rtt_min", "f"), ("rtt_avg", "f"), ("rtt_max", "f"), ("rtt_mdev", "f"),
+                       ("loss", "f"), ("bandwidth", "d")])
+
+_MARK = re.compile(r"^### (\S+) (\d+) (\S+) (\S+)")
+_STATS_HDR = re.compile(r"^--- (\S+) ping statistics ---")
+_LOSS = re.compile(r"(\d+) packets transmitted, (\d+) received.*?([\d.]+)% packet loss")
+_RTT = re.compile(r"^rtt min/avg/max/mdev = ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+) ms")
+
+
+@lru_cache(maxsize=1 << 16)
+def ip_int(addr):
+    try:
+        return int.from_bytes(socket.inet_aton(addr), "big")
+    except OSError:
+        return 0
+
+
+@lru_cache(maxsize=1 << 12)
+def _iperf_time(stamp):
+    return time.mktime(time.strptime(stamp, "%Y%m%d%H%M%S"))
+
+
+def ip_str(val):
+    return str(ipaddress.IPv4Address(val)) if val else "?"
+
+
+def parse_ping(data, base, rows):
+    """ Parses the ping -nq summaries of ping-results.log in data, which holds complete lines
+    starting at file offset base, appending a row per summary. A summary is complete at its rtt
+    line, or at its statistics line when nothing was received. Returns the offset where the
+    first incomplete summary begins, or the end of data. """
+    block = None
+    block_start = 0
+    pos = 0
+    for line in data.splitlines(True):
+        start = pos
+        pos += len(line)
+        text = line.decode("utf-8", "replace")
+        mark = _MARK.match(text)
+        if mark or (text.startswith("PING ") and not (block and block["marked"])):
+            block = {"ts": NAN, "src": 0, "dst": 0, "marked": bool(mark)}
+            if mark:
+                block.update(ts=float(mark.group(1)), src=ip_int(mark.group(3)),
+                             dst=ip_int(mark.group(4)))
+            block_start = start
+            continue
+        hdr = _STATS_HDR.match(text)
+        if hdr and block is None:
+            block = {"ts": NAN, "src": 0, "dst": 0, "marked": False}
+            block_start = start
+        if block is None:
+            continue
+        if text.startswith("PING "):
+            block["marked"] = False
+        elif hdr:
+            block["dst"] = block["dst"] or ip_int(hdr.group(1))
+        elif _LOSS.search(text):
+            loss = _LOSS.search(text)
+            block["loss"] = float(loss.group(3))
+            if int(loss.group(2)) == 0:
+                rows.append((PING, block["ts"], block["src"], block["dst"], NAN, NAN, NAN, NAN,
+                             block["loss"], NAN))
+                block = None
+        elif _RTT.match(text) and "loss" in block:
+            rtt = [float(val) for val in _RTT.match(text).groups()]
+            rows.append((PING, block["ts"], block["src"], block["dst"], rtt[0], rtt[1], rtt[2],
+                         rtt[3], block["loss"], NAN))
+            block = None
+    return base + (block_start if block is not None else pos)
+
+
+def parse_iperf(data, base, rows):
+    """ Parses the iperf -yC lines of iperf-resulst.log in data:
+    timestamp,src,src_port,dst,dst_port,id,interval,bytes,bits_per_second[,...] """
+    for line in data.splitlines():
+        fields = line.decode("utf-8", "replace").strip().split(",")
+        if len(fields) < 9:
+            continue
+        try:
+            stamp = _iperf_time(fields[0])
+            bandwidth = float(fields[8])
+        except ValueError:
+            continue
+        rows.append((IPERF, stamp, ip_int(fields[1]), ip_int(fields[3]), NAN, NAN, NAN, NAN,
+                     NAN, bandwidth))
+    return base + len(data)
+
+
+def assign_sources(rows, cases, turns):
+    """ Sets the src of the ping rows logged without a ### mark, as lu.sh rhi logs them, from
+    the (src, dst) addresses of the cases it ran. The unmarked rows of a destination take the
+    sources of its cases in case order, starting over when a case file is run again; turns
+    holds how many rows each destination has taken so far and is updated. """
+    by_dst = {}
+    for src, dst in cases:
+        by_dst.setdefault(ip_int(dst), []).append(ip_int(src))
+    for idx, row in enumerate(rows):
+        srcs = by_dst.get(row[3])
+        if row[0] != PING or row[2] or not srcs:
+            continue
+        turn = turns.get(str(row[3]), 0)
+        rows[idx] = row[:2] + (srcs[turn % len(srcs)],) + row[3:]
+        turns[str(row[3])] = turn + 1
+
+
+class ResultStore():
+    """ Columnar store of probe results under one directory: each column is a raw little endian
+    array file that ingestion appends to, and meta.json holds the committed row count, the run
+    labels and the byte offsets reached in each source log. """
+    META = "meta.json"
+    CHUNK = 1 << 22
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.meta = {"rows": 0, "runs": [], "sources": {}}
+        meta_file = os.path.join(store_dir, ResultStore.META)
+        if os.path.isfile(meta_file):
+            with open(meta_file) as mfl:
+                self.meta = json.load(mfl)
+        self.cols = None
+
+    def _col_file(self, name):
+        return os.path.join(self.store_dir, name + ".col")
+
+    def _save_meta(self):
+        tmp = os.path.join(self.store_dir, ResultStore.META + ".tmp")
+        with open(tmp, "w") as mfl:
+            json.dump(self.meta, mfl)
+        os.replace(tmp, os.path.join(self.store_dir, ResultStore.META))
+
+    def _read_source(self, path, parser, rows):
+        state = self.meta["sources"].get(path, {"inode": None, "offset": 0})
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        offset = state["offset"]
+        if stat.st_ino != state["inode"] or stat.st_size < offset:
+            offset = 0
+        with open(path, "rb") as fle:
+            fle.seek(offset)
+            pending = b""
+            while True:
+                chunk = fle.read(ResultStore.CHUNK)
+                if not chunk:
+                    break
+                data = pending + chunk
+                nxt = parser(data[:data.rfind(b"\n") + 1], offset, rows)
+                pending = data[nxt - offset:]
+                offset = nxt
+        self.meta["sources"][path] = {"inode": stat.st_ino, "offset": offset}
+
+    def ingest(self, ping_logs=(), iperf_logs=(), label=None, cases=()):
+        """ Parses the new bytes of each log and appends the rows as one run, with the sources
+        of unmarked ping summaries taken from cases, the (src, dst) addresses of the case files
+        the probes ran. Returns the number of rows added. """
+        os.makedirs(self.store_dir, exist_ok=True)
+        rows = []
+        for path in ping_logs:
+            self._read_source(os.path.abspath(path), parse_ping, rows)
+        assign_sources(rows, cases, self.meta.setdefault("turns", {}))
+        for path in iperf_logs:
+            self._read_source(os.path.abspath(path), parse_iperf, rows)
+        if rows:
+            run = len(self.meta["runs"])
+            self.meta["runs"].append(label or time.strftime("%Y%m%d-%H%M%S"))
+            self._truncate_to_meta()
+            names = list(COLUMNS)
+            for idx, name in enumerate(names):
+                if name == "kind":
+                    col = array("B", (row[0] for row in rows))
+                elif name == "run":
+                    col = array("H", [run]) * len(rows)
+                else:
+                    col = array(COLUMNS[name], (row[idx - 1] for row in rows))
+                if sys.byteorder == "big":
+                    col.byteswap()
+                with open(self._col_file(name), "ab") as cfl:
+                    col.tofile(cfl)
+            self.meta["rows"] += len(rows)
+        self._save_meta()
+        self.cols = None
+        return len(rows)
+
+    def _truncate_to_meta(self):
+        """ Drops rows appended by an ingestion that did not commit its meta. """
+        for name, code in COLUMNS.items():
+            path = self._col_file(name)
+            size = self.meta["rows"] * array(code).itemsize
+            if os.path.isfile(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as cfl:
+                    cfl.truncate(size)
+
+    def columns(self):
+        if self.cols is None:
+            self.cols = {}
+            for name, code in COLUMNS.items():
+                col = array(code)
+                if self.meta["rows"]:
+                    with open(self._col_file(name), "rb") as cfl:
+                        col.fromfile(cfl, self.meta["rows"])
+                    if sys.byteorder == "big":
+                        col.byteswap()
+                self.cols[name] = col
+        return self.cols
+
+    def aggregate(self, metric, group, percentiles=(50, 90, 99)):
+        """ Percentiles of metric (a column name) grouped by node (src), pair (src, dst) or run.
+        Returns an ordered list of (key, count, [percentile values]). NaN values are ignored. """
+        cols = self.columns()
+        values = cols[metric]
+        if group == "node":
+            keys = cols["src"]
+        elif group == "run":
+            keys = cols["run"]
+        elif group == "pair":
+            if np is not None:
+                srcs = np.frombuffer(cols["src"], dtype=np.uint32).astype(np.uint64)
+                keys = (srcs << np.uint64(32)) | np.frombuffer(cols["dst"], dtype=np.uint32)
+            else:
+                keys = array("Q", ((src << 32) | dst
+                                   for src, dst in zip(cols["src"], cols["dst"])))
+        else:
+            raise ValueError("Unknown group {0}".format(group))
+        if np is not None:
+            return _aggregate_np(np.asarray(keys), np.frombuffer(values, dtype=values.typecode),
+                                 percentiles)
+        return _aggregate_py(keys, values, percentiles)
+
+
+def _percentile(ordered, pct):
+    """ Linear interpolation between closest ranks, as numpy's default. """
+    if not ordered:
+        return NAN
+    pos = (len(ordered) - 1) * pct / 100.0
+    low = int(math.floor(pos))
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def _aggregate_py(keys, values, percentiles):
+    groups = {}
+    for key, val in zip(keys, values):
+        if val == val:
+            groups.setdefault(key, []).append(val)
+    out = []
+    for key in sorted(groups):
+        ordered = sorted(groups[key])
+        out.append((key, len(ordered), [_percentile(ordered, pct) for pct in percentiles]))
+    return out
+
+
+def _aggregate_np(keys, values, percentiles):
+    keep = ~np.isnan(values)
+    keys, values = keys[keep], values[keep]
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    uniq, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    out = []
+    for key, start, count in zip(uniq.tolist(), starts, counts):
+        grp = values[start:start + count]
+        out.append((key, int(count), np.percentile(grp, percentiles).tolist()))
+    return out
+
+
+def format_key(key, group, runs):
+    if group == "node":
+        return ip_str(key)
+    if group == "pair":
+        return "{0}->{1}".format(ip_str(key >> 32), ip_str(key & 0xffffffff))
+    return runs[key] if key < len(runs) else str(key)
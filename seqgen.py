@@ -0,0 +1,74 @@
+# pylint: disable=missing-docstring
+import pickle
+import random
+import struct
+import sys
+from array import array
+
+SEQ_MAGIC = b"BFSQ"
+VERSION = 1
+# magic, version, reserved, seed, entry count; entries follow as little-endian uint32
+HEADER = struct.Struct("<4sHHqQ")
+
+
+def new_seed():
+    return random.SystemRandom().getrandbits(63)
+
+
+def gen_sequence(range_start, range_end, seed):
+    """ Returns a uniformly random permutation of [range_start, range_end). """
+    seq = array("I", range(range_start, range_end))
+    random.Random(seed).shuffle(seq)
+    return seq
+
+
+def _write(path, magic, seed, columns):
+    with open(path, "wb") as fle:
+        fle.write(HEADER.pack(magic, VERSION, 0, seed, len(columns[0])))
+        for col in columns:
+            if sys.byteorder == "big":
+                col = array(col.typecode, col)
+                col.byteswap()
+            col.tofile(fle)
+
+
+def _read(path, magic, num_columns):
+    with open(path, "rb") as fle:
+        hdr = fle.read(HEADER.size)
+        if hdr[:4] != magic:
+            return None
+        if len(hdr) < HEADER.size:
+            raise ValueError("{0}: corrupt sequence file, truncated header".format(path))
+        _, version, _, seed, count = HEADER.unpack(hdr)
+        if version != VERSION:
+            raise ValueError("{0}: unsupported version {1}".format(path, version))
+        columns = []
+        for _ in range(num_columns):
+            col = array("I")
+            try:
+                col.fromfile(fle, count)
+            except (EOFError, ValueError):
+                raise ValueError("{0}: corrupt sequence file, truncated before its {1} entries"
+                                 .format(path, count))
+            if sys.byteorder == "big":
+                col.byteswap()
+            columns.append(col)
+    return seed, columns
+
+
+def write_sequence(path, seq, seed):
+    _write(path, SEQ_MAGIC, seed, [array("I", seq)])
+
+
+def read_sequence(path):
+    """ Returns (seq, seed). Pickled lists written by earlier versions are still accepted and
+    report a seed of None. Raises ValueError for a truncated or otherwise corrupt file. """
+    rec = _read(path, SEQ_MAGIC, 1)
+    if rec is None:
+        with open(path, "rb") as fle:
+            try:
+                return list(pickle.load(fle)), None
+            except (EOFError, pickle.UnpicklingError) as err:
+                raise ValueError("{0}: corrupt sequence file, {1}".format(path, err))
+    return list(rec[1][0]), rec[0]
+
@@ -0,0 +1,84 @@
+# pylint: disable=missing-docstring
+import sqlite3
+import threading
+import time
+
+CONFIGURED = "configured"
+LAUNCHING = "launching"
+RUNNING = "running"
+IPOP_ACTIVE = "ipop-active"
+STOPPED = "stopped"
+# booted pool container with the ipop service stopped
+WARM = "warm"
+
+UP = (RUNNING, IPOP_ACTIVE)
+
+
+class StateStore():
+    """ Per instance desired and observed state of the experiment, kept in SQLite in the
+    experiment dir so that an interrupted or repeated action only touches the instances that
+    still need it. Desired is running or stopped; observed moves through configured, launching,
+    running, ipop-active and stopped, or warm for an idle pool container. """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS instances (
+        inst INTEGER PRIMARY KEY,
+        desired TEXT,
+        desired_at REAL,
+        observed TEXT,
+        observed_at REAL)"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(StateStore.SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _upsert(self, column, insts, state):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR IGNORE INTO instances (inst) VALUES (?)",
+                                   [(inst,) for inst in insts])
+            self._conn.executemany("UPDATE instances SET {0}=?, {0}_at=? WHERE inst=?"
+                                   .format(column), [(state, now, inst) for inst in insts])
+            self._conn.execute("COMMIT")
+
+    def set_desired(self, insts, state):
+        self._upsert("desired", insts, state)
+
+    def set_observed(self, insts, state):
+        self._upsert("observed", insts, state)
+
+    def observed(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT inst, observed FROM instances"))
+
+    def rows(self):
+        with self._lock:
+            return list(self._conn.execute(
+                "SELECT inst, desired, desired_at, observed, observed_at FROM instances "
+                "ORDER BY inst"))
+
+    def reconcile(self, running):
+        """ Folds in one bulk listing of the runtime, running being the set of instances whose
+        containers are up. Instances recorded as up whose container is gone become stopped and
+        running containers not recorded as up become running. Returns the observed map. """
+        current = self.observed()
+        gone = [inst for inst, obs in current.items() if obs in UP + (LAUNCHING, WARM)
+                and inst not in running]
+        found = [inst for inst in running if current.get(inst) not in UP + (WARM,)]
+        if gone:
+            self.set_observed(gone, STOPPED)
+        if found:
+            self.set_observed(found, RUNNING)
+        return self.observed()
+
+    def select(self, insts, states, include=True):
+        """ Filters insts, in order, to those whose observed state is (or is not) in states. """
+        current = self.observed()
+        return [inst for inst in insts if (current.get(inst) in states) == include]
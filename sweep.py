@@ -0,0 +1,269 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import copy
+import hashlib
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from orchestrate import EXECUTORS, Host, SshExecutor, invoke, load_inventory
+
+Point = namedtuple("Point", ["key", "values", "seed", "range_start", "range_end", "template",
+                             "bf_template"])
+
+STEPS = [["--configure"], ["--run"], ["--test", "lu"], ["--end"]]
+DONE = "done"
+FAILED = "failed"
+RUNNING = "running"
+
+
+def load_grid(grid_file):
+    """ The grid is a json file of the form
+    {"params": {"range": [50, 100], "Topology.Overlays.*.MaxSuccessors": [2, 4],
+                "bf.DemandThreshold": ["10M", "100M"]},
+     "seeds": [1, 2], "steps": [["--configure"], ["--run"], ["--test", "lu"], ["--end"]]}
+    Parameter names are dotted paths into template-config.json, or into
+    template-bf-config.json when prefixed with bf., where * matches every key of a level.
+    range is a node count or a "start,end" range. seeds and steps are optional; the last step
+    is the teardown that also runs after a failed step. """
+    with open(grid_file) as gfl:
+        grid = json.load(gfl, object_pairs_hook=OrderedDict)
+    grid.setdefault("seeds", [None])
+    grid.setdefault("steps", STEPS)
+    return grid
+
+
+def set_path(doc, path, value):
+    """ Sets the dotted path in doc, expanding * over every key of its level. """
+    head, _, rest = path.partition(".")
+    keys = list(doc.keys()) if head == "*" else [head]
+    for key in keys:
+        if not rest:
+            doc[key] = value
+        else:
+            if key not in doc:
+                doc[key] = {}
+            set_path(doc[key], rest, value)
+
+
+def _range(value, default):
+    if value is None:
+        return default
+    if isinstance(value, int):
+        return 1, 1 + value
+    start, end = str(value).split(",")
+    return int(start), int(end)
+
+
+def expand(grid, template, bf_template, default_range):
+    """ Yields a Point per combination of parameter values and seed. The key hashes everything
+    that determines the outcome: the effective templates, the range, the seed and the steps. """
+    names = list(grid["params"])
+    for combo in itertools.product(*(grid["params"][name] for name in names)):
+        values = OrderedDict(zip(names, combo))
+        tmpl = copy.deepcopy(template)
+        bf_tmpl = copy.deepcopy(bf_template)
+        for name, value in values.items():
+            if name == "range":
+                continue
+            if name.startswith("bf."):
+                set_path(bf_tmpl, name[3:], value)
+            else:
+                set_path(tmpl, name, value)
+        start, end = _range(values.get("range"), default_range)
+        for seed in grid["seeds"]:
+            digest = hashlib.sha1(json.dumps(
+                {"template": tmpl, "bf": bf_tmpl, "range": [start, end], "seed": seed,
+                 "steps": grid["steps"]}, sort_keys=True).encode("utf-8")).hexdigest()
+            yield Point(digest[:16], values, seed, start, end, tmpl, bf_tmpl)
+
+
+class Sweep():
+    """ Runs every point of a parameter grid through the configure/run/test/end steps of
+    Experiment.py, each in its own dir under sweep/<key> with its own templates. The outcome of
+    a point is cached in its result.json, so running the sweep again skips completed points and
+    retries failed ones; a point found still running (after a crash) is torn down first. Points
+    are handed to the hosts of an inventory, one at a time per host, each to a host whose
+    capacity fits its range, largest first. The points of local hosts run one at a time, as
+    they would share the container names and the network on this machine. """
+    RESULT = "result.json"
+
+    def __init__(self, grid_file, exp_dir, inventory_file=None, verbose=False):
+        self.grid = load_grid(grid_file)
+        self.exp_dir = exp_dir
+        self.sweep_dir = os.path.join(exp_dir, "sweep")
+        self.verbose = verbose
+        if inventory_file:
+            self.hosts = load_inventory(inventory_file)
+        else:
+            self.hosts = [Host("local", "localhost", sys.maxsize, None, "local")]
+        self.executors = {kind: executor(exp_dir) for kind, executor in EXECUTORS.items()}
+        self._lock = threading.Lock()
+        self._local = threading.Lock()
+
+    def points(self, default_range):
+        with open(os.path.join(self.exp_dir, "template-config.json")) as tfl:
+            template = json.load(tfl, object_pairs_hook=OrderedDict)
+        with open(os.path.join(self.exp_dir, "template-bf-config.json")) as tfl:
+            bf_template = json.load(tfl, object_pairs_hook=OrderedDict)
+        return list(expand(self.grid, template, bf_template, default_range))
+
+    def _point_dir(self, point):
+        return os.path.join(self.sweep_dir, point.key)
+
+    def load_result(self, point):
+        try:
+            with open(os.path.join(self._point_dir(point), Sweep.RESULT)) as rfl:
+                return json.load(rfl)
+        except (OSError, ValueError):
+            return None
+
+    def _save_result(self, point, result):
+        path = os.path.join(self._point_dir(point), Sweep.RESULT)
+        with open(path + ".tmp", "w") as rfl:
+            json.dump(result, rfl, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _prepare(self, point):
+        point_dir = self._point_dir(point)
+        os.makedirs(os.path.join(point_dir, "test-link-utilization"), exist_ok=True)
+        for name, doc in (("template-config.json", point.template),
+                          ("template-bf-config.json", point.bf_template)):
+            with open(os.path.join(point_dir, name), "w") as tfl:
+                json.dump(doc, tfl, indent=2)
+        lu_script = os.path.join(self.exp_dir, "test-link-utilization", "lu.sh")
+        link = os.path.join(point_dir, "test-link-utilization", "lu.sh")
+        if os.path.exists(lu_script) and not os.path.lexists(link):
+            os.symlink(lu_script, link)
+
+    def _remote_dir(self, host, point):
+        return "{0}/sweep/{1}".format(SshExecutor.host_dir(host), point.key)
+
+    def _push(self, host, point):
+        """ Copies the point's templates to its dir on an ssh host. """
+        remote = self._remote_dir(host, point)
+        for name in ("template-config.json", "template-bf-config.json"):
+            with open(os.path.join(self._point_dir(point), name), "rb") as tfl:
+                subprocess.run(
+                    ["ssh", "-o", "BatchMode=yes", host.address,
+                     "mkdir -p {0}/test-link-utilization && ln -sf ../../../test-link-utilization"
+                     "/lu.sh {0}/test-link-utilization/lu.sh && cat > {0}/{1}".format(
+                         remote, name)],
+                    input=tfl.read(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    check=True)
+
+    def _run_step(self, host, point, args, timeout):
+        if host.executor == "ssh":
+            work_dir = self._remote_dir(host, point)
+        else:
+            work_dir = self._point_dir(point)
+        started = time.monotonic()
+        returncode, output = invoke(self.executors[host.executor], host, args, timeout,
+                                    work_dir)
+        return {"args": args, "returncode": returncode, "duration": time.monotonic() - started,
+                "output": output}
+
+    def run_point(self, host, point, timeout=None):
+        steps = self.grid["steps"]
+        common = ["--range", "{0},{1}".format(point.range_start, point.range_end)]
+        if point.seed is not None:
+            common += ["--seed", str(point.seed)]
+        previous = self.load_result(point)
+        self._prepare(point)
+        result = {"key": point.key, "params": point.values, "seed": point.seed,
+                  "range": [point.range_start, point.range_end], "host": host.name,
+                  "status": RUNNING, "started": time.time(), "steps": []}
+        self._save_result(point, result)
+        try:
+            if host.executor == "ssh":
+                self._push(host, point)
+            if previous and previous.get("status") == RUNNING:
+                # interrupted while running, so its containers may still be up
+                result["steps"].append(self._run_step(host, point, steps[-1] + common, timeout))
+            failed = False
+            for idx, step in enumerate(steps):
+                if failed and idx != len(steps) - 1:
+                    continue
+                res = self._run_step(host, point, step + common, timeout)
+                result["steps"].append(res)
+                failed = failed or res["returncode"] != 0
+        except (OSError, subprocess.CalledProcessError) as err:
+            failed = True
+            result["error"] = str(err)
+        result["status"] = FAILED if failed else DONE
+        result["duration"] = time.time() - result["started"]
+        self._save_result(point, result)
+        return result
+
+    def _worker(self, host, pending, results, timeout):
+        while True:
+            with self._lock:
+                point = next((pnt for pnt in pending
+                              if pnt.range_end - pnt.range_start <= host.capacity), None)
+                if point is None:
+                    return
+                pending.remove(point)
+            if host.executor == "local":
+                with self._local:
+                    result = self.run_point(host, point, timeout)
+            else:
+                result = self.run_point(host, point, timeout)
+            with self._lock:
+                results[point.key] = result
+                print("{0} {1} {2} on {3} in {4:.1f}s".format(
+                    point.key, dict(point.values), result["status"], host.name,
+                    result["duration"]))
+                sys.stdout.flush()
+
+    def run(self, default_range, timeout=None):
+        """ Runs the points not completed yet and returns the results of all of them. """
+        points = self.points(default_range)
+        results = OrderedDict()
+        pending = []
+        for point in points:
+            cached = self.load_result(point)
+            if cached and cached.get("status") == DONE:
+                results[point.key] = dict(cached, cached=True)
+            else:
+                pending.append(point)
+        pending.sort(key=lambda pnt: pnt.range_end - pnt.range_start, reverse=True)
+        print("{0} sweep point(s), {1} cached, {2} to run on {3} host(s)".format(
+            len(points), len(points) - len(pending), len(pending), len(self.hosts)))
+        threads = [threading.Thread(target=self._worker, args=(host, pending, results, timeout))
+                   for host in self.hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for point in pending:
+            results[point.key] = {"key": point.key, "params": point.values, "seed": point.seed,
+                                  "status": "skipped, no host has the capacity"}
+        print(self.format_results(points, results))
+        return results
+
+    def format_results(self, points, results):
+        lines = []
+        for point in points:
+            res = results.get(point.key, {})
+            lines.append("{0} seed={1} range={2},{3} {4}{5}{6}".format(
+                point.key, point.seed, point.range_start, point.range_end,
+                " ".join("{0}={1}".format(name, val) for name, val in point.values.items()
+                         if name != "range"),
+                " " + res.get("status", "?"), " (cached)" if res.get("cached") else ""))
+            if self.verbose or res.get("status") == FAILED:
+                for step in res.get("steps", []):
+                    if self.verbose or step["returncode"] != 0:
+                        lines.append("  {0} rc={1} {2:.1f}s\n{3}".format(
+                            " ".join(step["args"]), step["returncode"], step["duration"],
+                            step["output"].rstrip()))
+        done = sum(1 for res in results.values() if res.get("status") == DONE)
+        lines.append("{0}/{1} point(s) done, results under {2}".format(done, len(points),
+                                                                       self.sweep_dir))
+        return "\n".join(lines)
@@ -0,0 +1,126 @@
+# pylint: disable=missing-docstring
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cgsample import NodeReader, ResourceSampler, Ring # pylint: disable=wrong-import-position
+
+NET_DEV = ("Inter-|   Receive                                                |  Transmit\n"
+           " face |bytes    packets errs drop fifo frame compressed multicast|"
+           "bytes    packets errs drop fifo colls carrier compressed\n") + """\
+    lo: {lo} 10 0 0 0 0 0 0 {lo} 10 0 0 0 0 0 0
+  eth0: {rx} {rxp} 0 0 0 0 0 0 {tx} {txp} 0 0 0 0 0 0
+"""
+
+
+class FakeTree():
+    """ A cgroup mount and a proc dir with the files NodeReader reads for one pid. """
+
+    def __init__(self, root, pid, unified):
+        self.sys_root = os.path.join(root, "sys")
+        self.proc_root = os.path.join(root, "proc")
+        self.unified = unified
+        self.pid_dir = os.path.join(self.proc_root, str(pid))
+        os.makedirs(os.path.join(self.pid_dir, "net"))
+        if unified:
+            self.cgroup = {"cpu": os.path.join(self.sys_root, "docker", "c1"),
+                           "mem": os.path.join(self.sys_root, "docker", "c1")}
+            self.write(os.path.join(self.pid_dir, "cgroup"), "0::/docker/c1\n")
+        else:
+            self.cgroup = {"cpu": os.path.join(self.sys_root, "cpu,cpuacct", "docker", "c1"),
+                           "mem": os.path.join(self.sys_root, "memory", "docker", "c1")}
+            self.write(os.path.join(self.pid_dir, "cgroup"),
+                       "4:memory:/docker/c1\n3:cpu,cpuacct:/docker/c1\n1:name=systemd:/x\n")
+        for path in self.cgroup.values():
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def write(path, text):
+        # rewritten in place, as the kernel does, since the reader keeps the files open
+        with open(path, "r+" if os.path.exists(path) else "w") as fle:
+            fle.write(text)
+            fle.truncate()
+
+    def set(self, cpu_usec, mem, rx_bytes, tx_bytes, rx_packets, tx_packets):
+        if self.unified:
+            self.write(os.path.join(self.cgroup["cpu"], "cpu.stat"),
+                       "usage_usec {0}\nuser_usec 0\nsystem_usec 0\n".format(cpu_usec))
+            self.write(os.path.join(self.cgroup["mem"], "memory.current"), "{0}\n".format(mem))
+        else:
+            self.write(os.path.join(self.cgroup["cpu"], "cpuacct.usage"),
+                       "{0}\n".format(cpu_usec * 1000))
+            self.write(os.path.join(self.cgroup["mem"], "memory.usage_in_bytes"),
+                       "{0}\n".format(mem))
+        self.write(os.path.join(self.pid_dir, "net", "dev"),
+                   NET_DEV.format(lo=999999, rx=rx_bytes, rxp=rx_packets, tx=tx_bytes,
+                                  txp=tx_packets))
+
+
+class RingTest(unittest.TestCase):
+
+    def test_series_oldest_first_after_wrap(self):
+        ring = Ring(3, fields=("a",))
+        for idx in range(5):
+            ring.append(float(idx), [idx * 10])
+        stamps, columns = ring.series()
+        self.assertEqual(list(stamps), [2.0, 3.0, 4.0])
+        self.assertEqual(list(columns[0]), [20, 30, 40])
+
+    def test_series_before_full(self):
+        ring = Ring(4, fields=("a",))
+        ring.append(1.0, [7])
+        ring.append(2.0, [8])
+        self.assertEqual(list(ring.series()[0]), [1.0, 2.0])
+
+
+class ReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="bfexp-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def check_reader(self, unified):
+        tree = FakeTree(os.path.join(self.root, "v2" if unified else "v1"), 42, unified)
+        tree.set(1500, 4096, 100, 200, 3, 4)
+        reader = NodeReader(42, tree.sys_root, tree.proc_root)
+        self.assertEqual(reader.read(), (1500, 4096, 100, 200, 3, 4))
+        tree.set(2500, 8192, 300, 250, 5, 9)
+        self.assertEqual(reader.read(), (2500, 8192, 300, 250, 5, 9))
+        reader.close()
+
+    def test_cgroup_v1(self):
+        self.check_reader(unified=False)
+
+    def test_cgroup_v2(self):
+        self.check_reader(unified=True)
+
+    def test_sampler_deltas(self):
+        tree = FakeTree(self.root, 42, True)
+        tree.set(0, 1000, 0, 0, 0, 0)
+        sampler = ResourceSampler(lambda: ["ipop-dkr001"], lambda names: {"ipop-dkr001": 42},
+                                  capacity=8, sys_root=tree.sys_root, proc_root=tree.proc_root)
+        sampler.start = 100.0
+        sampler.discover()
+        sampler.sample(100.0)
+        # half a core, 2000 bytes/s in, 1000 bytes/s out over 2 seconds
+        tree.set(1000000, 5000, 4000, 2000, 40, 20)
+        sampler.sample(102.0)
+        tree.set(1000000, 3000, 4000, 2000, 40, 20)
+        sampler.sample(103.0)
+        series = sampler.series([("run", 100.0, 102.5)])
+        cols = series["nodes"]["ipop-dkr001"]
+        self.assertEqual(cols[0], [2000, 3000])
+        self.assertEqual(cols[1], [500, 0])
+        self.assertEqual(cols[2], [5000, 3000])
+        self.assertEqual(cols[3:], [[2000, 0], [1000, 0], [20, 0], [10, 0]])
+        self.assertEqual(series["phases"], [["run", 0, 2500]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# pylint: disable=missing-docstring
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from convergence import ConvergenceMonitor # pylint: disable=wrong-import-position
+
+LINKS = {1: "0123456789abcdef", 2: "fedcba9876543210", 3: "00112233aabbccdd"}
+
+
+class ConvergenceMonitorTest(unittest.TestCase):
+    """ Follows a fake log dir of three nodes whose tunnels were already up before the mark. """
+
+    def setUp(self):
+        self.logs_dir = tempfile.mkdtemp(prefix="bfexp-test-")
+        for node, link in LINKS.items():
+            os.makedirs(os.path.join(self.logs_dir, "dkr{0:03}".format(node)))
+            self.log(node, "tunnel {0} connected".format(link))
+
+    def tearDown(self):
+        shutil.rmtree(self.logs_dir, ignore_errors=True)
+
+    def log(self, node, text):
+        with open(os.path.join(self.logs_dir, "dkr{0:03}".format(node), "ctrl.log"), "a") as fle:
+            fle.write("{0} {1}\n".format(time.strftime("%Y-%m-%d %H:%M:%S"), text))
+
+    def churn(self, seed):
+        monitor = ConvergenceMonitor(self.logs_dir, LINKS, settle=0.2)
+        monitor.mark(seed)
+        # node 2 churns, the others log nothing new
+        self.log(2, "tunnel {0} disconnected".format(LINKS[2]))
+        self.log(2, "tunnel {0} connected".format(LINKS[2]))
+        monitor.reference = time.time()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            done = monitor.wait(1.0, interval=0.05)
+        return monitor, done, out.getvalue()
+
+    def test_untouched_nodes_converge_after_churn(self):
+        monitor, done, out = self.churn(seed=True)
+        self.assertEqual(sorted(done), [1, 2, 3])
+        self.assertEqual((done[1], done[3]), (0.0, 0.0))
+        self.assertEqual(monitor.links[1], {LINKS[1]})
+        self.assertIn("converged 3/3", out)
+
+    def test_unseeded_mark_skips_existing_logs(self):
+        _, done, _ = self.churn(seed=False)
+        self.assertEqual(sorted(done), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
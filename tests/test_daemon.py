@@ -0,0 +1,64 @@
+# pylint: disable=missing-docstring
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DaemonTest(unittest.TestCase):
+    """ Serves an experiment dir with Experiment.py --daemon, with bench/fake-docker as the
+    docker found on the path, and drives it through expctl.py. """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="bfexp-test-")
+        self.exp_dir = os.path.join(self.root, "exp")
+        os.makedirs(os.path.join(self.exp_dir, "test-link-utilization"))
+        for name in ("template-config.json", "template-bf-config.json"):
+            shutil.copy(os.path.join(SRC_DIR, name), self.exp_dir)
+        bin_dir = os.path.join(self.root, "bin")
+        os.makedirs(bin_dir)
+        os.symlink(os.path.join(SRC_DIR, "bench", "fake-docker"), os.path.join(bin_dir, "docker"))
+        os.makedirs(os.path.join(self.root, "containers"))
+        self.env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+                        FAKE_DOCKER_STATE=os.path.join(self.root, "containers"),
+                        FAKE_DOCKER_LATENCY="0")
+        self.daemon = subprocess.Popen(
+            [sys.executable, os.path.join(SRC_DIR, "Experiment.py"), "--daemon"],
+            cwd=self.exp_dir, env=self.env, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(os.path.join(self.exp_dir, "experiment.sock")):
+            self.assertLess(time.monotonic(), deadline, "daemon did not start")
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.expctl("--shutdown")
+        try:
+            self.daemon.wait(10)
+        except subprocess.TimeoutExpired:
+            self.daemon.kill()
+            self.daemon.wait()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def expctl(self, *argv):
+        return subprocess.run([sys.executable, os.path.join(SRC_DIR, "expctl.py")] + list(argv),
+                              cwd=self.exp_dir, env=self.env, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, timeout=20)
+
+    def test_sample_returns_to_client(self):
+        common = ["--range", "1,3", "--transport", "cli"]
+        resp = self.expctl(*(common + ["--run", "--sample", "1"]))
+        self.assertEqual(resp.returncode, 0, resp.stdout)
+        self.assertIn(b"Sampling container resources", resp.stdout)
+        resp = self.expctl(*(common + ["--end"]))
+        self.assertEqual(resp.returncode, 0, resp.stdout)
+        self.assertIn(b"Resource samples written", resp.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from orchestrate import Host, partition # pylint: disable=wrong-import-position
+
+
+class PartitionTest(unittest.TestCase):
+
+    def test_shards_follow_capacity(self):
+        hosts = [Host("node1", "node1", 4, None, "local"), Host("node2", "node2", 2, None, "local"),
+                 Host("node3", "node3", 1, None, "local")]
+        def shards(start, end):
+            return [(hst.name, first, last) for hst, first, last in partition(start, end, hosts)]
+        self.assertEqual(shards(1, 7), [("node1", 1, 4), ("node2", 4, 6), ("node3", 6, 7)])
+        self.assertEqual(shards(1, 3), [("node1", 1, 2), ("node2", 2, 3)])
+        with self.assertRaises(ValueError):
+            partition(1, 10, hosts)
+
+
+class OrchestrateTest(unittest.TestCase):
+    """ Runs Experiment.py --hosts over a two host local inventory, with bench/fake-docker as the
+    docker found on the path. """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="bfexp-test-")
+        self.exp_dir = os.path.join(self.root, "exp")
+        os.makedirs(os.path.join(self.exp_dir, "test-link-utilization"))
+        for name in ("template-config.json", "template-bf-config.json"):
+            shutil.copy(os.path.join(SRC_DIR, name), self.exp_dir)
+        bin_dir = os.path.join(self.root, "bin")
+        os.makedirs(bin_dir)
+        os.symlink(os.path.join(SRC_DIR, "bench", "fake-docker"), os.path.join(bin_dir, "docker"))
+        os.makedirs(os.path.join(self.root, "containers"))
+        self.env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+                        FAKE_DOCKER_STATE=os.path.join(self.root, "containers"),
+                        FAKE_DOCKER_LATENCY="0")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def inventory(self, *hosts):
+        path = os.path.join(self.exp_dir, "inventory.json")
+        with open(path, "w") as inv:
+            json.dump({"hosts": list(hosts)}, inv)
+        return path
+
+    def experiment(self, *argv):
+        return subprocess.run([sys.executable, os.path.join(SRC_DIR, "Experiment.py")] +
+                              list(argv), cwd=self.exp_dir, env=self.env, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, timeout=60)
+
+    def configs(self, host):
+        return sorted(name for name in os.listdir(os.path.join(self.exp_dir, "hosts", host,
+                                                               "config"))
+                      if re.match(r"config-\d+\.json$", name))
+
+    def test_shards_run_and_merge(self):
+        inv = self.inventory({"name": "node1", "capacity": 4}, {"name": "node2", "capacity": 2})
+        resp = self.experiment("--hosts", inv, "--range", "1,7", "--transport", "cli",
+                               "--configure", "--run")
+        self.assertEqual(resp.returncode, 0, resp.stdout)
+        self.assertEqual(self.configs("node1"), ["config-{0:03}.json".format(inst)
+                                                 for inst in range(1, 5)])
+        self.assertEqual(self.configs("node2"), ["config-005.json", "config-006.json"])
+        lines = resp.stdout.decode().splitlines()
+        self.assertIn("6 container(s) instantiated", lines)
+        self.assertEqual(lines[-1].split(", slowest")[0], "0/2 host(s) failed []")
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, "containers"))),
+                         ["ipop-dkr{0:03}".format(inst) for inst in range(1, 7)])
+
+    def test_cases_cross_hosts(self):
+        inv = self.inventory({"name": "node1", "capacity": 4}, {"name": "node2", "capacity": 2})
+        resp = self.experiment("--hosts", inv, "--range", "1,7", "--transport", "cli",
+                               "--test", "lu", "--num-cases", "12", "--seed", "3")
+        self.assertEqual(resp.returncode, 0, resp.stdout)
+        self.assertIn("link utilization: 0/12 failed", resp.stdout.decode().splitlines())
+        dsts = set()
+        for host, insts in (("node1", range(1, 5)), ("node2", range(5, 7))):
+            with open(os.path.join(self.exp_dir, "{0}-cases".format(host))) as fle:
+                generated = fle.read()
+            with open(os.path.join(self.exp_dir, "hosts", host, "{0}-cases".format(host))) as fle:
+                self.assertEqual(fle.read(), generated)
+            cases = [line.split() for line in generated.splitlines()]
+            self.assertTrue(cases)
+            self.assertTrue(all(int(inst) in insts for inst, _, _ in cases))
+            dsts.update((host, int(dst.rsplit(".", 1)[1]) in insts) for _, _, dst in cases)
+        # both shards send to nodes on the other host
+        self.assertIn(("node1", False), dsts)
+        self.assertIn(("node2", False), dsts)
+
+    def test_failed_host_exits_non_zero(self):
+        # a plain file where the host's experiment dir should be keeps its shard from starting
+        blocked = os.path.join(self.root, "blocked")
+        open(blocked, "w").close()
+        inv = self.inventory({"name": "node1", "capacity": 4},
+                             {"name": "node2", "capacity": 2, "exp_dir": blocked})
+        resp = self.experiment("--hosts", inv, "--range", "1,7", "--transport", "cli",
+                               "--configure", "--run")
+        self.assertEqual(resp.returncode, 1, resp.stdout)
+        output = resp.stdout.decode()
+        self.assertIn("==== node2 [5,7) rc=-1", output)
+        self.assertNotIn("==== node1", output)
+        self.assertIn("4 container(s) instantiated", output.splitlines())
+        self.assertIn("1/2 host(s) failed ['node2']", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
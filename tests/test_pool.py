@@ -0,0 +1,67 @@
+# pylint: disable=missing-docstring
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from Experiment import DockerExperiment # pylint: disable=wrong-import-position
+import state # pylint: disable=wrong-import-position
+
+
+class WarmPoolTest(unittest.TestCase):
+    """ Runs --configure --pool then --run --pool against bench/fake-docker. """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="bfexp-test-")
+        self.exp_dir = os.path.join(self.root, "exp")
+        os.makedirs(os.path.join(self.exp_dir, "test-link-utilization"))
+        for name in ("template-config.json", "template-bf-config.json"):
+            shutil.copy(os.path.join(SRC_DIR, name), self.exp_dir)
+        self.log = os.path.join(self.root, "docker.log")
+        self.env = dict(os.environ)
+        os.environ.update(FAKE_DOCKER_STATE=os.path.join(self.root, "containers"),
+                          FAKE_DOCKER_LATENCY="0", FAKE_DOCKER_LOG=self.log)
+        os.makedirs(os.environ["FAKE_DOCKER_STATE"])
+        self.virt = DockerExperiment.VIRT
+        DockerExperiment.VIRT = os.path.join(SRC_DIR, "bench", "fake-docker")
+
+    def tearDown(self):
+        DockerExperiment.VIRT = self.virt
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def experiment(self, *argv):
+        return DockerExperiment(exp_dir=self.exp_dir, argv=["--range", "1,4", "--transport",
+                                                            "cli", "--seed", "1"] + list(argv))
+
+    def calls(self, sub):
+        with open(self.log) as log:
+            return [line.split() for line in log if line.split()[:1] == [sub]]
+
+    def test_warm_run_starts_ipop_only(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            exp = self.experiment("--pool")
+            exp.configure()
+            exp.warm_pool()
+            self.assertEqual(exp.state.select([1, 2, 3], (state.WARM,)), [1, 2, 3])
+            os.remove(self.log)
+            exp = self.experiment("--pool", "--run")
+            exp.run()
+        self.assertEqual(self.calls("run"), [])
+        for inst in (1, 2, 3):
+            starts = [call for call in self.calls("exec")
+                      if call[-4:] == ["ipop-dkr{0:03}".format(inst), "systemctl", "start",
+                                       "ipop"]]
+            self.assertEqual(len(starts), 1, inst)
+        self.assertEqual(exp.state.select([1, 2, 3], (state.IPOP_ACTIVE,)), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import os
+import shutil
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transport import EngineApiTransport, split_image # pylint: disable=wrong-import-position
+
+
+def frame(stream, data):
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+class StubApi(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Answers the Engine API calls the transport makes from canned state: execs report the
+    exit codes queued for them, one inspect call at a time, and the image exists once pulled. """
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, StubHandler)
+        self.connections = 0
+        self.requests = []
+        self.exec_states = []
+        self.image = False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+    def reply(self, status, body):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self.server.requests.append(("GET", self.path))
+        if self.path.endswith("/json") and "/exec/" in self.path:
+            running, code = self.server.exec_states.pop(0)
+            self.reply(200, {"Running": running, "ExitCode": code})
+        else:
+            self.reply(404, {"message": "not found"})
+
+    def do_POST(self): # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append(("POST", self.path))
+        path = self.path.partition("?")[0]
+        if path.endswith("/exec") and "/containers/" in path:
+            self.reply(201, {"Id": "e1"})
+        elif path.endswith("/exec/e1/start"):
+            self.reply(200, frame(1, b"out\n") + frame(2, b"err\n") + frame(1, b"more\n"))
+        elif path.endswith("/images/create"):
+            self.server.image = True
+            self.reply(200, b'{"status":"Pulling"}\r\n{"status":"Done"}\r\n')
+        elif path.endswith("/containers/create"):
+            if not self.server.image:
+                self.reply(404, {"message": "No such image: img:1"})
+            else:
+                self.reply(201, {"Id": "c1"})
+        elif path.endswith("/containers/c1/start"):
+            self.reply(204, b"")
+        elif path.endswith("/kill"):
+            time.sleep(0.2)
+            if "missing" in path:
+                self.reply(404, {"message": "No such container"})
+            else:
+                self.reply(204, b"")
+        else:
+            self.reply(404, {"message": "not found"})
+
+
+class EngineApiTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="bfexp-test-")
+        self.server = StubApi(os.path.join(self.root, "docker.sock"))
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.api = EngineApiTransport(self.server.server_address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_demux(self):
+        data = frame(1, b"a") + frame(2, b"bc") + frame(1, b"d") + b"\x01\x00\x00"
+        self.assertEqual(EngineApiTransport.demux(data), (b"ad", b"bc"))
+        self.assertEqual(EngineApiTransport.demux(b""), (b"", b""))
+
+    def test_exec_exit_code(self):
+        self.server.exec_states = [(False, 3)]
+        resp = self.api.exec("ipop-dkr001", ["false"])
+        self.assertEqual(resp.returncode, 3)
+        self.assertEqual((resp.stdout, resp.stderr), (b"out\nmore\n", b"err\n"))
+
+    def test_exec_waits_until_not_running(self):
+        self.server.exec_states = [(True, None), (True, None), (False, 0)]
+        self.assertEqual(self.api.exec("ipop-dkr001", ["true"]).returncode, 0)
+        self.assertEqual(self.server.exec_states, [])
+
+    def test_exec_unknown_exit_code_fails(self):
+        self.server.exec_states = [(False, None)]
+        self.assertNotEqual(self.api.exec("ipop-dkr001", ["true"]).returncode, 0)
+
+    def test_connections_are_reused(self):
+        self.server.exec_states = [(False, 0)] * 5
+        for _ in range(5):
+            self.assertEqual(self.api.exec("ipop-dkr001", ["true"]).returncode, 0)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_run_pulls_missing_image(self):
+        resp = self.api.run("ipop-dkr001", "img:1", "/sbin/init")
+        self.assertEqual(resp.returncode, 0, resp.stderr)
+        self.assertEqual([path.partition("?")[0] for _, path in self.server.requests],
+                         ["/v1.39/containers/create", "/v1.39/images/create",
+                          "/v1.39/containers/create", "/v1.39/containers/c1/start"])
+
+    def test_pull_keeps_registry_port(self):
+        self.assertEqual(self.api.pull("registry:5000/img:2").returncode, 0)
+        params = parse_qs(urlparse(self.server.requests[-1][1]).query)
+        self.assertEqual((params["fromImage"], params["tag"]), (["registry:5000/img"], ["2"]))
+
+    def test_split_image(self):
+        self.assertEqual(split_image("img"), ("img", "latest"))
+        self.assertEqual(split_image("kcratie/bounded-flood:0.2"), ("kcratie/bounded-flood", "0.2"))
+        self.assertEqual(split_image("registry:5000/img"), ("registry:5000/img", "latest"))
+        self.assertEqual(split_image("registry:5000/img:2"), ("registry:5000/img", "2"))
+        self.assertEqual(split_image("img@sha256:ab"), ("img@sha256:ab", None))
+
+    def test_kill_is_concurrent(self):
+        names = ["ipop-dkr{0:03}".format(inst) for inst in range(8)] + ["missing"]
+        started = time.monotonic()
+        resp = self.api.kill(names, "SIGTERM")
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(resp.returncode, 1)
+        self.assertEqual(resp.stdout.decode().split(), names[:-1])
+        self.assertTrue(resp.stderr.decode().startswith("missing: "))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import os
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+_cpu_time = getattr(time, "thread_time", time.process_time)
+_INSTANCE = re.compile(r"ipop-dkr(\d+)")
+
+SpanRecord = namedtuple("SpanRecord", ["name", "cat", "start", "wall", "cpu", "tid", "args"])
+
+
+class _NoopSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Span():
+    __slots__ = ("tracer", "name", "cat", "args", "start", "cpu")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu = _cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tbk):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.events.append(SpanRecord(self.name, self.cat, self.start, end - self.start,
+                                             _cpu_time() - self.cpu, threading.get_ident(),
+                                             self.args))
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Tracer():
+    """ Records completed spans into a bounded in-memory ring buffer. Spans nest by time on each
+    thread, which is how the Chrome trace viewer reconstructs the call tree. When disabled
+    span() returns a shared no-op object so instrumented code pays only a method call. """
+    BUFFER_SZ = 1 << 20
+
+    def __init__(self, size=BUFFER_SZ):
+        self.enabled = False
+        self.events = deque(maxlen=size)
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        self.events.clear()
+        self.origin = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, cat="", **args):
+        if not self.enabled:
+            return NOOP_SPAN
+        return _Span(self, name, cat, args)
+
+    def export_chrome(self, path):
+        pid = os.getpid()
+        events = [{"name": rec.name, "cat": rec.cat, "ph": "X", "pid": pid, "tid": rec.tid,
+                   "ts": (rec.start - self.origin) * 1e6, "dur": rec.wall * 1e6,
+                   "args": dict(rec.args, cpu_ms=rec.cpu * 1e3)}
+                  for rec in list(self.events)]
+        with open(path, "w") as tfl:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, tfl)
+
+    def summary(self):
+        """ A table of count, total/max wall time and total CPU time per (category, name), phase
+        spans first. """
+        stats = {}
+        for rec in list(self.events):
+            count, wall, cpu, peak = stats.get((rec.cat, rec.name), (0, 0.0, 0.0, 0.0))
+            stats[(rec.cat, rec.name)] = (count + 1, wall + rec.wall, cpu + rec.cpu,
+                                          max(peak, rec.wall))
+        lines = ["{0:<10} {1:<24} {2:>7} {3:>10} {4:>10} {5:>10}".format(
+            "category", "span", "count", "wall(s)", "max(s)", "cpu(s)")]
+        for (cat, name), (count, wall, cpu, peak) in sorted(
+                stats.items(), key=lambda item: (item[0][0] != "phase", item[0][0],
+                                                 -item[1][1])):
+            lines.append("{0:<10} {1:<24} {2:>7} {3:>10.3f} {4:>10.3f} {5:>10.3f}".format(
+                cat, name, count, wall, peak, cpu))
+        return "\n".join(lines)
+
+
+TRACER = Tracer()
+
+
+def span(name, cat="", **args):
+    return TRACER.span(name, cat, **args)
+
+
+def cmd_span(cat, name, cmd):
+    """ A span for an external command or API call, tagged with the instance it targets. """
+    if not TRACER.enabled:
+        return NOOP_SPAN
+    text = " ".join(str(arg) for arg in cmd)
+    args = {"cmd": text}
+    match = _INSTANCE.search(text)
+    if match:
+        args["instance"] = int(match.group(1))
+    return _Span(TRACER, name, cat, args)
@@ -0,0 +1,183 @@
+# pylint: disable=missing-docstring
+import os
+import random
+from array import array
+
+from lurunner import Case
+
+PATTERNS = ("uniform", "permutation", "hotspot", "ring")
+HOT_FRACTION = 0.5
+
+
+def parse_pattern(spec):
+    """ Parses PATTERN[=PARAMS]; hotspot takes HOT[/FRACTION], the number of hot nodes and the
+    fraction of each source's cases sent to them. Returns (pattern, params). """
+    name, _, value = spec.partition("=")
+    if name not in PATTERNS:
+        raise ValueError("Unknown traffic pattern {0}, one of {1}".format(name,
+                                                                         ", ".join(PATTERNS)))
+    params = {}
+    if name == "hotspot" and value:
+        hot, _, fraction = value.partition("/")
+        try:
+            params["hot"] = int(hot)
+            if fraction:
+                params["fraction"] = float(fraction)
+        except ValueError:
+            raise ValueError("Invalid hotspot parameters {0}, expected HOT[/FRACTION]"
+                             .format(value))
+    return name, params
+
+
+def case_file(out_dir, host):
+    """ The path of the case file written for a host. """
+    return os.path.join(out_dir, "{0}-cases".format(host))
+
+
+def _sample_others(rnd, size, skip, count):
+    """ count distinct indices of [0, size) other than skip, which may be None. """
+    if skip is None:
+        return rnd.sample(range(size), count)
+    return [idx + 1 if idx >= skip else idx for idx in rnd.sample(range(size - 1), count)]
+
+
+class TrafficMatrix():
+    """ Generates link utilization cases over the nodes of a range, addressed by the overlay
+    address of each node and split by the host running it. Every node sources the same number
+    of cases, give or take one, and the odd cases are dealt to the hosts in turn so that the
+    load of a host follows its share of the nodes. Destinations are picked per pattern:
+      uniform       distinct random destinations
+      permutation   rounds of a random cyclic order, each node sending to the node k places
+                    ahead in round k, so that every node also receives its share
+      hotspot       a fraction of each node's cases go to a few hot nodes, the rest uniform
+      ring          the nearest ring neighbours, alternating successor and predecessor
+    The cost grows with the number of cases and nodes, not with the size of the pair space. """
+
+    def __init__(self, nodes, addresses, layout, seed):
+        """ nodes lists the node numbers, in ring order, and addresses their overlay address;
+        layout is a list of (host name, first node, end node) shards covering the nodes. """
+        self.nodes = list(nodes)
+        self.addresses = list(addresses)
+        self.layout = list(layout)
+        self.seed = seed
+        self.srcs = array("I")
+        self.dsts = array("I")
+
+    def host_of(self, node):
+        for host, start, end in self.layout:
+            if start <= node < end:
+                return host
+        return None
+
+    def quotas(self, rnd, count):
+        size = len(self.nodes)
+        quotas = [count // size] * size
+        shards = [[idx for idx, node in enumerate(self.nodes) if start <= node < end]
+                  for _, start, end in self.layout]
+        for shard in shards:
+            rnd.shuffle(shard)
+        dealt = [shard[pos] for pos in range(max(len(shard) for shard in shards))
+                 for shard in shards if pos < len(shard)]
+        for idx in dealt[:count % size]:
+            quotas[idx] += 1
+        return quotas
+
+    def _uniform(self, rnd, quotas):
+        size = len(self.nodes)
+        return [_sample_others(rnd, size, src, quota) for src, quota in enumerate(quotas)]
+
+    def _permutation(self, rnd, quotas):
+        size = len(self.nodes)
+        order = list(range(size))
+        rnd.shuffle(order)
+        shifts = rnd.sample(range(1, size), max(quotas))
+        return [[order[(pos + shift) % size] for shift in shifts[:quotas[src]]]
+                for pos, src in sorted(enumerate(order), key=lambda item: item[1])]
+
+    def _ring(self, rnd, quotas): # pylint: disable=unused-argument
+        size = len(self.nodes)
+        offsets, seen = [], set()
+        for step in range(1, size):
+            offset = (step + 1) // 2 * (1 if step % 2 else -1) % size
+            if offset not in seen:
+                seen.add(offset)
+                offsets.append(offset)
+        return [[(src + offset) % size for offset in offsets[:quota]]
+                for src, quota in enumerate(quotas)]
+
+    def _hotspot(self, rnd, quotas, hot=None, fraction=HOT_FRACTION):
+        size = len(self.nodes)
+        hot = min(size, max(1, hot if hot is not None else size // 100))
+        hot_set = set(rnd.sample(range(size), hot))
+        hot_nodes = sorted(hot_set)
+        cold_nodes = [idx for idx in range(size) if idx not in hot_set]
+        cold_pos = {idx: pos for pos, idx in enumerate(cold_nodes)}
+        hot_pos = {idx: pos for pos, idx in enumerate(hot_nodes)}
+        dsts = []
+        for src, quota in enumerate(quotas):
+            num_hot = len(hot_nodes) - (src in hot_set)
+            num_cold = len(cold_nodes) - (src in cold_pos)
+            to_hot = min(int(round(quota * fraction)), num_hot)
+            to_hot = max(to_hot, quota - num_cold)
+            picks = [hot_nodes[pos] for pos in _sample_others(rnd, len(hot_nodes),
+                                                              hot_pos.get(src), to_hot)]
+            picks += [cold_nodes[pos] for pos in _sample_others(rnd, len(cold_nodes),
+                                                               cold_pos.get(src),
+                                                               quota - to_hot)]
+            rnd.shuffle(picks)
+            dsts.append(picks)
+        return dsts
+
+    def generate(self, pattern, count, **params):
+        """ Generates count distinct (src, dst) cases. They are ordered by rank, the first case
+        of every source then the second, so the sources of consecutive cases differ. """
+        size = len(self.nodes)
+        if count > size * (size - 1):
+            raise ValueError("Cannot draw {0} distinct pairs from {1} nodes".format(count, size))
+        rnd = random.Random(self.seed)
+        quotas = self.quotas(rnd, count)
+        per_src = getattr(self, "_" + pattern)(rnd, quotas, **params)
+        order = list(range(size))
+        rnd.shuffle(order)
+        self.srcs = array("I")
+        self.dsts = array("I")
+        for rank in range(max(quotas)):
+            for src in order:
+                if rank < quotas[src]:
+                    self.srcs.append(src)
+                    self.dsts.append(per_src[src][rank])
+        return self.srcs, self.dsts
+
+    def host_cases(self):
+        """ Returns {host name: [Case]} with the cases each host sources. """
+        cases = {host: [] for host, _, _ in self.layout}
+        hosts = [self.host_of(node) for node in self.nodes]
+        for src, dst in zip(self.srcs, self.dsts):
+            cases[hosts[src]].append(Case(self.nodes[src], self.addresses[src],
+                                          self.addresses[dst]))
+        return cases
+
+    def write(self, out_dir):
+        """ Writes a "<host>-cases" file per host for lu.sh rhi and --cases, and returns their
+        paths. """
+        paths = {}
+        for host, cases in self.host_cases().items():
+            paths[host] = case_file(out_dir, host)
+            with open(paths[host], "w") as fle:
+                fle.write("".join("{0:0>3d} {1} {2}\n".format(*case) for case in cases))
+        return paths
+
+    def summary(self):
+        size = len(self.nodes)
+        sent, received = [0] * size, [0] * size
+        for src, dst in zip(self.srcs, self.dsts):
+            sent[src] += 1
+            received[dst] += 1
+        per_host = {host: 0 for host, _, _ in self.layout}
+        for idx, node in enumerate(self.nodes):
+            per_host[self.host_of(node)] += sent[idx]
+        return ("{0} case(s) over {1} node(s), seed {2}; sent per node {3}-{4}, received per "
+                "node {5}-{6}; per host {7}".format(
+                    len(self.srcs), size, self.seed, min(sent), max(sent), min(received),
+                    max(received), ", ".join("{0} {1}".format(host, num)
+                                             for host, num in per_host.items())))
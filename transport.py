@@ -0,0 +1,385 @@
+# pylint: disable=missing-docstring
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import http.client
+import os
+import queue
+import socket
+import struct
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+from tracing import cmd_span
+
+_IDS = re.compile(r"/(?:[0-9a-f]{12,}|ipop-dkr\d+)")
+
+
+def split_image(image):
+    """ Splits an image reference into its repository and tag, None for a digest reference. A
+    registry port, as in registry:5000/img, stays in the repository. """
+    if "@" in image:
+        return image, None
+    repo, sep, tag = image.rpartition(":")
+    if not sep or "/" in tag:
+        return image, "latest"
+    return repo, tag
+
+
+class CliTransport():
+    """ Container operations performed by forking the docker CLI. """
+
+    def __init__(self, docker):
+        self.docker = docker
+
+    def _run(self, cmd, timeout=None):
+        if cmd[0] is None:
+            raise ValueError("No executable specified to run")
+        with cmd_span("docker", "docker " + cmd[1], cmd) as spn:
+            resp = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  timeout=timeout)
+            spn.set(rc=resp.returncode)
+        return resp
+
+    def run(self, name, image, cmd, binds=(), network=None, privileged=False, auto_remove=False):
+        cmd_list = [self.docker, "run", "-d"]
+        for bind in binds:
+            cmd_list += ["-v", bind]
+        if auto_remove:
+            cmd_list.append("--rm")
+        if privileged:
+            cmd_list.append("--privileged")
+        cmd_list += ["--name", name]
+        if network:
+            cmd_list += ["--network", network]
+        cmd_list += [image, cmd]
+        return self._run(cmd_list)
+
+    def exec(self, container, cmd, timeout=None):
+        return self._run([self.docker, "exec", container] + list(cmd), timeout)
+
+    def kill(self, containers, signal=None):
+        cmd = [self.docker, "kill"]
+        if signal:
+            cmd += ["--signal", signal]
+        return self._run(cmd + list(containers))
+
+    def running(self, container):
+        resp = self._run([self.docker, "inspect", "-f", "{{.State.Running}}", container])
+        return resp.returncode == 0 and resp.stdout.strip() == b"true"
+
+    def pull(self, image):
+        return self._run([self.docker, "pull", image])
+
+    def ensure_network(self, name):
+        resp = self._run([self.docker, "network", "inspect", name])
+        if resp.returncode == 0:
+            return resp
+        return self._run([self.docker, "network", "create", name])
+
+    def remove_network(self, name):
+        return self._run([self.docker, "network", "rm", name])
+
+    def list_running(self, prefix):
+        """ Returns the names of the running containers whose name contains prefix, or None if
+        the runtime could not be queried. """
+        resp = self._run([self.docker, "ps", "--filter", "name={0}".format(prefix), "--format",
+                          "{{.Names}}"])
+        if resp.returncode != 0:
+            return None
+        return set(resp.stdout.decode("utf-8").split())
+
+    def pids(self, containers):
+        """ Maps the running containers among the given ones to their init pid. """
+        if not containers:
+            return {}
+        resp = self._run([self.docker, "inspect", "-f", "{{.Name}} {{.State.Pid}}"] +
+                         list(containers))
+        pids = {}
+        for line in resp.stdout.decode("utf-8").splitlines():
+            name, _, pid = line.strip().partition(" ")
+            if pid.isdigit() and int(pid) > 0:
+                pids[name.lstrip("/")] = int(pid)
+        return pids
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__("{0} {1}".format(status, message))
+        self.status = status
+        self.message = message
+
+
+class EngineApiTransport():
+    """ Container operations performed over HTTP against the Docker Engine API on its unix
+    socket. Idle keep-alive connections are kept in a pool and reused across calls and threads.
+    Every operation returns a CompletedProcess so callers are agnostic of the transport. """
+    SOCKET = "/var/run/docker.sock"
+    API_VERSION = "v1.39"
+    POOL_SZ = 64
+    # how long an exec whose output has ended may still report itself running
+    EXEC_SETTLE = 5.0
+
+    def __init__(self, socket_path=SOCKET, pool_size=POOL_SZ, api_version=API_VERSION):
+        self.socket_path = socket_path
+        self.prefix = "/{0}".format(api_version) if api_version else ""
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self, timeout):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = UnixHTTPConnection(self.socket_path)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _release(self, conn, resp):
+        if resp.will_close:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, body=None, params=None, timeout=None):
+        url = self.prefix + path
+        if params:
+            url += "?" + urlencode(params)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        conn = self._acquire(timeout)
+        try:
+            with cmd_span("api", method + " " + _IDS.sub("/{id}", path), [method, url]) as spn:
+                conn.request(method, url, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                spn.set(status=resp.status)
+        except socket.timeout:
+            conn.close()
+            raise subprocess.TimeoutExpired([method, url], timeout)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        self._release(conn, resp)
+        if resp.status >= 400:
+            try:
+                message = json.loads(data.decode("utf-8")).get("message", "")
+            except ValueError:
+                message = data.decode("utf-8", "replace")
+            raise ApiError(resp.status, message)
+        return data
+
+    def ping(self):
+        try:
+            return self.request("GET", "/_ping", timeout=2) == b"OK"
+        except (OSError, http.client.HTTPException, ApiError, subprocess.TimeoutExpired):
+            return False
+
+    @staticmethod
+    def _completed(args, err=None, stdout=b"", returncode=0):
+        if err is not None:
+            return subprocess.CompletedProcess(args, 1, b"", (str(err) + "\n").encode("utf-8"))
+        return subprocess.CompletedProcess(args, returncode, stdout, b"")
+
+    @staticmethod
+    def demux(data):
+        """ Splits a multiplexed attach stream into its stdout and stderr bytes. """
+        out, err = [], []
+        pos = 0
+        while pos + 8 <= len(data):
+            stream, size = struct.unpack(">BxxxL", data[pos:pos + 8])
+            (err if stream == 2 else out).append(data[pos + 8:pos + 8 + size])
+            pos += 8 + size
+        return b"".join(out), b"".join(err)
+
+    def run(self, name, image, cmd, binds=(), network=None, privileged=False, auto_remove=False):
+        args = ["create", name]
+        spec = {"Image": image, "Cmd": [cmd],
+                "HostConfig": {"Binds": list(binds), "Privileged": privileged,
+                               "AutoRemove": auto_remove}}
+        if network:
+            spec["HostConfig"]["NetworkMode"] = network
+        try:
+            try:
+                created = self.request("POST", "/containers/create", spec, params={"name": name})
+            except ApiError as err:
+                # docker run pulls a missing image, the create endpoint does not
+                if err.status != 404 or "no such image" not in err.message.lower():
+                    raise
+                pulled = self.pull(image)
+                if pulled.returncode != 0:
+                    return subprocess.CompletedProcess(args, 1, b"", pulled.stderr)
+                created = self.request("POST", "/containers/create", spec, params={"name": name})
+            created = json.loads(created.decode("utf-8"))
+            self.request("POST", "/containers/{0}/start".format(created["Id"]))
+        except (OSError, http.client.HTTPException, ApiError) as err:
+            return self._completed(args, err)
+        return self._completed(args, stdout=(created["Id"] + "\n").encode("utf-8"))
+
+    def exec(self, container, cmd, timeout=None):
+        args = ["exec", container] + list(cmd)
+        spec = {"AttachStdout": True, "AttachStderr": True, "Cmd": list(cmd)}
+        try:
+            exec_id = json.loads(self.request(
+                "POST", "/containers/{0}/exec".format(quote(container)), spec,
+                timeout=timeout).decode("utf-8"))["Id"]
+            data = self.request("POST", "/exec/{0}/start".format(exec_id),
+                                {"Detach": False, "Tty": False}, timeout=timeout)
+            exit_code = self.exit_code(exec_id, timeout)
+        except (OSError, http.client.HTTPException, ApiError) as err:
+            return self._completed(args, err)
+        stdout, stderr = self.demux(data)
+        if exit_code is None:
+            return subprocess.CompletedProcess(args, 1, stdout,
+                                               stderr + b"exec exit code not reported\n")
+        return subprocess.CompletedProcess(args, exit_code, stdout, stderr)
+
+    def exit_code(self, exec_id, timeout=None):
+        """ Polls the exec until it is no longer running and returns its exit code, or None if
+        it still runs or reports none when the wait is over. """
+        deadline = time.monotonic() + (EngineApiTransport.EXEC_SETTLE if timeout is None
+                                       else min(timeout, EngineApiTransport.EXEC_SETTLE))
+        delay = 0.005
+        while True:
+            state = json.loads(self.request("GET", "/exec/{0}/json".format(exec_id),
+                                            timeout=timeout).decode("utf-8"))
+            if not state.get("Running"):
+                return state.get("ExitCode")
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    def _kill_one(self, container, signal):
+        try:
+            self.request("POST", "/containers/{0}/kill".format(quote(container)),
+                         params={"signal": signal} if signal else None)
+        except (OSError, http.client.HTTPException, ApiError) as err:
+            return "{0}: {1}".format(container, err)
+        return None
+
+    def kill(self, containers, signal=None):
+        """ Sends the kill requests concurrently, over up to a pool's worth of connections. """
+        containers = list(containers)
+        args = ["kill"] + containers
+        killed, errors = [], []
+        if containers:
+            workers = min(len(containers), self._idle.maxsize or len(containers))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                outcomes = list(pool.map(lambda ctr: self._kill_one(ctr, signal), containers))
+            for container, error in zip(containers, outcomes):
+                if error:
+                    errors.append(error)
+                else:
+                    killed.append(container)
+        return subprocess.CompletedProcess(args, 1 if errors else 0,
+                                           "".join(c + "\n" for c in killed).encode("utf-8"),
+                                           "".join(e + "\n" for e in errors).encode("utf-8"))
+
+    def inspect(self, container):
+        return json.loads(self.request("GET", "/containers/{0}/json".format(quote(container)))
+                          .decode("utf-8"))
+
+    def running(self, container):
+        try:
+            return bool(self.inspect(container)["State"]["Running"])
+        except (OSError, http.client.HTTPException, ApiError, KeyError):
+            return False
+
+    def ensure_network(self, name):
+        args = ["network", "create", name]
+        try:
+            self.request("GET", "/networks/{0}".format(quote(name)))
+            return self._completed(args)
+        except ApiError as err:
+            if err.status != 404:
+                return self._completed(args, err)
+        except (OSError, http.client.HTTPException) as err:
+            return self._completed(args, err)
+        try:
+            data = self.request("POST", "/networks/create", {"Name": name, "CheckDuplicate": True})
+        except (OSError, http.client.HTTPException, ApiError) as err:
+            return self._completed(args, err)
+        return self._completed(args, stdout=data)
+
+    def remove_network(self, name):
+        args = ["network", "rm", name]
+        try:
+            self.request("DELETE", "/networks/{0}".format(quote(name)))
+        except (OSError, http.client.HTTPException, ApiError) as err:
+            return self._completed(args, err)
+        return self._completed(args, stdout=(name + "\n").encode("utf-8"))
+
+    def list_running(self, prefix):
+        try:
+            data = self.request("GET", "/containers/json",
+                                params={"filters": json.dumps({"name": [prefix]})})
+        except (OSError, http.client.HTTPException, ApiError, subprocess.TimeoutExpired):
+            return None
+        return set(name.lstrip("/") for ctr in json.loads(data.decode("utf-8"))
+                   for name in ctr.get("Names", []))
+
+    def pids(self, containers):
+        pids = {}
+        for container in containers:
+            try:
+                pid = self.inspect(container)["State"]["Pid"]
+            except (OSError, http.client.HTTPException, ApiError, KeyError):
+                continue
+            if pid:
+                pids[container] = pid
+        return pids
+
+    def pull(self, image):
+        repo, tag = split_image(image)
+        params = {"fromImage": repo}
+        if tag:
+            params["tag"] = tag
+        try:
+            data = self.request("POST", "/images/create", params=params)
+        except (OSError, http.client.HTTPException, ApiError) as err:
+            return self._completed(["pull", image], err)
+        # the progress stream reports a failed pull with an error message and a 200 status
+        for line in data.decode("utf-8", "replace").splitlines():
+            try:
+                error = json.loads(line).get("error")
+            except (ValueError, AttributeError):
+                continue
+            if error:
+                return self._completed(["pull", image], error)
+        return self._completed(["pull", image], stdout=data)
+
+
+def make_transport(kind, docker, socket_path=None):
+    """ kind is one of api, cli or auto; auto uses the Engine API when its socket answers and
+    falls back to the docker CLI otherwise. The socket defaults to a unix:// DOCKER_HOST. """
+    if socket_path is None:
+        host = os.environ.get("DOCKER_HOST", "")
+        socket_path = host[7:] if host.startswith("unix://") else EngineApiTransport.SOCKET
+    if kind == "cli":
+        return CliTransport(docker)
+    api = EngineApiTransport(socket_path)
+    if kind == "api" or (os.path.exists(socket_path) and api.ping()):
+        return api
+    return CliTransport(docker)